@@ -0,0 +1,37 @@
+import logging
+import azure.functions as func
+import sys
+import os
+
+# Add the parent directory to sys.path to allow imports from Shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Shared import config
+from Shared import db_manager
+from Shared import retention
+
+def main(timer: func.TimerRequest) -> None:
+    """
+    Nightly purge of AccessLogs rows older than AccessLogRetentionDays (off when unset or 0).
+    """
+    days = config.env_int("AccessLogRetentionDays", 0)
+    if days <= 0:
+        logging.info("AccessLogRetentionDays is not set; skipping retention.")
+        return
+
+    conn = db_manager.get_connection()
+    discard = False
+    try:
+        retention.purge_expired(
+            conn,
+            days,
+            batch_size=config.env_int("AccessLogRetentionBatchSize", retention.DEFAULT_BATCH_SIZE),
+            pause=config.env_float("AccessLogRetentionPause", 0.05),
+            max_batches=config.env_int("AccessLogRetentionMaxBatches", 0) or None,
+        )
+    except Exception as e:
+        discard = True
+        logging.error(f"AccessLogs retention failed: {e}")
+        raise
+    finally:
+        db_manager.release_connection(conn, discard=discard)
@@ -0,0 +1,26 @@
+import logging
+import azure.functions as func
+import sys
+import os
+
+# Add the parent directory to sys.path to allow imports from Shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Shared import config
+from Shared import rollups
+
+def main(timer: func.TimerRequest) -> None:
+    """
+    Every 5 minutes: folds new AccessLogs rows into the hourly/daily rollups (opt-in via AccessLogRollups).
+    """
+    if not config.env_flag("AccessLogRollups"):
+        return
+    try:
+        rollups.run(
+            batch_rows=config.env_int("AccessLogRollupBatchRows", rollups.DEFAULT_BATCH_ROWS),
+            max_batches=config.env_int("AccessLogRollupMaxBatches", 0) or None,
+            lag=config.env_int("AccessLogRollupLagSeconds", rollups.DEFAULT_LAG_SECONDS),
+        )
+    except Exception as e:
+        logging.error(f"AccessLogs rollup failed: {e}")
+        raise
@@ -2,14 +2,70 @@ import logging
 import azure.functions as func
 import sys
 import os
+import time
+import uuid
+import datetime
+import json
+import tempfile
 
 # Add the parent directory to sys.path to allow imports from Shared
 # This is sometimes needed depending on how the Python worker handles paths
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from Shared import blob_manager
+from Shared import config
 from Shared import db_manager
+from Shared import metrics
+from Shared import profiling
+from Shared import spool
+
+# Timestamp is the request time (naive UTC, like GETDATE() on Azure SQL), not the time
+# a batched or spooled row happens to be written.
+ACCESS_LOG_INSERT = "INSERT INTO AccessLogs ([User], Timestamp) VALUES (?, ?)"
+
+# Write-behind replay is at-least-once: RequestId makes a replayed row a no-op.
+ACCESS_LOG_SPOOL_INSERT = (
+    "INSERT INTO AccessLogs ([User], Timestamp, RequestId) SELECT ?, ?, ? "
+    "WHERE NOT EXISTS (SELECT 1 FROM AccessLogs WHERE RequestId = ?)"
+)
+
+ACCESS_LOG_BLOB = "accesslogs/%Y-%m-%d/%H.log"
+
+def _access_log_drainer():
+    return spool.get_spool_drainer(ACCESS_LOG_SPOOL_INSERT, "accesslogs-spool")
+
+if config.env_flag("AccessLogWriteBehind"):
+    # Start draining rows left over from a previous run right away.
+    _access_log_drainer()
+
+REQUEST_LATENCY = metrics.REGISTRY.histogram(
+    "http_request_duration_seconds", "Request latency by function and status.", ("function", "status"))
+
+# On-demand profiling: a ProfileSampleRate percentage of requests, or any request with
+# "X-Profile-Token: <ProfileToken>". Not installed at all unless configured.
+PROFILER = profiling.Profiler(
+    directory=os.environ.get("ProfileDirectory") or os.path.join(tempfile.gettempdir(), "profiles"),
+    sample_rate=config.env_float("ProfileSampleRate", 0.0),
+    token=os.environ.get("ProfileToken"),
+    mode=os.environ.get("ProfileMode", "sample"),
+    max_files=config.env_int("ProfileMaxFiles", 200),
+    interval=config.env_float("ProfileIntervalMs", 1.0) / 1000,
+) if os.environ.get("ProfileSampleRate") or os.environ.get("ProfileToken") else None
 
 def main(req: func.HttpRequest) -> func.HttpResponse:
+    started = time.perf_counter()
+    profile = PROFILER.begin("HttpTriggerTest", req.headers.get(profiling.TOKEN_HEADER)) if PROFILER else None
+    if profile is None:
+        response = _handle(req)
+    else:
+        with profile:
+            response = _handle(req)
+        response.headers[profiling.ID_HEADER] = profile.id
+        logging.info(f"Profiled request {profile.id}: {profile.path}")
+    REQUEST_LATENCY.observe(time.perf_counter() - started, function="HttpTriggerTest", status=response.status_code)
+    return response
+
+def _handle(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
     name = req.params.get('name')
@@ -23,17 +79,39 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
     if name:
         response_message = f"Hello, {name}."
+        timestamp = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None).isoformat(sep=" ", timespec="milliseconds")
         
         # --- Database Interaction Demo ---
         # logic: We want to store this interaction in the DB.
         try:
             # Note: This will fail if SqlConnectionString is not valid in local.settings.json
-            db_manager.execute_query("INSERT INTO AccessLogs ([User], Timestamp) VALUES (?, GETDATE())", [name])
-            response_message += " (DB interaction successful)"
+            if config.env_flag("AccessLogWriteBehind"):
+                # Opt-in: append to the local spool; the drainer replays it into AccessLogs.
+                request_id = uuid.uuid4().hex
+                drainer = _access_log_drainer()
+                drainer.spool.append([name, timestamp, request_id, request_id])
+                drainer.notify()
+                response_message += " (DB write spooled)"
+            elif config.env_flag("AccessLogBatching"):
+                # Opt-in: the insert is committed by the shared batch writer, off the request path.
+                db_manager.get_batch_writer(ACCESS_LOG_INSERT).submit([name, timestamp])
+                response_message += " (DB write queued)"
+            else:
+                db_manager.execute_query(ACCESS_LOG_INSERT, [name, timestamp])
+                response_message += " (DB interaction successful)"
         except Exception as e:
             logging.error(f"DB Error: {e}")
             # We don't fail the request for this demo, but we log the error
             response_message += f" (DB Error: {str(e)})"
+
+        # Opt-in: also append the access to an hourly append blob (batched, off the request path).
+        blob_container = os.environ.get("AccessLogBlobContainer")
+        if blob_container:
+            try:
+                blob_manager.get_append_writer(blob_container, ACCESS_LOG_BLOB).submit(
+                    json.dumps({"user": name, "timestamp": timestamp}))
+            except Exception as e:
+                logging.error(f"Blob append error: {e}")
         
         return func.HttpResponse(response_message)
     else:
@@ -0,0 +1,22 @@
+import azure.functions as func
+import sys
+import os
+
+# Add the parent directory to sys.path to allow imports from Shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing db_manager and spool registers the SQL pool, batch writer and spool gauges
+from Shared import db_manager
+from Shared import spool
+from Shared import metrics
+
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Prometheus text exposition of this worker's in-process metrics.
+    Note: each Functions worker process keeps its own registry.
+    """
+    return func.HttpResponse(
+        metrics.render(),
+        status_code=200,
+        headers={"Content-Type": metrics.CONTENT_TYPE}
+    )
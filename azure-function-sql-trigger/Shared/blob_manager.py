@@ -0,0 +1,381 @@
+import os
+import time
+import threading
+import atexit
+import logging
+from concurrent.futures import Future
+
+import requests
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError, ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+)
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient, ContentSettings
+
+from Shared import config
+from Shared import metrics
+
+MiB = 1024 * 1024
+
+# Append blobs accept blocks of at most 4 MiB and 50,000 blocks per blob.
+MAX_APPEND_BLOCK = 4 * MiB
+MAX_APPEND_BLOCKS = 50000
+
+
+def _connection_string():
+    conn_str = os.environ.get("BlobConnectionString") or os.environ.get("AzureWebJobsStorage")
+    if not conn_str:
+        logging.error("Neither BlobConnectionString nor AzureWebJobsStorage is set.")
+        raise ValueError("BlobConnectionString environment variable is not set.")
+    return conn_str
+
+
+def _client_options_from_env():
+    return {
+        "pool_size": config.env_int("BlobPoolMaxSize", 32),
+        "max_block_size": config.env_int("BlobBlockSize", 4 * MiB),
+        "max_single_put_size": config.env_int("BlobSinglePutSize", 8 * MiB),
+        "max_single_get_size": config.env_int("BlobSingleGetSize", 8 * MiB),
+        "max_chunk_get_size": config.env_int("BlobChunkGetSize", 4 * MiB),
+        "connection_timeout": config.env_float("BlobConnectTimeout", 10.0),
+        "read_timeout": config.env_float("BlobReadTimeout", 60.0),
+    }
+
+
+def _create_client(conn_str, pool_size, connection_timeout, read_timeout, **transfer_options):
+    # One keep-alive HTTP session for the whole process. Size its pool for
+    # concurrent invocations times max_concurrency, or extra sockets are opened and dropped.
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    transport = RequestsTransport(session=session, session_owner=False,
+                                  connection_timeout=connection_timeout, read_timeout=read_timeout)
+    return BlobServiceClient.from_connection_string(conn_str, transport=transport, **transfer_options)
+
+
+# Global client, shared across function invocations on the same worker
+_client = None
+_client_lock = threading.Lock()
+_containers = {}
+_containers_lock = threading.Lock()
+
+
+def configure_blob_client(client=None, connection_string=None, **options):
+    """
+    Replaces the global BlobServiceClient. Pass `client` to use an existing client
+    (e.g. an in-process fake in tests), or `connection_string` (e.g. Azurite's) to
+    build one. Remaining keyword arguments override the `Blob*` environment settings.
+    """
+    global _client
+    if client is None:
+        settings = _client_options_from_env()
+        settings.update(options)
+        client = _create_client(connection_string or _connection_string(), **settings)
+    with _client_lock:
+        _client = client
+    with _containers_lock:
+        _containers.clear()
+    return client
+
+
+def get_blob_service_client():
+    """
+    Returns the process-wide BlobServiceClient, creating it from
+    `BlobConnectionString` (or `AzureWebJobsStorage`) on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client(_connection_string(), **_client_options_from_env())
+    return _client
+
+
+def get_container_client(container, create=True):
+    """
+    Returns the cached ContainerClient for `container`. With `create`, the
+    container is created on first use (once per process, not per call).
+    """
+    container_client = _containers.get(container)
+    if container_client is None:
+        with _containers_lock:
+            container_client = _containers.get(container)
+            if container_client is None:
+                container_client = get_blob_service_client().get_container_client(container)
+                if create:
+                    try:
+                        with metrics.track_backend("blob_create_container"):
+                            container_client.create_container()
+                    except ResourceExistsError:
+                        pass
+                _containers[container] = container_client
+    return container_client
+
+
+def _max_concurrency(max_concurrency):
+    return max_concurrency or config.env_int("BlobMaxConcurrency", 4)
+
+
+def upload_blob(container, name, data, overwrite=True, content_type=None, max_concurrency=None):
+    """
+    Uploads `data` (bytes, str or a readable stream). Payloads above
+    `BlobSinglePutSize` are split into `BlobBlockSize` blocks that are uploaded
+    `max_concurrency` at a time and committed as one block list.
+    """
+    blob = get_container_client(container).get_blob_client(name)
+    kwargs = {"overwrite": overwrite, "max_concurrency": _max_concurrency(max_concurrency)}
+    if content_type:
+        kwargs["content_settings"] = ContentSettings(content_type=content_type)
+    with metrics.track_backend("blob_upload"):
+        return blob.upload_blob(data, **kwargs)
+
+
+def download_blob(container, name, max_concurrency=None):
+    """
+    Returns the blob's content as bytes. Blobs above `BlobSingleGetSize` are
+    fetched as `BlobChunkGetSize` ranges, `max_concurrency` at a time.
+    """
+    blob = get_container_client(container, create=False).get_blob_client(name)
+    with metrics.track_backend("blob_download"):
+        return blob.download_blob(max_concurrency=_max_concurrency(max_concurrency)).readall()
+
+
+def download_blob_to_stream(container, name, stream, max_concurrency=None):
+    """
+    Streams the blob into a writable, seekable file object with parallel ranged
+    reads (memory stays at about max_concurrency chunks). Returns the bytes written.
+    """
+    blob = get_container_client(container, create=False).get_blob_client(name)
+    with metrics.track_backend("blob_download"):
+        return blob.download_blob(max_concurrency=_max_concurrency(max_concurrency)).readinto(stream)
+
+
+class AppendBlobWriter:
+    """
+    Batching writer of log lines to append blobs.
+
+    `submit()` queues one line and returns a Future immediately; a background
+    thread joins queued lines into one `append_block` call (at most 4 MiB) once
+    `batch_bytes` are pending or the oldest line has waited `max_delay` seconds.
+    `blob_name` may contain strftime fields (e.g. "accesslogs/%Y-%m-%d/%H.log",
+    expanded in UTC) so blobs roll over before reaching the 50,000-block limit;
+    a blob that does reach it continues in "<name>.1", "<name>.2", ...
+    """
+
+    def __init__(self, container, blob_name, batch_bytes=MiB, max_delay=1.0, max_pending_bytes=64 * MiB):
+        self.container = container
+        self.blob_name = blob_name
+        self.batch_bytes = min(batch_bytes, MAX_APPEND_BLOCK)
+        self.max_delay = max_delay
+        self.max_pending_bytes = max(max_pending_bytes, self.batch_bytes)
+
+        self._cond = threading.Condition(threading.Lock())
+        self._pending = []       # list of (encoded line, Future)
+        self._pending_bytes = 0
+        self._oldest = None      # monotonic time of the oldest pending line
+        self._in_flight = 0      # batches taken but not yet appended
+        self._closed = False
+        self._overflow = {}      # blob name -> current ".N" suffix once the block limit is hit
+        self._stats = {"submitted": 0, "blocks": 0, "lines_written": 0, "line_errors": 0, "bytes_written": 0}
+
+        self._thread = threading.Thread(target=self._run, name="blob-append-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, line):
+        """
+        Queues one line (a newline is added if missing). Blocks only if
+        `max_pending_bytes` are already queued.
+        """
+        data = (line if line.endswith("\n") else line + "\n").encode("utf-8")
+        if len(data) > MAX_APPEND_BLOCK:
+            raise ValueError(f"Line of {len(data)} bytes exceeds the {MAX_APPEND_BLOCK}-byte append block limit.")
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("AppendBlobWriter is closed.")
+            while self._pending_bytes + len(data) > self.max_pending_bytes and self._pending:
+                self._cond.notify_all()
+                self._cond.wait()
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((data, future))
+            self._pending_bytes += len(data)
+            self._stats["submitted"] += 1
+            if len(self._pending) == 1 or self._pending_bytes >= self.batch_bytes:
+                # Wake the writer to start the delay timer or flush a full block.
+                self._cond.notify_all()
+        return future
+
+    def flush(self):
+        """
+        Appends everything queued so far and waits until it is written.
+        """
+        with self._cond:
+            batch = self._take_locked()
+        if batch:
+            self._write(batch)
+        with self._cond:
+            while self._in_flight:
+                self._cond.wait()
+
+    def close(self):
+        """
+        Stops the background thread after flushing all queued lines.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+            stats["pending_bytes"] = self._pending_bytes
+        return stats
+
+    def _take_locked(self):
+        # Take whole lines up to one append block; the rest stays queued.
+        taken = 0
+        size = 0
+        for data, _ in self._pending:
+            if taken and size + len(data) > MAX_APPEND_BLOCK:
+                break
+            size += len(data)
+            taken += 1
+        batch, self._pending = self._pending[:taken], self._pending[taken:]
+        self._pending_bytes -= size
+        self._oldest = time.monotonic() if self._pending else None
+        if batch:
+            self._in_flight += 1
+        self._cond.notify_all()
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._pending_bytes >= self.batch_bytes:
+                        break
+                    if self._pending:
+                        remaining = self._oldest + self.max_delay - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+                batch = self._take_locked()
+            self._write(batch)
+
+    def _current_blob(self):
+        name = time.strftime(self.blob_name, time.gmtime())
+        suffix = self._overflow.get(name)
+        return name, (f"{name}.{suffix}" if suffix else name)
+
+    def _append_block(self, name, data):
+        blob = get_container_client(self.container).get_blob_client(name)
+        try:
+            return blob.append_block(data)
+        except ResourceNotFoundError:
+            # First block of this blob (or the blob was deleted): create it, then retry.
+            # IfMissing keeps a concurrent worker's creation (and its blocks) intact.
+            try:
+                blob.create_append_blob(match_condition=MatchConditions.IfMissing)
+            except (ResourceExistsError, ResourceModifiedError):
+                pass
+            return blob.append_block(data)
+
+    def _append(self, data):
+        while True:
+            base, name = self._current_blob()
+            try:
+                result = self._append_block(name, data)
+            except HttpResponseError as e:
+                if e.error_code != "BlockCountExceedsLimit":
+                    raise
+                # Full blob (e.g. filled by an earlier process): continue in the next one.
+                self._overflow[base] = self._overflow.get(base, 0) + 1
+                continue
+            committed = (result or {}).get("blob_committed_block_count")
+            if committed is not None and committed >= MAX_APPEND_BLOCKS:
+                self._overflow[base] = self._overflow.get(base, 0) + 1
+            return
+
+    def _write(self, batch):
+        data = b"".join(line for line, _ in batch)
+        try:
+            with metrics.track_backend("blob_append"):
+                self._append(data)
+            error = None
+        except Exception as e:
+            logging.error(f"Append of {len(batch)} lines to blob failed: {e}")
+            error = e
+        with self._cond:
+            if error is None:
+                self._stats["blocks"] += 1
+                self._stats["lines_written"] += len(batch)
+                self._stats["bytes_written"] += len(data)
+            else:
+                self._stats["line_errors"] += len(batch)
+            self._in_flight -= 1
+            self._cond.notify_all()
+        for _, future in batch:
+            if error is None:
+                future.set_result(len(data))
+            else:
+                future.set_exception(error)
+
+
+# One writer per (container, blob name), shared by all invocations on this worker
+_append_writers = {}
+_append_writers_lock = threading.Lock()
+
+
+def get_append_writer(container, blob_name):
+    """
+    Returns the shared AppendBlobWriter for `container`/`blob_name`, configured
+    from `BlobAppendBatchBytes`, `BlobAppendMaxDelay` and `BlobAppendMaxPendingBytes`.
+    """
+    key = (container, blob_name)
+    writer = _append_writers.get(key)
+    if writer is None:
+        with _append_writers_lock:
+            writer = _append_writers.get(key)
+            if writer is None:
+                writer = AppendBlobWriter(
+                    container,
+                    blob_name,
+                    batch_bytes=config.env_int("BlobAppendBatchBytes", MiB),
+                    max_delay=config.env_float("BlobAppendMaxDelay", 1.0),
+                    max_pending_bytes=config.env_int("BlobAppendMaxPendingBytes", 64 * MiB),
+                )
+                _append_writers[key] = writer
+    return writer
+
+
+metrics.REGISTRY.gauge(
+    "blob_append_pending_bytes", "Bytes queued in append blob writers, by blob.", ("blob",),
+    callback=lambda: {(f"{container}/{name}",): writer.stats()["pending_bytes"]
+                      for (container, name), writer in list(_append_writers.items())})
+
+
+@atexit.register
+def close_append_writers():
+    """
+    Flushes and stops all append writers (runs automatically on interpreter shutdown).
+    """
+    with _append_writers_lock:
+        writers = list(_append_writers.values())
+        _append_writers.clear()
+    for writer in writers:
+        try:
+            writer.close()
+        except Exception as e:
+            logging.error(f"Failed to flush append writer on shutdown: {e}")
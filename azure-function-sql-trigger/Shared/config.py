@@ -0,0 +1,22 @@
+"""
+Typed access to app settings (environment variables), shared by the functions and
+Shared modules. Unset or empty settings fall back to the given default.
+"""
+import os
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def env_flag(name, default=False):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
@@ -1,17 +1,532 @@
 import os
-import pyodbc
+import time
+import random
+import threading
+import re
+import atexit
 import logging
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import pyodbc
 
-# Global variable to hold the connection
-_connection = None
+from Shared import config
+from Shared import metrics
 
-def get_connection():
+try:
+    import numpy
+except ImportError:  # Optional: only needed for result="arrays"
+    numpy = None
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection becomes available within the checkout timeout.
+    """
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of connecting while the circuit breaker is open.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"SQL circuit breaker is open; not connecting for another {retry_after:.1f}s.")
+        self.retry_after = retry_after
+
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+CIRCUIT_TRANSITIONS = metrics.REGISTRY.counter(
+    "sql_circuit_transitions_total", "SQL circuit breaker state changes, by new state.", ("state",))
+CONNECT_RETRIES = metrics.REGISTRY.counter(
+    "sql_connect_retries_total", "Connection attempts retried, or skipped because the retry budget was empty.",
+    ("outcome",))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for connection attempts.
+
+    Closed: attempts go through; `failure_threshold` consecutive failures open it.
+    Open: `before_call()` raises CircuitOpen immediately for `reset_timeout` seconds.
+    Half-open: up to `half_open_max_calls` trial attempts run; one success closes the
+    breaker, one failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self._stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        with self._lock:
+            if self._state == OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpen(remaining)
+                self._transition_locked(HALF_OPEN)
+            if self._state == HALF_OPEN:
+                if self._trials >= self.half_open_max_calls:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpen(0.0)
+                self._trials += 1
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state == HALF_OPEN:
+                self._transition_locked(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._stats["opened"] += 1
+                self._transition_locked(OPEN)
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"state": state, "consecutive_failures": self._failures})
+        return stats
+
+    def _transition_locked(self, state):
+        previous, self._state = self._state, state
+        self._trials = 0
+        CIRCUIT_TRANSITIONS.inc(state=state)
+        log = logging.warning if state != CLOSED else logging.info
+        log(f"SQL circuit breaker {previous} -> {state} (consecutive failures: {self._failures}).")
+
+
+class RetryBudget:
+    """
+    Token bucket that caps retries to a fraction of first attempts.
+
+    Every first attempt deposits `ratio` tokens and `min_per_second` tokens trickle
+    in over time (so a quiet worker can still retry); each retry spends one token.
+    During an outage the bucket drains and further failures are not retried.
+    """
+
+    def __init__(self, ratio=0.1, min_per_second=1.0, max_tokens=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+
+    def deposit(self):
+        with self._lock:
+            self._refill_locked()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            self._refill_locked()
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+
+# Statement cache counters, shared by all connections on this worker
+_statement_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_statement_stats_lock = threading.Lock()
+
+
+def _count_statement(event):
+    with _statement_stats_lock:
+        _statement_stats[event] += 1
+
+
+class StatementCache:
+    """
+    Per-connection LRU of cursors keyed by SQL text.
+
+    pyodbc only re-prepares a statement when a cursor executes different SQL than
+    last time, so keeping one cursor per hot statement skips the prepare/plan lookup
+    on every repeat. A cursor is taken out of the cache while in use and put back
+    afterwards, so it is never shared.
+    """
+
+    def __init__(self, conn, max_size=32):
+        self._conn = conn
+        self.max_size = max_size
+        self._cursors = OrderedDict()
+
+    def acquire(self, sql):
+        cursor = self._cursors.pop(sql, None)
+        if cursor is not None:
+            _count_statement("hits")
+            return cursor
+        _count_statement("misses")
+        return self._conn.cursor()
+
+    def release(self, sql, cursor):
+        if self.max_size <= 0 or sql in self._cursors:
+            cursor.close()
+            return
+        self._cursors[sql] = cursor
+        while len(self._cursors) > self.max_size:
+            _, evicted = self._cursors.popitem(last=False)
+            _count_statement("evictions")
+            evicted.close()
+
+    def close(self):
+        cursors, self._cursors = self._cursors, OrderedDict()
+        for cursor in cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+
+class _PooledConnection:
+    """
+    Bookkeeping wrapper around a raw DB-API connection owned by the pool.
     """
-    Gets a connection to the Azure SQL Database.
-    Retains the connection globally to reuse it across function invocations (connection pooling).
+    __slots__ = ("raw", "created_at", "last_used", "statements")
+
+    def __init__(self, raw, statement_cache_size=32):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used = now
+        self.statements = StatementCache(raw, statement_cache_size)
+
+
+class ConnectionPool:
     """
-    global _connection
-    
+    Bounded, thread-safe pool of DB-API connections.
+
+    `connect` is any zero-argument callable returning a connection (pyodbc in
+    production, sqlite3 locally). Idle connections are handed out most recently
+    used first, probed with `SELECT 1` if they have been idle longer than
+    `probe_after` seconds, evicted after `idle_timeout` seconds of inactivity
+    (never below `min_size`) and recycled once they are older than `max_lifetime`.
+
+    Opening a connection goes through a CircuitBreaker and is retried up to
+    `connect_retries` times with exponential backoff and full jitter, as long as the
+    shared RetryBudget allows it.
+    """
+
+    def __init__(self, connect, min_size=0, max_size=10, checkout_timeout=30.0,
+                 idle_timeout=300.0, max_lifetime=1800.0, probe_after=5.0,
+                 statement_cache_size=32, failure_threshold=5, reset_timeout=30.0,
+                 half_open_max_calls=1, connect_retries=2, retry_backoff=0.2,
+                 retry_backoff_max=5.0, retry_budget_ratio=0.1, retry_budget_min_per_second=1.0):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1.")
+        self._connect = connect
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.probe_after = probe_after
+        self.statement_cache_size = statement_cache_size
+        self.connect_retries = connect_retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout, half_open_max_calls)
+        self.retry_budget = RetryBudget(retry_budget_ratio, retry_budget_min_per_second)
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []          # stack of _PooledConnection, most recently used last
+        self._in_use = {}        # id(raw) -> _PooledConnection
+        self._size = 0           # idle + in use + connections being opened
+        self._closed = False
+
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "closed": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "connect_failures": 0,
+            "connect_retries": 0,
+        }
+
+    # --- Checkout / checkin ---
+
+    def checkout(self, timeout=None):
+        """
+        Returns a raw connection from the pool, opening a new one if the pool has room.
+        Blocks up to `timeout` seconds (default: `checkout_timeout`) when the pool is exhausted.
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        waited_since = None
+
+        while True:
+            pooled = None
+            must_open = False
+            expired = []
+            try:
+                with self._cond:
+                    if self._closed:
+                        raise RuntimeError("Connection pool is closed.")
+                    expired = self._collect_expired_locked()
+                    if expired:
+                        # Free their slots (closed in `finally`) before choosing between idle, open and wait.
+                        continue
+                    if self._idle:
+                        pooled = self._idle.pop()
+                    elif self._size < self.max_size:
+                        self._size += 1
+                        must_open = True
+                    else:
+                        if waited_since is None:
+                            waited_since = time.monotonic()
+                            self._stats["waits"] += 1
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats["timeouts"] += 1
+                            self._record_wait_locked(waited_since)
+                            raise PoolTimeout(f"Timed out after {timeout:.1f}s waiting for a SQL connection (max_size={self.max_size}).")
+                        self._cond.wait(remaining)
+            finally:
+                self._close_all(expired)
+
+            if must_open:
+                pooled = self._open()
+            elif pooled is not None and not self._is_healthy(pooled):
+                self._discard(pooled)
+                continue
+            elif pooled is None:
+                continue
+
+            pooled.last_used = time.monotonic()
+            with self._cond:
+                self._in_use[id(pooled.raw)] = pooled
+                self._stats["checkouts"] += 1
+                if waited_since is not None:
+                    self._record_wait_locked(waited_since)
+            return pooled.raw
+
+    def checkin(self, raw, discard=False):
+        """
+        Returns a connection to the pool. Broken connections (`discard=True`) and
+        connections past `max_lifetime` are closed instead of being reused.
+        """
+        with self._cond:
+            pooled = self._in_use.pop(id(raw), None)
+            if pooled is None:
+                logging.warning("Ignoring checkin of a connection that is not owned by the pool.")
+                return
+            now = time.monotonic()
+            if not (discard or self._closed or now - pooled.created_at > self.max_lifetime):
+                pooled.last_used = now
+                self._idle.append(pooled)
+                self._cond.notify()
+                return
+        self._discard(pooled)
+
+    def statement_cache(self, raw):
+        """
+        Returns the StatementCache of a connection currently checked out of this pool.
+        """
+        with self._cond:
+            return self._in_use[id(raw)].statements
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Context manager that checks a connection out and always returns it.
+        If the block raises and the connection cannot even be rolled back, it is discarded.
+        """
+        raw = self.checkout(timeout)
+        discard = False
+        try:
+            yield raw
+        except BaseException:
+            try:
+                raw.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.checkin(raw, discard=discard)
+
+    # --- Maintenance ---
+
+    def fill(self):
+        """
+        Opens connections until at least `min_size` exist (e.g. to pre-warm a worker).
+        """
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            pooled = self._open()
+            with self._cond:
+                self._idle.insert(0, pooled)
+                self._cond.notify()
+
+    def close(self):
+        """
+        Closes all idle connections; connections still in use are closed on checkin.
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            })
+        stats["circuit"] = self.breaker.stats()
+        return stats
+
+    # --- Internals ---
+
+    def _open(self):
+        try:
+            raw = self._connect_with_retries()
+        except Exception as e:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            logging.error(f"Failed to connect to SQL Database: {e}")
+            raise
+        with self._cond:
+            self._stats["created"] += 1
+        return _PooledConnection(raw, self.statement_cache_size)
+
+    def _connect_with_retries(self):
+        self.retry_budget.deposit()
+        last_error = None
+        for attempt in range(self.connect_retries + 1):
+            try:
+                self.breaker.before_call()
+            except CircuitOpen:
+                if last_error is not None:
+                    raise last_error
+                raise
+            try:
+                logging.info("Creating new SQL connection...")
+                with metrics.track_backend("connect"):
+                    raw = self._connect()
+            except Exception as e:
+                self.breaker.record_failure()
+                last_error = e
+                with self._cond:
+                    self._stats["connect_failures"] += 1
+                if attempt == self.connect_retries:
+                    raise
+                if not self.retry_budget.try_spend():
+                    CONNECT_RETRIES.inc(outcome="budget_exhausted")
+                    raise
+                CONNECT_RETRIES.inc(outcome="retried")
+                with self._cond:
+                    self._stats["connect_retries"] += 1
+                # Exponential backoff with full jitter.
+                time.sleep(random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** attempt)))
+                continue
+            self.breaker.record_success()
+            return raw
+
+    def _is_healthy(self, pooled):
+        now = time.monotonic()
+        if now - pooled.created_at > self.max_lifetime:
+            return False
+        if now - pooled.last_used < self.probe_after:
+            return True
+        try:
+            cursor = pooled.raw.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception as e:
+            logging.warning(f"Existing connection lost ({e}). Reconnecting...")
+            with self._cond:
+                self._stats["health_check_failures"] += 1
+            return False
+
+    def _collect_expired_locked(self):
+        # Oldest idle connections sit at the bottom of the stack.
+        now = time.monotonic()
+        expired = []
+        keep = []
+        removable = max(0, self._size - self.min_size)
+        for pooled in self._idle:
+            too_old = now - pooled.created_at > self.max_lifetime
+            too_idle = now - pooled.last_used > self.idle_timeout
+            if removable and (too_old or too_idle):
+                expired.append(pooled)
+                removable -= 1
+            else:
+                keep.append(pooled)
+        if expired:
+            self._idle = keep
+        return expired
+
+    def _close_all(self, pooled_connections):
+        for pooled in pooled_connections:
+            self._discard(pooled)
+
+    def _discard(self, pooled):
+        pooled.statements.close()
+        try:
+            pooled.raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats["closed"] += 1
+            self._cond.notify()
+
+    def _record_wait_locked(self, waited_since):
+        waited = time.monotonic() - waited_since
+        self._stats["wait_time"] += waited
+        self._stats["max_wait_time"] = max(self._stats["max_wait_time"], waited)
+
+
+# Global pool, shared across function invocations on the same worker
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _connection_string():
     conn_str = os.environ.get("SqlConnectionString")
     if not conn_str:
         logging.error("SqlConnectionString environment variable is not set.")
@@ -20,51 +535,530 @@ def get_connection():
     if "yourserver.database.windows.net" in conn_str:
         logging.error("SqlConnectionString is still set to the default placeholder. Please update local.settings.json with valid credentials.")
         raise ValueError("SqlConnectionString is set to default placeholder.")
+    return conn_str
 
-    # Check if connection is already established and active
-    if _connection:
-        try:
-            # Simple check to see if connection is alive (optional, but good practice)
-            # cursor = _connection.cursor()
-            # cursor.execute("SELECT 1")
-            # return _connection
-            pass # Simplified for this example, usually pyodbc handles some pooling or we just reuse object
-        except Exception:
-            logging.warning("Existing connection lost. Reconnecting...")
-            _connection = None
 
-    if _connection is None:
-        logging.info("Creating new SQL connection...")
-        try:
-            _connection = pyodbc.connect(conn_str)
-        except Exception as e:
-            logging.error(f"Failed to connect to SQL Database: {e}")
-            raise e
-            
-    return _connection
+def _pool_options_from_env():
+    return {
+        "min_size": config.env_int("SqlPoolMinSize", 0),
+        "max_size": config.env_int("SqlPoolMaxSize", 10),
+        "checkout_timeout": config.env_float("SqlPoolTimeout", 30.0),
+        "idle_timeout": config.env_float("SqlPoolIdleTimeout", 300.0),
+        "max_lifetime": config.env_float("SqlPoolMaxLifetime", 1800.0),
+        "probe_after": config.env_float("SqlPoolProbeAfter", 5.0),
+        "statement_cache_size": config.env_int("SqlStatementCacheSize", 32),
+        "failure_threshold": config.env_int("SqlBreakerFailureThreshold", 5),
+        "reset_timeout": config.env_float("SqlBreakerResetTimeout", 30.0),
+        "half_open_max_calls": config.env_int("SqlBreakerHalfOpenCalls", 1),
+        "connect_retries": config.env_int("SqlConnectRetries", 2),
+        "retry_backoff": config.env_float("SqlRetryBackoff", 0.2),
+        "retry_backoff_max": config.env_float("SqlRetryBackoffMax", 5.0),
+        "retry_budget_ratio": config.env_float("SqlRetryBudgetRatio", 0.1),
+        "retry_budget_min_per_second": config.env_float("SqlRetryBudgetMinPerSecond", 1.0),
+    }
+
 
-def execute_query(query, params=None):
+def configure_pool(connect=None, **options):
     """
-    Helper function to execute a query.
+    Replaces the global pool. `connect` overrides the pyodbc connection factory,
+    e.g. `lambda: sqlite3.connect("local.db", check_same_thread=False)` for local runs.
+    Remaining keyword arguments override the `SqlPool*` environment settings.
+    """
+    global _pool
+    if connect is None:
+        conn_str = _connection_string()
+        connect = lambda: pyodbc.connect(conn_str)
+    settings = _pool_options_from_env()
+    settings.update(options)
+    new_pool = ConnectionPool(connect, **settings)
+    with _pool_lock:
+        old_pool, _pool = _pool, new_pool
+    if old_pool is not None:
+        old_pool.close()
+    return new_pool
+
+
+def get_pool():
+    """
+    Returns the global connection pool, creating it from `SqlConnectionString` on first use.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                conn_str = _connection_string()
+                _pool = ConnectionPool(lambda: pyodbc.connect(conn_str), **_pool_options_from_env())
+    return _pool
+
+
+def _pool_gauge(field):
+    # Scrapes must not create the pool (that would require SqlConnectionString).
+    return lambda: _pool.stats()[field] if _pool is not None else 0
+
+
+metrics.REGISTRY.gauge("sql_pool_in_use", "Pooled SQL connections checked out.", callback=_pool_gauge("in_use"))
+metrics.REGISTRY.gauge("sql_pool_idle", "Idle pooled SQL connections.", callback=_pool_gauge("idle"))
+# Running totals of the current pool: counters, so rate() works (they restart with configure_pool()).
+metrics.REGISTRY.counter("sql_pool_waits_total", "Checkouts that had to wait for a free connection.",
+                         callback=_pool_gauge("waits"))
+metrics.REGISTRY.counter("sql_pool_wait_seconds_total", "Total time spent waiting for a free connection.",
+                         callback=_pool_gauge("wait_time"))
+metrics.REGISTRY.counter("sql_pool_timeouts_total", "Checkouts that timed out waiting for a free connection.",
+                         callback=_pool_gauge("timeouts"))
+metrics.REGISTRY.gauge(
+    "sql_circuit_state", "SQL circuit breaker state (1 for the current state).", ("state",),
+    callback=lambda: {(state,): int(_pool is not None and _pool.breaker.state == state)
+                      for state in (CLOSED, OPEN, HALF_OPEN)})
+
+
+def circuit_state():
+    """
+    Returns the circuit breaker state of the global pool: "closed", "open" or "half_open".
+    """
+    return get_pool().breaker.state
+
+
+def pool_stats():
+    """
+    Returns pool counters: size, in_use, idle, waits, wait_time, timeouts, etc.
+    """
+    return get_pool().stats()
+
+
+def get_connection():
+    """
+    Checks a connection out of the global pool.
+    Connections are retained across function invocations (connection pooling);
+    callers must hand it back with `release_connection()`.
+    """
+    return get_pool().checkout()
+
+
+def release_connection(conn, discard=False):
+    """
+    Returns a connection obtained from `get_connection()` to the pool.
+    """
+    get_pool().checkin(conn, discard=discard)
+
+
+# --- Statement classification ---
+
+READ, WRITE, DDL = "read", "write", "ddl"
+
+_WRITE_KEYWORDS = {"INSERT", "UPDATE", "DELETE", "MERGE"}
+_DDL_KEYWORDS = {"CREATE", "ALTER", "DROP", "TRUNCATE"}
+_SQL_NOISE = re.compile(r"--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|\[[^\]]*\]|\"[^\"]*\"", re.S)
+_SQL_TOKEN = re.compile(r"[A-Za-z_]+|[()]")
+
+_kind_cache = OrderedDict()
+_kind_cache_lock = threading.Lock()
+_kind_cache_size = config.env_int("SqlClassifyCacheSize", 1024)
+_kind_stats = {"hits": 0, "misses": 0}
+
+
+def _parse_statement_kind(sql):
+    # Only keywords outside parentheses matter: that skips CTE bodies and subqueries.
+    tokens = _SQL_TOKEN.findall(_SQL_NOISE.sub(" ", sql))
+    # A statement that opens with "(" is a parenthesised query: its first keyword decides.
+    depth = 1 if tokens and tokens[0] == "(" else 0
+    top_level = []
+    for token in tokens[depth:]:
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth = max(0, depth - 1)
+        elif depth == 0 or not top_level:
+            top_level.append(token.upper())
+    for i, word in enumerate(top_level):
+        if word in _DDL_KEYWORDS:
+            return DDL
+        if word in _WRITE_KEYWORDS:
+            return WRITE
+        if word == "SELECT":
+            # SELECT ... INTO creates and fills a table.
+            return WRITE if "INTO" in top_level[i + 1:] else READ
+        if word != "WITH" and i == 0:
+            # EXEC, DECLARE, IF ...: can't tell, so treat as a write and commit.
+            return WRITE
+    return WRITE
+
+
+def statement_kind(sql):
+    """
+    Classifies a statement as READ, WRITE or DDL, parsing each distinct SQL text once.
+    Understands comments, string literals and CTEs (`WITH ... SELECT` is a read).
+    """
+    with _kind_cache_lock:
+        kind = _kind_cache.get(sql)
+        if kind is not None:
+            _kind_cache.move_to_end(sql)
+            _kind_stats["hits"] += 1
+            return kind
+        _kind_stats["misses"] += 1
+    kind = _parse_statement_kind(sql)
+    with _kind_cache_lock:
+        _kind_cache[sql] = kind
+        while len(_kind_cache) > _kind_cache_size:
+            _kind_cache.popitem(last=False)
+    return kind
+
+
+def statement_cache_stats():
+    """
+    Returns hit/miss counters for the per-connection statement caches and the classification cache.
+    """
+    with _statement_stats_lock:
+        statements = dict(_statement_stats)
+    with _kind_cache_lock:
+        classification = dict(_kind_stats, size=len(_kind_cache))
+    return {"statements": statements, "classification": classification}
+
+
+@contextmanager
+def _statement(pool, conn, query, params):
+    """
+    Executes `query` on a cached cursor of `conn` and yields the cursor.
+    The cursor goes back to the cache only if the block completes; otherwise it may
+    still hold unread results and is closed.
+    """
+    cache = pool.statement_cache(conn)
+    cursor = cache.acquire(query)
     try:
         if params:
             cursor.execute(query, params)
         else:
             cursor.execute(query)
-        
-        # Determine if it's a SELECT or INSERT/UPDATE
-        if query.strip().upper().startswith("SELECT"):
-            columns = [column[0] for column in cursor.description]
-            results = []
-            for row in cursor.fetchall():
-                results.append(dict(zip(columns, row)))
-            return results
-        else:
+        yield cursor
+    except BaseException:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+        raise
+    cache.release(query, cursor)
+
+
+RESULT_MODES = ("dicts", "tuples", "namedtuples", "columns", "arrays")
+
+_namedtuple_types = {}
+
+
+def _row_factory(cursor, result):
+    """
+    Returns a callable that converts one driver row into the requested shape.
+    """
+    if result == "tuples":
+        # pyodbc.Row is already tuple-like (and supports attribute access); no copy needed.
+        return None
+    columns = [column[0] for column in cursor.description]
+    if result == "dicts":
+        return lambda row: dict(zip(columns, row))
+    if result == "namedtuples":
+        key = tuple(columns)
+        row_type = _namedtuple_types.get(key)
+        if row_type is None:
+            row_type = _namedtuple_types[key] = namedtuple("Row", columns, rename=True)
+        return row_type._make
+    raise ValueError(f"Unknown result mode {result!r}; expected one of {RESULT_MODES}.")
+
+
+def _to_columns(cursor, chunk, result):
+    columns = [column[0] for column in cursor.description]
+    if result == "arrays":
+        if numpy is None:
+            raise ImportError("result='arrays' requires numpy; use result='columns' for plain lists.")
+        return {name: numpy.array([row[i] for row in chunk]) for i, name in enumerate(columns)}
+    return {name: [row[i] for row in chunk] for i, name in enumerate(columns)}
+
+
+def _fetch_chunks(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def _fetch_results(cursor, result, chunk_size):
+    if result in ("columns", "arrays"):
+        columns = [column[0] for column in cursor.description]
+        data = {name: [] for name in columns}
+        for chunk in _fetch_chunks(cursor, chunk_size):
+            for i, name in enumerate(columns):
+                data[name].extend(row[i] for row in chunk)
+        if result == "arrays":
+            if numpy is None:
+                raise ImportError("result='arrays' requires numpy; use result='columns' for plain lists.")
+            data = {name: numpy.array(values) for name, values in data.items()}
+        return data
+    make_row = _row_factory(cursor, result)
+    rows = cursor.fetchall()
+    if make_row is None:
+        return rows
+    return [make_row(row) for row in rows]
+
+
+def execute_query(query, params=None, result="dicts", chunk_size=None):
+    """
+    Helper function to execute a query.
+
+    For SELECTs, `result` picks the shape of the returned rows:
+    "dicts" (default), "tuples" (raw driver rows), "namedtuples",
+    "columns" ({column: [values]}) or "arrays" ({column: numpy.ndarray}).
+    Statements that return no rows give the affected row count instead.
+    Anything that is not a pure read is committed.
+    """
+    chunk_size = chunk_size or config.env_int("SqlFetchSize", 1000)
+    pool = get_pool()
+    with metrics.track_backend("execute_query"), pool.connection() as conn:
+        with _statement(pool, conn, query, params) as cursor:
+            # cursor.description is set whenever the statement produced a result set
+            # (SELECT, WITH ... SELECT, INSERT ... OUTPUT).
+            if cursor.description is not None:
+                results = _fetch_results(cursor, result, chunk_size)
+            else:
+                results = cursor.rowcount
+        if statement_kind(query) != READ:
+            conn.commit()
+        return results
+
+
+def iter_chunks(query, params=None, result="tuples", chunk_size=None):
+    """
+    Generator that executes a SELECT and yields its result in `fetchmany` chunks,
+    so arbitrarily large scans run in constant memory. Each chunk is a list of rows
+    (shaped as in `execute_query`) or, for "columns"/"arrays", one column dict.
+    The pooled connection is held until the generator is exhausted or closed.
+    """
+    chunk_size = chunk_size or config.env_int("SqlFetchSize", 1000)
+    pool = get_pool()
+    with pool.connection() as conn:
+        with _statement(pool, conn, query, params) as cursor:
+            if cursor.description is None:
+                raise ValueError("iter_chunks() needs a statement that returns rows.")
+            if result in ("columns", "arrays"):
+                for chunk in _fetch_chunks(cursor, chunk_size):
+                    yield _to_columns(cursor, chunk, result)
+            else:
+                make_row = _row_factory(cursor, result)
+                for chunk in _fetch_chunks(cursor, chunk_size):
+                    yield chunk if make_row is None else [make_row(row) for row in chunk]
+        if statement_kind(query) != READ:
+            conn.commit()
+
+
+def iter_query(query, params=None, result="tuples", chunk_size=None):
+    """
+    Generator that yields the rows of a SELECT one at a time (see `iter_chunks`).
+    """
+    if result in ("columns", "arrays"):
+        raise ValueError("iter_query yields rows; use iter_chunks for columnar chunks.")
+    for chunk in iter_chunks(query, params, result, chunk_size):
+        yield from chunk
+
+
+class BatchWriter:
+    """
+    Micro-batching writer for a single parameterised write statement.
+
+    `submit()` queues one parameter row and returns a Future immediately; a background
+    thread flushes queued rows with `executemany` (pyodbc `fast_executemany` when
+    available) and one commit once `batch_size` rows are pending or the oldest row has
+    waited `max_delay` seconds. If a batch fails it is rolled back and replayed row by
+    row so that only the offending rows' Futures carry the error.
+    """
+
+    def __init__(self, query, pool=None, batch_size=100, max_delay=1.0, max_pending=10000):
+        self.query = query
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_pending = max(max_pending, batch_size)
+        self._pool = pool
+
+        self._cond = threading.Condition(threading.Lock())
+        self._pending = []       # list of (params, Future)
+        self._oldest = None      # monotonic time of the oldest pending row
+        self._in_flight = 0      # batches taken but not yet committed
+        self._closed = False
+        self._stats = {"submitted": 0, "batches": 0, "rows_written": 0, "row_errors": 0, "fallbacks": 0}
+
+        self._thread = threading.Thread(target=self._run, name="sql-batch-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, params):
+        """
+        Queues one row of parameters. Blocks only if `max_pending` rows are already queued.
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchWriter is closed.")
+            while len(self._pending) >= self.max_pending:
+                self._cond.notify_all()
+                self._cond.wait()
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((params, future))
+            self._stats["submitted"] += 1
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                # Wake the writer to start the delay timer or flush a full batch.
+                self._cond.notify_all()
+        return future
+
+    def flush(self):
+        """
+        Writes everything queued so far and waits until it is committed.
+        """
+        with self._cond:
+            batch = self._take_locked()
+        if batch:
+            self._write(batch)
+        with self._cond:
+            while self._in_flight:
+                self._cond.wait()
+
+    def close(self):
+        """
+        Stops the background thread after flushing all queued rows.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        return stats
+
+    def _take_locked(self):
+        batch, self._pending = self._pending, []
+        self._oldest = None
+        if batch:
+            self._in_flight += 1
+        self._cond.notify_all()
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._pending) >= self.batch_size:
+                        break
+                    if self._pending:
+                        remaining = self._oldest + self.max_delay - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+                batch = self._take_locked()
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            pool = self._pool or get_pool()
+            rows = [params for params, _ in batch]
+            with metrics.track_backend("batch_flush"), pool.connection() as conn:
+                try:
+                    cursor = conn.cursor()
+                    try:
+                        if hasattr(cursor, "fast_executemany"):
+                            cursor.fast_executemany = True
+                        cursor.executemany(self.query, rows)
+                        conn.commit()
+                    finally:
+                        cursor.close()
+                    results = [(future, None) for _, future in batch]
+                except Exception as e:
+                    logging.warning(f"Batch insert of {len(batch)} rows failed ({e}); retrying row by row.")
+                    conn.rollback()
+                    results = self._write_rows(conn, batch)
+            self._record(len(batch), results)
+        except Exception as e:
+            # No usable connection: every row in the batch failed.
+            logging.error(f"Batch write failed: {e}")
+            self._record(len(batch), [(future, e) for _, future in batch])
+
+    def _write_rows(self, conn, batch):
+        with self._cond:
+            self._stats["fallbacks"] += 1
+        results = []
+        cursor = conn.cursor()
+        try:
+            for params, future in batch:
+                try:
+                    cursor.execute(self.query, params)
+                    results.append((future, None))
+                except Exception as e:
+                    logging.error(f"Batch row {params!r} failed: {e}")
+                    results.append((future, e))
             conn.commit()
-            return cursor.rowcount
-    finally:
-        cursor.close()
-        # Do NOT close the connection here, so it can be reused
+        finally:
+            cursor.close()
+        return results
+
+    def _record(self, batch_size, results):
+        errors = sum(1 for _, error in results if error is not None)
+        with self._cond:
+            self._stats["batches"] += 1
+            self._stats["rows_written"] += batch_size - errors
+            self._stats["row_errors"] += errors
+            self._in_flight -= 1
+            self._cond.notify_all()
+        for future, error in results:
+            if error is None:
+                future.set_result(1)
+            else:
+                future.set_exception(error)
+
+
+# One writer per statement, shared by all invocations on this worker
+_batch_writers = {}
+_batch_writers_lock = threading.Lock()
+
+
+def get_batch_writer(query):
+    """
+    Returns the shared BatchWriter for `query`, configured from
+    `SqlBatchSize`, `SqlBatchMaxDelay` and `SqlBatchMaxPending`.
+    """
+    writer = _batch_writers.get(query)
+    if writer is None:
+        with _batch_writers_lock:
+            writer = _batch_writers.get(query)
+            if writer is None:
+                writer = BatchWriter(
+                    query,
+                    batch_size=config.env_int("SqlBatchSize", 100),
+                    max_delay=config.env_float("SqlBatchMaxDelay", 1.0),
+                    max_pending=config.env_int("SqlBatchMaxPending", 10000),
+                )
+                _batch_writers[query] = writer
+    return writer
+
+
+metrics.REGISTRY.gauge(
+    "sql_batch_pending_rows", "Rows queued in batch writers, by statement.", ("query",),
+    callback=lambda: {(query,): writer.stats()["pending"] for query, writer in list(_batch_writers.items())})
+
+
+@atexit.register
+def close_batch_writers():
+    """
+    Flushes and stops all batch writers (runs automatically on interpreter shutdown).
+    """
+    with _batch_writers_lock:
+        writers = list(_batch_writers.values())
+        _batch_writers.clear()
+    for writer in writers:
+        try:
+            writer.close()
+        except Exception as e:
+            logging.error(f"Failed to flush batch writer on shutdown: {e}")
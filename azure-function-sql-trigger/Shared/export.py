@@ -0,0 +1,305 @@
+"""
+Streaming bulk export of AccessLogs to CSV or Parquet.
+
+The table is read in keyset order (`WHERE Id > last ORDER BY Id`, one bounded page
+per query) and each page is streamed in `fetchmany` chunks through
+`db_manager.iter_chunks`, so memory stays flat whatever the table size. Output
+rotates to a new file once a file reaches `max_file_bytes`.
+
+Files are written as `*.part` and renamed to `accesslogs-<firstId>-<lastId>.<ext>`
+only once complete, so the names on disk record exactly which Ids are exported:
+an interrupted export resumes after the last complete file of each range, and a
+finished one records its high-water `Id` in `export.json` so the next run exports
+only newer rows. With `workers > 1`, the Id span is split into disjoint ranges
+exported by separate processes.
+
+Usage:
+    python -m Shared.export --sqlite local.db --out ./export --format csv
+    python -m Shared.export --out ./export --format parquet --workers 4   # uses SqlConnectionString
+"""
+import argparse
+import csv
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from Shared import db_manager
+from Shared import migrations
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Optional: only needed for format="parquet"
+    pyarrow = None
+
+FORMATS = ("csv", "parquet")
+COLUMNS = ("Id", "User", "Timestamp", "RequestId")
+MANIFEST = "export.json"
+DEFAULT_PAGE_ROWS = 100000
+DEFAULT_CHUNK_ROWS = 10000
+DEFAULT_MAX_FILE_BYTES = 256 * 1024 * 1024
+
+_FILE_NAME = re.compile(r"^accesslogs-(\d+)-(\d+)\.(csv|parquet)$")
+
+
+def _page_query(dialect):
+    columns = "Id, [User], Timestamp, RequestId"
+    if dialect == migrations.SQLITE:
+        return f"SELECT {columns} FROM AccessLogs WHERE Id > ? AND Id <= ? ORDER BY Id LIMIT ?", \
+            lambda after, upper, rows: (after, upper, rows)
+    return f"SELECT TOP (?) {columns} FROM AccessLogs WHERE Id > ? AND Id <= ? ORDER BY Id", \
+        lambda after, upper, rows: (rows, after, upper)
+
+
+def _as_datetime(value):
+    # sqlite3 returns DATETIME columns as text.
+    return datetime.datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+class _RotatingWriter:
+    """
+    Writes row chunks to `accesslogs-<first>-<last>.<fmt>` files of roughly
+    `max_file_bytes` each (a file is closed after the chunk that crosses the limit).
+    """
+
+    def __init__(self, directory, fmt, max_file_bytes, worker):
+        if fmt == "parquet" and pyarrow is None:
+            raise ImportError("format='parquet' requires pyarrow; use format='csv' or pip install pyarrow.")
+        self.directory = directory
+        self.fmt = fmt
+        self.max_file_bytes = max_file_bytes
+        self.worker = worker
+        self.files = []
+        self._file = None
+        self._writer = None
+        self._path = None
+        self._first_id = None
+        self._last_id = None
+
+    def _open(self, first_id):
+        self._path = os.path.join(self.directory, f".accesslogs-{self.worker}-{first_id}.{self.fmt}.part")
+        self._file = open(self._path, "w", newline="", encoding="utf-8") if self.fmt == "csv" else open(self._path, "wb")
+        self._first_id = first_id
+        if self.fmt == "csv":
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(COLUMNS)
+        else:
+            self._writer = pyarrow.parquet.ParquetWriter(self._file, _arrow_schema())
+
+    def write(self, columns):
+        """
+        Writes one chunk given as {column: [values]} (the "columns" shape of iter_chunks).
+        """
+        ids = columns["Id"]
+        if not ids:
+            return
+        if self._file is None:
+            self._open(ids[0])
+        if self.fmt == "csv":
+            timestamps = [_as_datetime(ts) for ts in columns["Timestamp"]]
+            self._writer.writerows(zip(
+                ids, columns["User"], [ts.isoformat(sep=" ") if ts is not None else None for ts in timestamps],
+                columns["RequestId"]))
+        else:
+            self._writer.write_table(pyarrow.Table.from_pydict({
+                "Id": ids,
+                "User": columns["User"],
+                "Timestamp": [_as_datetime(ts) for ts in columns["Timestamp"]],
+                "RequestId": columns["RequestId"],
+            }, schema=_arrow_schema()))
+        self._last_id = ids[-1]
+        if self._file.tell() >= self.max_file_bytes:
+            self.close()
+
+    def close(self):
+        """
+        Finishes the open file and gives it its final name.
+        """
+        if self._file is None:
+            return
+        if self.fmt == "parquet":
+            self._writer.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        final = os.path.join(self.directory, f"accesslogs-{self._first_id}-{self._last_id}.{self.fmt}")
+        os.replace(self._path, final)
+        self.files.append(final)
+        self._file = self._writer = self._path = None
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            os.remove(self._path)
+            self._file = self._writer = self._path = None
+
+
+def _arrow_schema():
+    return pyarrow.schema([
+        ("Id", pyarrow.int64()),
+        ("User", pyarrow.string()),
+        ("Timestamp", pyarrow.timestamp("ms")),
+        ("RequestId", pyarrow.string()),
+    ])
+
+
+def _resume_point(directory, lower, upper):
+    """
+    The last Id already exported to complete files within (lower, upper].
+    """
+    last = lower
+    for name in os.listdir(directory):
+        match = _FILE_NAME.match(name)
+        if match:
+            first_id, last_id = int(match.group(1)), int(match.group(2))
+            if lower < first_id and last_id <= upper:
+                last = max(last, last_id)
+    return last
+
+
+def export_range(directory, lower, upper, fmt="csv", max_file_bytes=DEFAULT_MAX_FILE_BYTES,
+                 page_rows=DEFAULT_PAGE_ROWS, chunk_rows=DEFAULT_CHUNK_ROWS, worker=0):
+    """
+    Exports AccessLogs rows with lower < Id <= upper (resuming after files already
+    on disk) using the global db_manager pool. Returns (rows, files written).
+    """
+    after = _resume_point(directory, lower, upper)
+    with db_manager.get_pool().connection() as conn:
+        dialect = migrations.dialect_of(conn)
+    query, params = _page_query(dialect)
+    writer = _RotatingWriter(directory, fmt, max_file_bytes, worker)
+    rows = 0
+    try:
+        while after < upper:
+            page = 0
+            for chunk in db_manager.iter_chunks(query, params(after, upper, page_rows), "columns", chunk_rows):
+                writer.write(chunk)
+                page += len(chunk["Id"])
+                after = chunk["Id"][-1]
+            rows += page
+            if page < page_rows:
+                break
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    return rows, writer.files
+
+
+def _split(lower, upper, parts):
+    step = max(1, -(-(upper - lower) // parts))
+    bounds = list(range(lower, upper, step)) + [upper]
+    return [[bounds[i], bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+
+def _read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _max_id():
+    with db_manager.get_pool().connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT MAX(Id) FROM AccessLogs")
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        conn.rollback()
+    return (row[0] if row else None) or 0
+
+
+def _worker_init(connect):
+    if connect is not None:
+        db_manager.configure_pool(connect, max_size=1)
+
+
+def _export_task(task):
+    return export_range(**task)
+
+
+def export(directory, fmt="csv", workers=1, max_file_bytes=DEFAULT_MAX_FILE_BYTES,
+           page_rows=DEFAULT_PAGE_ROWS, chunk_rows=DEFAULT_CHUNK_ROWS, connect=None):
+    """
+    Exports the AccessLogs rows not yet exported to `directory`.
+
+    An unfinished export recorded in `export.json` is resumed over its original
+    ranges; otherwise rows after the previous high-water Id, up to the current
+    MAX(Id), are split into `workers` disjoint Id ranges. `connect` is a picklable
+    zero-argument connection factory for worker processes (default: SqlConnectionString).
+    Returns {"rows": int, "files": [...], "high_water": int}.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {FORMATS}.")
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".part"):
+            os.remove(os.path.join(directory, name))
+
+    manifest = _read_manifest(directory)
+    if manifest is None or manifest["complete"]:
+        lower = manifest["high_water"] if manifest else 0
+        upper = _max_id()
+        manifest = {"format": fmt, "high_water": upper, "complete": False,
+                    "ranges": _split(lower, upper, workers) if upper > lower else []}
+        _write_manifest(directory, manifest)
+    elif manifest["format"] != fmt:
+        raise ValueError(f"Unfinished {manifest['format']} export in {directory}; resume it with that format.")
+
+    tasks = [{"directory": directory, "lower": lower, "upper": upper, "fmt": fmt,
+              "max_file_bytes": max_file_bytes, "page_rows": page_rows, "chunk_rows": chunk_rows, "worker": i}
+             for i, (lower, upper) in enumerate(manifest["ranges"])]
+    if len(tasks) > 1:
+        # Spawned (not forked) workers: each builds its own pool instead of inheriting sockets.
+        with ProcessPoolExecutor(max_workers=len(tasks), mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_worker_init, initargs=(connect,)) as pool:
+            results = list(pool.map(_export_task, tasks))
+    else:
+        results = [_export_task(task) for task in tasks]
+
+    manifest["complete"] = True
+    _write_manifest(directory, manifest)
+    summary = {"rows": sum(rows for rows, _ in results),
+               "files": [path for _, files in results for path in files],
+               "high_water": manifest["high_water"]}
+    logging.info(f"Exported {summary['rows']} AccessLogs rows to {len(summary['files'])} files "
+                 f"(high-water Id {summary['high_water']}).")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream AccessLogs to CSV/Parquet files.")
+    migrations.add_connection_args(parser)
+    parser.add_argument("--out", required=True, help="Output directory (also holds the resume state).")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--max-file-mb", type=float, default=DEFAULT_MAX_FILE_BYTES / (1024 * 1024))
+    parser.add_argument("--page-rows", type=int, default=DEFAULT_PAGE_ROWS)
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    connect = migrations.connection_factory(args)
+    db_manager.configure_pool(connect, max_size=1)
+    summary = export(args.out, args.format, args.workers, int(args.max_file_mb * 1024 * 1024),
+                     args.page_rows, args.chunk_rows, connect)
+    print(f"Exported {summary['rows']} rows to {len(summary['files'])} files; high-water Id {summary['high_water']}.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
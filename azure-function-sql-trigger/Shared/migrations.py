@@ -0,0 +1,313 @@
+"""
+Versioned schema migrations for the AccessLogs database.
+
+Each migration has a version number, a description and per-dialect steps: SQL
+strings or callables taking a cursor. Applied versions are recorded in
+`SchemaVersions`, so `migrate()` is safe to run on every deploy. Supported
+dialects: "mssql" (Azure SQL / SQL Server via pyodbc) and "sqlite" (local runs).
+
+Usage:
+    python -m Shared.migrations --sqlite local.db migrate
+    python -m Shared.migrations status            # uses SqlConnectionString
+"""
+import argparse
+import logging
+import os
+import sys
+
+MSSQL, SQLITE = "mssql", "sqlite"
+
+
+def dialect_of(conn):
+    """
+    Returns "sqlite" for sqlite3 connections and "mssql" otherwise.
+    """
+    return SQLITE if type(conn).__module__.startswith("sqlite3") else MSSQL
+
+
+def _sqlite_add_column(table, column, definition):
+    def step(cursor):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+def _mssql_index(name, definition):
+    return f"""
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='{name}')
+        {definition}
+    """
+
+
+MIGRATIONS = [
+    (1, "Create AccessLogs", {
+        MSSQL: ["""
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AccessLogs' AND xtype='U')
+            CREATE TABLE AccessLogs (
+                Id INT IDENTITY(1,1) PRIMARY KEY,
+                [User] NVARCHAR(100),
+                Timestamp DATETIME DEFAULT GETDATE()
+            )
+        """],
+        SQLITE: ["""
+            CREATE TABLE IF NOT EXISTS AccessLogs (
+                Id INTEGER PRIMARY KEY AUTOINCREMENT,
+                [User] NVARCHAR(100),
+                Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """],
+    }),
+    (2, "Add AccessLogs.RequestId dedupe key for write-behind replays", {
+        MSSQL: [
+            """
+            IF COL_LENGTH('AccessLogs', 'RequestId') IS NULL
+            ALTER TABLE AccessLogs ADD RequestId NVARCHAR(64) NULL
+            """,
+            _mssql_index("UX_AccessLogs_RequestId",
+                         "CREATE UNIQUE INDEX UX_AccessLogs_RequestId ON AccessLogs (RequestId) WHERE RequestId IS NOT NULL"),
+        ],
+        SQLITE: [
+            _sqlite_add_column("AccessLogs", "RequestId", "NVARCHAR(64)"),
+            "CREATE UNIQUE INDEX IF NOT EXISTS UX_AccessLogs_RequestId ON AccessLogs (RequestId) WHERE RequestId IS NOT NULL",
+        ],
+    }),
+    (3, "Index AccessLogs by Timestamp and by User", {
+        # Timestamp: newest-first reads and retention cutoffs. User: per-user lookups in time order.
+        MSSQL: [
+            _mssql_index("IX_AccessLogs_Timestamp",
+                         "CREATE INDEX IX_AccessLogs_Timestamp ON AccessLogs (Timestamp DESC) INCLUDE ([User])"),
+            _mssql_index("IX_AccessLogs_User_Timestamp",
+                         "CREATE INDEX IX_AccessLogs_User_Timestamp ON AccessLogs ([User], Timestamp)"),
+        ],
+        SQLITE: [
+            "CREATE INDEX IF NOT EXISTS IX_AccessLogs_Timestamp ON AccessLogs (Timestamp DESC)",
+            "CREATE INDEX IF NOT EXISTS IX_AccessLogs_User_Timestamp ON AccessLogs ([User], Timestamp)",
+        ],
+    }),
+    (4, "Create AccessLogs hourly/daily rollups and rollup watermarks", {
+        # Maintained by Shared/rollups.py; [User] is '' for rows without a user.
+        MSSQL: [
+            """
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AccessLogsHourly' AND xtype='U')
+            CREATE TABLE AccessLogsHourly (
+                BucketStart DATETIME NOT NULL,
+                [User] NVARCHAR(100) NOT NULL,
+                RequestCount BIGINT NOT NULL,
+                CONSTRAINT PK_AccessLogsHourly PRIMARY KEY (BucketStart, [User])
+            )
+            """,
+            """
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AccessLogsDaily' AND xtype='U')
+            CREATE TABLE AccessLogsDaily (
+                BucketStart DATETIME NOT NULL,
+                [User] NVARCHAR(100) NOT NULL,
+                RequestCount BIGINT NOT NULL,
+                CONSTRAINT PK_AccessLogsDaily PRIMARY KEY (BucketStart, [User])
+            )
+            """,
+            """
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='RollupWatermarks' AND xtype='U')
+            CREATE TABLE RollupWatermarks (
+                Name NVARCHAR(64) PRIMARY KEY,
+                LastId BIGINT NOT NULL,
+                UpdatedAt DATETIME DEFAULT GETDATE()
+            )
+            """,
+        ],
+        SQLITE: [
+            """
+            CREATE TABLE IF NOT EXISTS AccessLogsHourly (
+                BucketStart DATETIME NOT NULL,
+                [User] NVARCHAR(100) NOT NULL,
+                RequestCount INTEGER NOT NULL,
+                PRIMARY KEY (BucketStart, [User])
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS AccessLogsDaily (
+                BucketStart DATETIME NOT NULL,
+                [User] NVARCHAR(100) NOT NULL,
+                RequestCount INTEGER NOT NULL,
+                PRIMARY KEY (BucketStart, [User])
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS RollupWatermarks (
+                Name NVARCHAR(64) PRIMARY KEY,
+                LastId INTEGER NOT NULL,
+                UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+        ],
+    }),
+]
+
+_VERSIONS_TABLE = {
+    MSSQL: """
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='SchemaVersions' AND xtype='U')
+        CREATE TABLE SchemaVersions (
+            Version INT PRIMARY KEY,
+            Description NVARCHAR(200),
+            AppliedAt DATETIME DEFAULT GETDATE()
+        )
+    """,
+    SQLITE: """
+        CREATE TABLE IF NOT EXISTS SchemaVersions (
+            Version INTEGER PRIMARY KEY,
+            Description NVARCHAR(200),
+            AppliedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+}
+
+
+def applied_versions(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(_VERSIONS_TABLE[dialect_of(conn)])
+        conn.commit()
+        cursor.execute("SELECT Version FROM SchemaVersions")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def current_version(conn):
+    return max(applied_versions(conn), default=0)
+
+
+def pending(conn, migrations=MIGRATIONS):
+    applied = applied_versions(conn)
+    return [migration for migration in migrations if migration[0] not in applied]
+
+
+def migrate(conn, target=None, migrations=MIGRATIONS):
+    """
+    Applies pending migrations in version order (up to `target`), each in its own
+    transaction together with its SchemaVersions row. Returns the versions applied.
+    """
+    dialect = dialect_of(conn)
+    done = []
+    for version, description, steps in sorted(pending(conn, migrations), key=lambda m: m[0]):
+        if target is not None and version > target:
+            break
+        logging.info(f"Applying migration {version}: {description}")
+        cursor = conn.cursor()
+        try:
+            for step in steps[dialect]:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute("INSERT INTO SchemaVersions (Version, Description) VALUES (?, ?)", (version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        done.append(version)
+    return done
+
+
+# --- Dialect helpers shared by the AccessLogs jobs ---
+
+def datetime_param(conn, value):
+    """
+    Binds a naive datetime for comparison with a DATETIME column. sqlite3 compares
+    them as text ("YYYY-MM-DD HH:MM:SS"); pyodbc takes the datetime itself.
+    """
+    if dialect_of(conn) == SQLITE:
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+def next_id_boundary(conn, cursor, table, after, upper, count):
+    """
+    Keyset step: returns the Id of the `count`-th row of `table` with
+    `after < Id <= upper` (or the last one if there are fewer), None if there are none.
+    """
+    if dialect_of(conn) == SQLITE:
+        query = f"SELECT MAX(Id) FROM (SELECT Id FROM {table} WHERE Id > ? AND Id <= ? ORDER BY Id LIMIT ?)"
+        params = (after, upper, count)
+    else:
+        query = f"SELECT MAX(Id) FROM (SELECT TOP (?) Id FROM {table} WHERE Id > ? AND Id <= ? ORDER BY Id) AS b"
+        params = (count, after, upper)
+    cursor.execute(query, params)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+# --- Command line ---
+
+class SqliteConnect:
+    """
+    Picklable connection factory for a SQLite file (usable in spawned worker processes).
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self):
+        import sqlite3
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+
+class OdbcConnect:
+    """
+    Picklable connection factory for an ODBC connection string.
+    """
+
+    def __init__(self, conn_str):
+        self.conn_str = conn_str
+
+    def __call__(self):
+        import pyodbc
+        return pyodbc.connect(self.conn_str)
+
+
+def connection_factory(args):
+    """
+    Returns a zero-argument connect function for --sqlite / --connection-string / SqlConnectionString.
+    """
+    if args.sqlite:
+        return SqliteConnect(args.sqlite)
+    conn_str = args.connection_string or os.environ.get("SqlConnectionString")
+    if not conn_str:
+        raise SystemExit("Pass --sqlite PATH or --connection-string, or set SqlConnectionString.")
+    return OdbcConnect(conn_str)
+
+
+def connect_from_args(args):
+    return connection_factory(args)()
+
+
+def add_connection_args(parser):
+    parser.add_argument("--sqlite", metavar="PATH", help="Use a local SQLite database file.")
+    parser.add_argument("--connection-string", help="ODBC connection string (default: SqlConnectionString).")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AccessLogs schema migrations.")
+    add_connection_args(parser)
+    parser.add_argument("command", choices=["migrate", "status"])
+    parser.add_argument("--target", type=int, help="Stop after this version.")
+    args = parser.parse_args(argv)
+
+    conn = connect_from_args(args)
+    try:
+        if args.command == "migrate":
+            applied = migrate(conn, args.target)
+            print(f"Applied migrations: {applied or 'none'}; schema version {current_version(conn)}.")
+        else:
+            applied = applied_versions(conn)
+            for version, description, _ in MIGRATIONS:
+                print(f"{'[x]' if version in applied else '[ ]'} {version}: {description}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Batched retention for AccessLogs.
+
+Expired rows are deleted in small keyset batches (contiguous Id ranges, one
+transaction each), so a purge never holds locks on more than `batch_size` rows
+and never escalates to a table lock. Works on Azure SQL / SQL Server and SQLite.
+
+Usage:
+    python -m Shared.retention --sqlite local.db --days 30
+    python -m Shared.retention --days 90              # uses SqlConnectionString
+"""
+import argparse
+import datetime
+import logging
+import sys
+import time
+
+from Shared import migrations
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def purge_expired(conn, days, batch_size=DEFAULT_BATCH_SIZE, pause=0.0, max_batches=None, now=None):
+    """
+    Deletes AccessLogs rows older than `days` days and returns the number deleted.
+
+    The newest expired Id is looked up once (via IX_AccessLogs_Timestamp); the rows
+    up to it are then walked in Id order, `batch_size` at a time, committing after
+    each batch. `pause` sleeps between batches to leave room for foreground writes;
+    `max_batches` bounds a single run (the next run picks up where this one stopped).
+    """
+    if days <= 0:
+        raise ValueError("Retention days must be positive.")
+    # Naive UTC, like GETDATE() on Azure SQL and CURRENT_TIMESTAMP on SQLite.
+    now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    cutoff = migrations.datetime_param(conn, now - datetime.timedelta(days=days))
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(Id) FROM AccessLogs WHERE Timestamp < ?", (cutoff,))
+        row = cursor.fetchone()
+        upper = row[0] if row else None
+        if upper is None:
+            return 0
+
+        deleted = 0
+        batches = 0
+        last_id = 0
+        while last_id < upper:
+            if max_batches is not None and batches >= max_batches:
+                logging.info(f"Retention stopped after {batches} batches at Id {last_id}.")
+                break
+            boundary = migrations.next_id_boundary(conn, cursor, "AccessLogs", last_id, upper, batch_size)
+            if boundary is None:
+                break
+            cursor.execute(
+                "DELETE FROM AccessLogs WHERE Id > ? AND Id <= ? AND Timestamp < ?",
+                (last_id, boundary, cutoff)
+            )
+            conn.commit()
+            deleted += max(cursor.rowcount, 0)
+            batches += 1
+            last_id = boundary
+            if pause:
+                time.sleep(pause)
+        logging.info(f"Retention deleted {deleted} AccessLogs rows older than {days} days in {batches} batches.")
+        return deleted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Delete expired AccessLogs rows in small batches.")
+    migrations.add_connection_args(parser)
+    parser.add_argument("--days", type=int, required=True, help="Keep rows newer than this many days.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+    parser.add_argument("--max-batches", type=int)
+    args = parser.parse_args(argv)
+
+    conn = migrations.connect_from_args(args)
+    try:
+        deleted = purge_expired(conn, args.days, args.batch_size, args.pause, args.max_batches)
+        print(f"Deleted {deleted} rows older than {args.days} days.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
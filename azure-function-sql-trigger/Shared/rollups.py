@@ -0,0 +1,304 @@
+"""
+Incremental hourly/daily rollups of AccessLogs.
+
+`AccessLogsHourly` and `AccessLogsDaily` hold request counts per (bucket, user).
+Each rollup pass aggregates only the AccessLogs rows past the `Id` watermark in
+`RollupWatermarks`, adds them to the summary rows and advances the watermark in the
+same transaction, so a re-run (or a crash mid-pass) never counts a row twice.
+Retention (Shared/retention.py) may delete raw rows; the rollups keep their counts.
+
+IDENTITY values are taken at insert time but rows become visible at commit, so a
+row may appear below a watermark that has already passed it. A pass therefore only
+rolls up to the `MAX(Id)` it observed at least `lag` seconds earlier (kept as a
+second RollupWatermarks row): any transaction holding an Id at or below it has had
+`lag` seconds to commit. New rows are counted one observation (timer run) later.
+
+Usage:
+    python -m Shared.rollups --sqlite local.db run
+    python -m Shared.rollups --sqlite local.db hourly --start 2026-10-01 --end 2026-10-02
+"""
+import argparse
+import datetime
+import logging
+import sys
+from collections import defaultdict
+
+from Shared import db_manager
+from Shared import metrics
+from Shared import migrations
+
+WATERMARK = "AccessLogs"
+OBSERVED = "AccessLogs:observed"
+DEFAULT_BATCH_ROWS = 50000
+DEFAULT_LAG_SECONDS = 60
+
+GRANULARITIES = {"hour": "AccessLogsHourly", "day": "AccessLogsDaily"}
+
+_HOUR_BUCKET = {
+    migrations.MSSQL: "DATEADD(hour, DATEDIFF(hour, 0, Timestamp), 0)",
+    migrations.SQLITE: "strftime('%Y-%m-%d %H:00:00', Timestamp)",
+}
+
+
+# Age in seconds of RollupWatermarks.UpdatedAt, on the database clock it was written with.
+_AGE_SECONDS = {
+    migrations.MSSQL: "DATEDIFF(second, UpdatedAt, GETDATE())",
+    migrations.SQLITE: "CAST((julianday('now') - julianday(UpdatedAt)) * 86400 AS INTEGER)",
+}
+
+
+def _day_of(bucket):
+    if isinstance(bucket, str):
+        return bucket[:10] + " 00:00:00"
+    return bucket.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _read_watermark(conn, cursor):
+    cursor.execute("SELECT LastId FROM RollupWatermarks WHERE Name = ?", (WATERMARK,))
+    row = cursor.fetchone()
+    if row is not None:
+        return row[0]
+    cursor.execute("INSERT INTO RollupWatermarks (Name, LastId) VALUES (?, 0)", (WATERMARK,))
+    conn.commit()
+    return 0
+
+
+def _add_counts(cursor, table, counts):
+    for (bucket, user), count in counts.items():
+        cursor.execute(
+            f"UPDATE {table} SET RequestCount = RequestCount + ? WHERE BucketStart = ? AND [User] = ?",
+            (count, bucket, user)
+        )
+        if cursor.rowcount == 0:
+            cursor.execute(
+                f"INSERT INTO {table} (BucketStart, [User], RequestCount) VALUES (?, ?, ?)",
+                (bucket, user, count)
+            )
+
+
+def safe_upper_id(conn, lag=DEFAULT_LAG_SECONDS):
+    """
+    The highest Id that is safe to roll up: MAX(Id) as observed at least `lag`
+    seconds ago (None if no observation is old enough yet). Records the current
+    MAX(Id) as the next observation whenever the previous one is consumed.
+    With `lag` <= 0, returns the current MAX(Id).
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(Id) FROM AccessLogs")
+        row = cursor.fetchone()
+        max_id = (row[0] if row else None) or 0
+        if lag <= 0:
+            conn.rollback()
+            return max_id
+        cursor.execute(
+            f"SELECT LastId, {_AGE_SECONDS[migrations.dialect_of(conn)]} FROM RollupWatermarks WHERE Name = ?",
+            (OBSERVED,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("INSERT INTO RollupWatermarks (Name, LastId) VALUES (?, ?)", (OBSERVED, max_id))
+            conn.commit()
+            return None
+        observed, age = row
+        if age is None or age < lag:
+            conn.rollback()
+            return None
+        # Conditional on LastId so that of two overlapping passes only one moves the observation.
+        cursor.execute(
+            "UPDATE RollupWatermarks SET LastId = ?, UpdatedAt = CURRENT_TIMESTAMP WHERE Name = ? AND LastId = ?",
+            (max_id, OBSERVED, observed)
+        )
+        conn.commit()
+        return observed
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def rollup_batch(conn, batch_rows=DEFAULT_BATCH_ROWS, upper_id=None):
+    """
+    Rolls up the next `batch_rows` AccessLogs rows past the watermark, but not past
+    `upper_id` (see safe_upper_id), in one transaction. Returns the number of rows
+    aggregated (0 when caught up).
+    """
+    cursor = conn.cursor()
+    try:
+        last_id = _read_watermark(conn, cursor)
+        cursor.execute("SELECT MAX(Id) FROM AccessLogs")
+        row = cursor.fetchone()
+        max_id = row[0] if row else None
+        if max_id is not None and upper_id is not None:
+            max_id = min(max_id, upper_id)
+        if max_id is None or max_id <= last_id:
+            conn.rollback()
+            return 0
+        upper = migrations.next_id_boundary(conn, cursor, "AccessLogs", last_id, max_id, batch_rows)
+        if upper is None:
+            conn.rollback()
+            return 0
+
+        # Claim the range first: the watermark row lock serialises concurrent passes, and
+        # a pass that lost the race sees LastId moved and backs off.
+        cursor.execute(
+            "UPDATE RollupWatermarks SET LastId = ?, UpdatedAt = CURRENT_TIMESTAMP WHERE Name = ? AND LastId = ?",
+            (upper, WATERMARK, last_id)
+        )
+        if cursor.rowcount != 1:
+            conn.rollback()
+            return 0
+
+        bucket = _HOUR_BUCKET[migrations.dialect_of(conn)]
+        cursor.execute(
+            f"SELECT {bucket}, COALESCE([User], ''), COUNT(*) FROM AccessLogs "
+            f"WHERE Id > ? AND Id <= ? GROUP BY {bucket}, COALESCE([User], '')",
+            (last_id, upper)
+        )
+        hourly = {(hour, user): count for hour, user, count in cursor.fetchall()}
+        daily = defaultdict(int)
+        for (hour, user), count in hourly.items():
+            daily[(_day_of(hour), user)] += count
+
+        _add_counts(cursor, "AccessLogsHourly", hourly)
+        _add_counts(cursor, "AccessLogsDaily", daily)
+        conn.commit()
+        return sum(hourly.values())
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def run(batch_rows=DEFAULT_BATCH_ROWS, max_batches=None, lag=DEFAULT_LAG_SECONDS):
+    """
+    Rolls up the rows past the watermark that are at least `lag` seconds settled
+    (see safe_upper_id) on a pooled connection, one transaction per `batch_rows`
+    rows. Returns the number of rows aggregated.
+    """
+    total = 0
+    batches = 0
+    with db_manager.get_pool().connection() as conn:
+        upper_id = safe_upper_id(conn, lag)
+        if upper_id is None:
+            return 0
+        while max_batches is None or batches < max_batches:
+            with metrics.track_backend("rollup_batch"):
+                rows = rollup_batch(conn, batch_rows, upper_id)
+            if not rows:
+                break
+            total += rows
+            batches += 1
+    if total:
+        logging.info(f"Rolled up {total} AccessLogs rows in {batches} batches.")
+    return total
+
+
+# --- Query API (reads only the rollup tables) ---
+
+def _bucket_value(value):
+    return datetime.datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _read(query_by_dialect, params):
+    with db_manager.get_pool().connection() as conn:
+        dialect = migrations.dialect_of(conn)
+        params = [migrations.datetime_param(conn, p) if isinstance(p, datetime.datetime) else p for p in params]
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query_by_dialect[dialect], params)
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        conn.rollback()
+    results = [dict(zip(columns, row)) for row in rows]
+    for result in results:
+        if "bucket_start" in result:
+            result["bucket_start"] = _bucket_value(result["bucket_start"])
+    return results
+
+
+def _table(granularity):
+    try:
+        return GRANULARITIES[granularity]
+    except KeyError:
+        raise ValueError(f"Unknown granularity {granularity!r}; expected one of {sorted(GRANULARITIES)}.")
+
+
+def counts_by_user(start, end, granularity="hour", user=None):
+    """
+    Request counts per bucket and user for buckets starting in [start, end):
+    [{"bucket_start": datetime, "user": str, "count": int}, ...] in bucket order.
+    """
+    table = _table(granularity)
+    query = (f"SELECT BucketStart AS bucket_start, [User] AS [user], RequestCount AS [count] FROM {table} "
+             "WHERE BucketStart >= ? AND BucketStart < ?")
+    params = [start, end]
+    if user is not None:
+        query += " AND [User] = ?"
+        params.append(user)
+    query += " ORDER BY BucketStart, [User]"
+    return _read({migrations.MSSQL: query, migrations.SQLITE: query}, params)
+
+
+def counts_by_bucket(start, end, granularity="hour"):
+    """
+    Total request counts per bucket (all users) for buckets starting in [start, end).
+    """
+    table = _table(granularity)
+    query = (f"SELECT BucketStart AS bucket_start, SUM(RequestCount) AS [count] FROM {table} "
+             "WHERE BucketStart >= ? AND BucketStart < ? GROUP BY BucketStart ORDER BY BucketStart")
+    return _read({migrations.MSSQL: query, migrations.SQLITE: query}, [start, end])
+
+
+def top_users(start, end, limit=10, granularity="day"):
+    """
+    The `limit` users with the most requests in buckets starting in [start, end).
+    """
+    table = _table(granularity)
+    select = "[User] AS [user], SUM(RequestCount) AS [count]"
+    rest = (f"FROM {table} WHERE BucketStart >= ? AND BucketStart < ? "
+            "GROUP BY [User] ORDER BY SUM(RequestCount) DESC, [User]")
+    return _read({
+        migrations.MSSQL: f"SELECT TOP ({int(limit)}) {select} {rest}",
+        migrations.SQLITE: f"SELECT {select} {rest} LIMIT {int(limit)}",
+    }, [start, end])
+
+
+def _parse_datetime(value):
+    return datetime.datetime.fromisoformat(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AccessLogs hourly/daily rollups.")
+    migrations.add_connection_args(parser)
+    parser.add_argument("command", choices=["run", "hourly", "daily", "top"])
+    parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS)
+    parser.add_argument("--lag", type=int, default=DEFAULT_LAG_SECONDS,
+                        help="Seconds an observed MAX(Id) must settle before it is rolled up (0: no lag).")
+    parser.add_argument("--start", type=_parse_datetime, help="ISO date/time (default: 24 hours ago).")
+    parser.add_argument("--end", type=_parse_datetime, help="ISO date/time (default: now).")
+    parser.add_argument("--user")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    db_manager.configure_pool(migrations.connection_factory(args), max_size=1)
+    if args.command == "run":
+        print(f"Rolled up {run(args.batch_rows, lag=args.lag)} rows.")
+        return
+    end = args.end or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    start = args.start or end - datetime.timedelta(days=1)
+    if args.command == "top":
+        rows = top_users(start, end, args.limit)
+    else:
+        rows = counts_by_user(start, end, "hour" if args.command == "hourly" else "day", args.user)
+    for row in rows:
+        print("  ".join(str(value) for value in row.values()))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+import atexit
+import logging
+
+from Shared import config
+from Shared import db_manager
+from Shared import metrics
+
+
+class Spool:
+    """
+    Local durable queue of statement parameters, stored in a SQLite file in WAL mode.
+
+    `append()` commits one row locally (no network round trip); `peek()`/`ack()` let
+    a drainer replay rows in order and delete them only once they are in the database.
+    Rows that keep failing are moved to a `dead_letter` table in the same file.
+    """
+
+    def __init__(self, path, synchronous="NORMAL"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL survives process crashes; FULL also survives power loss at the cost of an fsync per append.
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                params TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                seq INTEGER PRIMARY KEY,
+                params TEXT NOT NULL,
+                error TEXT,
+                created REAL NOT NULL
+            )
+        """)
+
+    def append(self, params):
+        with self._lock:
+            self._conn.execute("INSERT INTO spool (params, created) VALUES (?, ?)",
+                               (json.dumps(params), time.time()))
+
+    def peek(self, limit):
+        """
+        Returns up to `limit` of the oldest rows as `(seq, params, attempts)`.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, params, attempts FROM spool ORDER BY seq LIMIT ?", (limit,)).fetchall()
+        return [(seq, json.loads(params), attempts) for seq, params, attempts in rows]
+
+    def ack(self, seqs):
+        with self._lock:
+            self._conn.executemany("DELETE FROM spool WHERE seq = ?", [(seq,) for seq in seqs])
+
+    def record_failure(self, seqs):
+        with self._lock:
+            self._conn.executemany("UPDATE spool SET attempts = attempts + 1 WHERE seq = ?",
+                                   [(seq,) for seq in seqs])
+
+    def dead_letter(self, seq, error):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dead_letter (seq, params, error, created) "
+                    "SELECT seq, params, ?, created FROM spool WHERE seq = ?", (str(error), seq))
+                self._conn.execute("DELETE FROM spool WHERE seq = ?", (seq,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def requeue_dead_letters(self):
+        """
+        Moves dead-lettered rows back into the spool (e.g. after fixing the schema).
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                count = self._conn.execute(
+                    "INSERT INTO spool (params, created) SELECT params, created FROM dead_letter ORDER BY seq"
+                ).rowcount
+                self._conn.execute("DELETE FROM dead_letter")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def depth(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def dead_letter_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SpoolDrainer:
+    """
+    Background thread that replays a Spool into the database with one `executemany`
+    and one commit per batch (at-least-once: rows are deleted from the spool only
+    after the commit, so `query` should ignore rows it has already applied).
+
+    While the database is unreachable the drainer backs off exponentially up to
+    `max_backoff` seconds and keeps the rows. If a batch fails but the database is
+    reachable, rows are retried one by one; a row that fails `max_attempts` such retries is
+    moved to the spool's dead-letter table so it cannot block the rest.
+    """
+
+    def __init__(self, spool, query, pool=None, batch_size=500, interval=1.0,
+                 max_backoff=30.0, max_attempts=20):
+        self.spool = spool
+        self.query = query
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self._pool = pool
+
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._stats = {"drained": 0, "batches": 0, "failures": 0, "dead_lettered": 0}
+        self._stats_lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name="sql-spool-drainer", daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        """
+        Wakes the drainer early (e.g. after an append).
+        """
+        self._wake.set()
+
+    def drain(self):
+        """
+        Replays batches until the spool is empty or a batch fails. Returns rows written.
+        """
+        written = 0
+        while True:
+            rows = self.spool.peek(self.batch_size)
+            if not rows:
+                return written
+            count = self._write(rows)
+            written += count
+            if count < len(rows):
+                return written
+
+    def close(self, timeout=10.0):
+        """
+        Stops the thread after a final drain attempt; undrained rows stay in the spool.
+        """
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pending"] = self.spool.depth()
+        stats["dead_letter"] = self.spool.dead_letter_count()
+        stats["backoff"] = self._backoff
+        return stats
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+
+    def _run(self):
+        while True:
+            if self._backoff:
+                self._wake.wait(max(0.0, self._retry_at - time.monotonic()))
+            else:
+                self._wake.wait(self.interval)
+            self._wake.clear()
+            stopping = self._stopped.is_set()
+            # notify() must not cut a backoff short, except for the final drain on close().
+            if not stopping and self._backoff and time.monotonic() < self._retry_at:
+                continue
+            try:
+                self.drain()
+            except Exception as e:
+                logging.error(f"Spool drain failed: {e}")
+            if stopping:
+                return
+
+    def _write(self, rows):
+        """
+        Writes one batch; returns how many rows left the spool (written or dead-lettered).
+        """
+        seqs = [seq for seq, _, _ in rows]
+        try:
+            pool = self._pool or db_manager.get_pool()
+            with metrics.track_backend("spool_drain"), pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    if hasattr(cursor, "fast_executemany"):
+                        cursor.fast_executemany = True
+                    cursor.executemany(self.query, [params for _, params, _ in rows])
+                    conn.commit()
+                except Exception as e:
+                    logging.warning(f"Spool batch of {len(rows)} rows failed ({e}); retrying row by row.")
+                    conn.rollback()
+                    return self._write_rows(conn, rows)
+                finally:
+                    cursor.close()
+        except Exception as e:
+            # No usable connection: keep everything and back off (doesn't count as an attempt).
+            self._failed(seqs, e, count_attempt=False)
+            return 0
+        self.spool.ack(seqs)
+        self._backoff = 0.0
+        self._count(drained=len(rows), batches=1)
+        return len(rows)
+
+    def _write_rows(self, conn, rows):
+        written, failed, last_error = [], [], None
+        cursor = conn.cursor()
+        try:
+            for seq, params, attempts in rows:
+                try:
+                    cursor.execute(self.query, params)
+                    conn.commit()
+                    written.append(seq)
+                except Exception as e:
+                    conn.rollback()
+                    failed.append((seq, params, attempts))
+                    last_error = e
+        finally:
+            cursor.close()
+
+        self.spool.ack(written)
+        self._count(drained=len(written), batches=1)
+        dead = 0
+        for seq, params, attempts in failed:
+            if attempts + 1 >= self.max_attempts:
+                logging.error(f"Spooled row {params!r} dead-lettered after {attempts + 1} attempts: {last_error}")
+                self.spool.dead_letter(seq, last_error)
+                dead += 1
+        self._count(dead_lettered=dead)
+        retry = [seq for seq, _, attempts in failed if attempts + 1 < self.max_attempts]
+        if retry:
+            self._failed(retry, last_error)
+        else:
+            self._backoff = 0.0
+        return len(written) + dead
+
+    def _failed(self, seqs, error, count_attempt=True):
+        if count_attempt:
+            self.spool.record_failure(seqs)
+        self._backoff = min(self.max_backoff, max(self.interval, self._backoff * 2))
+        self._retry_at = time.monotonic() + self._backoff
+        self._count(failures=1)
+        logging.error(f"Spool drain of {len(seqs)} rows failed, retrying in {self._backoff:.1f}s: {error}")
+
+
+# One spool + drainer per statement, shared by all invocations on this worker
+_drainers = {}
+_drainers_lock = threading.Lock()
+
+
+def get_spool_drainer(query, name):
+    """
+    Returns the shared SpoolDrainer for `query`, spooling to `<SpoolDirectory>/<name>.db`
+    (default: the system temp directory) and configured from `SpoolBatchSize`,
+    `SpoolDrainInterval`, `SpoolMaxBackoff` and `SpoolMaxAttempts`.
+    """
+    drainer = _drainers.get(query)
+    if drainer is None:
+        with _drainers_lock:
+            drainer = _drainers.get(query)
+            if drainer is None:
+                directory = os.environ.get("SpoolDirectory") or tempfile.gettempdir()
+                os.makedirs(directory, exist_ok=True)
+                spool = Spool(os.path.join(directory, f"{name}.db"),
+                              synchronous="FULL" if config.env_flag("SpoolSyncFull") else "NORMAL")
+                drainer = SpoolDrainer(
+                    spool, query,
+                    batch_size=config.env_int("SpoolBatchSize", 500),
+                    interval=config.env_float("SpoolDrainInterval", 1.0),
+                    max_backoff=config.env_float("SpoolMaxBackoff", 30.0),
+                    max_attempts=config.env_int("SpoolMaxAttempts", 20),
+                )
+                _drainers[query] = drainer
+    return drainer
+
+
+metrics.REGISTRY.gauge(
+    "sql_spool_pending_rows", "Rows waiting in the local write-behind spool, by spool file.", ("spool",),
+    callback=lambda: {(os.path.basename(d.spool.path),): d.spool.depth() for d in list(_drainers.values())})
+
+
+@atexit.register
+def close_spool_drainers():
+    """
+    Gives each drainer one last chance to empty its spool; the rest is replayed on next start.
+    """
+    with _drainers_lock:
+        drainers = list(_drainers.values())
+        _drainers.clear()
+    for drainer in drainers:
+        try:
+            drainer.close()
+            drainer.spool.close()
+        except Exception as e:
+            logging.error(f"Failed to stop spool drainer on shutdown: {e}")
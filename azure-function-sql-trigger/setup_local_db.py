@@ -2,6 +2,8 @@ import pyodbc
 import time
 import sys
 
+from Shared import migrations
+
 # Local Docker connection string
 CONN_STR = "Driver={ODBC Driver 18 for SQL Server};Server=127.0.0.1,1433;Uid=sa;Pwd=Strong!Pass123;Encrypt=no;TrustServerCertificate=yes;Connection Timeout=30;"
 
@@ -25,21 +27,13 @@ def init_db():
         cursor.close()
         conn.close()
 
-        # 2. Connect to 'FunctionDB' to create Table
-        conn = pyodbc.connect(CONN_STR + "Database=FunctionDB;", autocommit=True)
-        cursor = conn.cursor()
-        
-        # Create Table
-        print("Checking for 'AccessLogs' table...")
-        cursor.execute("""
-            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AccessLogs' AND xtype='U')
-            CREATE TABLE AccessLogs (
-                Id INT IDENTITY(1,1) PRIMARY KEY,
-                [User] NVARCHAR(100),
-                Timestamp DATETIME DEFAULT GETDATE()
-            )
-        """)
-        print("[PASS] Table 'AccessLogs' is ready.")
+        # 2. Connect to 'FunctionDB' and bring the schema up to date
+        conn = pyodbc.connect(CONN_STR + "Database=FunctionDB;")
+        print(f"Schema version: {migrations.current_version(conn)}")
+        applied = migrations.migrate(conn)
+        for version in applied:
+            print(f"[PASS] Applied migration {version}.")
+        print(f"[PASS] Table 'AccessLogs' is ready (schema version {migrations.current_version(conn)}).")
         
         conn.close()
         print("\nSUCCESS: Local SQL Environment is fully prepared.")
@@ -1,5 +1,7 @@
-from azure.storage.blob import BlobServiceClient
 import os
+import time
+
+from Shared import blob_manager
 
 # Azurite Default Connection String
 AZURITE_CONN_STR = "DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;"
@@ -10,29 +12,35 @@ BLOB_NAME = "test-log.txt"
 print(f"--- Testing Azurite Blob Storage (Object Storage) ---")
 
 try:
-    # 1. Connect
-    blob_service_client = BlobServiceClient.from_connection_string(AZURITE_CONN_STR)
+    # 1. Connect (one pooled client per process, reused by every call below)
+    blob_manager.configure_blob_client(connection_string=AZURITE_CONN_STR)
     print("[PASS] Connected to Azurite.")
 
-    # 2. Create Container (if not exists)
-    container_client = blob_service_client.get_container_client(CONTAINER_NAME)
-    if not container_client.exists():
-        container_client.create_container()
-        print(f"[PASS] Created container '{CONTAINER_NAME}'.")
-    else:
-        print(f"[INFO] Container '{CONTAINER_NAME}' already exists.")
-
-    # 3. Upload Blob
-    blob_client = blob_service_client.get_blob_client(container=CONTAINER_NAME, blob=BLOB_NAME)
+    # 2. Upload Blob (the container is created on first use)
     data = "Hello from Azurite Object Storage!"
-    blob_client.upload_blob(data, overwrite=True)
+    blob_manager.upload_blob(CONTAINER_NAME, BLOB_NAME, data)
     print(f"[PASS] Uploaded blob '{BLOB_NAME}'.")
 
-    # 4. Read Blob
-    download_stream = blob_client.download_blob()
-    content = download_stream.readall()
+    # 3. Read Blob
+    content = blob_manager.download_blob(CONTAINER_NAME, BLOB_NAME)
     print(f"  -> Read Content: {content.decode('utf-8')}")
 
+    # 4. Large payload: parallel block upload and ranged download
+    payload = os.urandom(16 * 1024 * 1024)
+    started = time.perf_counter()
+    blob_manager.upload_blob(CONTAINER_NAME, "large-test.bin", payload)
+    uploaded = time.perf_counter()
+    assert blob_manager.download_blob(CONTAINER_NAME, "large-test.bin") == payload
+    print(f"[PASS] 16 MiB round trip: upload {uploaded - started:.2f}s, download {time.perf_counter() - uploaded:.2f}s.")
+
+    # 5. Append blob batching
+    writer = blob_manager.get_append_writer(CONTAINER_NAME, "test-append.log")
+    futures = [writer.submit(f"line {i}") for i in range(1000)]
+    writer.flush()
+    for future in futures:
+        future.result()
+    print(f"[PASS] Appended 1000 lines in {writer.stats()['blocks']} block(s).")
+
     print("[PASS] Blob Storage verification successful.")
 
 except Exception as e:
@@ -8,9 +8,9 @@ try:
     cursor = conn.cursor()
     
     print("--- Reading from AccessLogs ---")
-    cursor.execute("SELECT * FROM AccessLogs")
-    rows = cursor.fetchall()
-    for row in rows:
+    cursor.execute("SELECT * FROM AccessLogs ORDER BY Id")
+    # Iterating the cursor streams rows; use Shared/export.py for full offloads.
+    for row in cursor:
         print(row)
         
     conn.close()
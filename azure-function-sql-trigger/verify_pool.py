@@ -0,0 +1,59 @@
+import sqlite3
+import sys
+import os
+import time
+
+# Add current dir to path so Shared can be imported
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from Shared.db_manager import ConnectionPool
+
+print("--- Testing Connection Pool (SQLite in-memory) ---")
+
+
+def connect():
+    return sqlite3.connect(":memory:", check_same_thread=False)
+
+
+failed = False
+
+# 1. All idle connections expired while the pool is at max_size:
+#    checkout must replace them at once, not wait for checkout_timeout.
+pool = ConnectionPool(connect, max_size=2, checkout_timeout=3.0, idle_timeout=0.05)
+first, second = pool.checkout(), pool.checkout()
+pool.checkin(first)
+pool.checkin(second)
+time.sleep(0.1)
+
+started = time.monotonic()
+conn = pool.checkout()
+elapsed = time.monotonic() - started
+stats = pool.stats()
+pool.checkin(conn)
+pool.close()
+
+if elapsed < 1.0 and stats["closed"] == 2 and stats["created"] == 3 and stats["waits"] == 0:
+    print(f"[PASS] Expired idle connections replaced without waiting ({elapsed * 1000:.1f} ms).")
+else:
+    print(f"[FAIL] Checkout after idle expiry took {elapsed:.2f}s; stats: {stats}")
+    failed = True
+
+# 2. With one connection still checked out, only the expired idle one is closed and replaced.
+pool = ConnectionPool(connect, min_size=0, max_size=2, checkout_timeout=0.2, idle_timeout=0.05)
+held, idle = pool.checkout(), pool.checkout()
+pool.checkin(idle)
+time.sleep(0.1)
+conn = pool.checkout()  # replaces the expired idle connection
+stats = pool.stats()
+pool.checkin(held)
+pool.checkin(conn)
+pool.close()
+
+if stats["closed"] == 1 and stats["size"] == 2:
+    print("[PASS] Expired connection closed and its slot reused.")
+else:
+    print(f"[FAIL] Unexpected pool state after expiry: {stats}")
+    failed = True
+
+print("--- Verification Complete ---")
+sys.exit(1 if failed else 0)
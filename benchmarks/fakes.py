@@ -0,0 +1,210 @@
+"""
+Local stand-ins for the cloud backends, with optional latency injection.
+
+- `sqlite_connect()` returns a DB-API connection factory for `db_manager.configure_pool`
+  (SQLite standing in for Azure SQL / pyodbc).
+- `FakeFirestoreManager` / `FakeStorageManager` mirror the public methods of the
+  GCP managers (including the `*_async` ones used by `main_async`) and keep
+  everything in memory.
+"""
+import asyncio
+import datetime
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from harness import record_stage
+
+
+class Latency:
+    """
+    Sleeps `base_ms` plus up to `jitter_ms` of uniform noise per backend call.
+    """
+
+    def __init__(self, base_ms=0.0, jitter_ms=0.0):
+        self.base = base_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+
+    def delay(self):
+        return self.base + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def wait(self):
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        delay = self.delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# --- SQL (pyodbc stand-in) ---
+
+class _TimedCursor:
+    def __init__(self, cursor, latency):
+        self._cursor = cursor
+        self._latency = latency
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        self._latency.wait()
+        self._cursor.execute(sql, params)
+        record_stage("sql.execute", time.perf_counter() - start)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        start = time.perf_counter()
+        self._latency.wait()
+        self._cursor.executemany(sql, seq_of_params)
+        record_stage("sql.executemany", time.perf_counter() - start)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _TimedConnection:
+    def __init__(self, conn, latency):
+        self._conn = conn
+        self._latency = latency
+
+    def cursor(self):
+        return _TimedCursor(self._conn.cursor(), self._latency)
+
+    def commit(self):
+        start = time.perf_counter()
+        self._latency.wait()
+        self._conn.commit()
+        record_stage("sql.commit", time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _getdate():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def sqlite_connect(path, latency=None, connect_latency=None):
+    """
+    Returns a zero-argument connection factory for `db_manager.configure_pool`.
+    Registers GETDATE() so the production T-SQL statements run unchanged.
+    """
+    latency = latency or Latency()
+    connect_latency = connect_latency or Latency()
+
+    def connect():
+        start = time.perf_counter()
+        connect_latency.wait()
+        conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.create_function("GETDATE", 0, _getdate)
+        record_stage("sql.connect", time.perf_counter() - start)
+        return _TimedConnection(conn, latency)
+
+    return connect
+
+
+def create_access_logs(path):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS AccessLogs (
+            Id INTEGER PRIMARY KEY AUTOINCREMENT,
+            [User] NVARCHAR(100),
+            Timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            RequestId NVARCHAR(64) UNIQUE
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+
+# --- GCP managers ---
+
+class FakeFirestoreManager:
+    def __init__(self, latency=None):
+        self._latency = latency or Latency()
+        self._lock = threading.Lock()
+        self.collections = {}
+
+    def add_log(self, collection_name, data):
+        start = time.perf_counter()
+        self._latency.wait()
+        doc_id = uuid.uuid4().hex[:20]
+        with self._lock:
+            self.collections.setdefault(collection_name, {})[doc_id] = dict(data)
+        record_stage("firestore.add_log", time.perf_counter() - start)
+        return doc_id
+
+    async def add_log_async(self, collection_name, data):
+        start = time.perf_counter()
+        await self._latency.wait_async()
+        doc_id = uuid.uuid4().hex[:20]
+        with self._lock:
+            self.collections.setdefault(collection_name, {})[doc_id] = dict(data)
+        record_stage("firestore.add_log", time.perf_counter() - start)
+        return doc_id
+
+    def get_logs(self, collection_name, limit=10):
+        return self.get_logs_page(collection_name, limit)[0]
+
+    def get_logs_page(self, collection_name, limit=10, cursor=None):
+        start = time.perf_counter()
+        self._latency.wait()
+        page = self._page(collection_name, limit, cursor)
+        record_stage("firestore.get_logs", time.perf_counter() - start)
+        return page
+
+    async def get_logs_page_async(self, collection_name, limit=10, cursor=None):
+        start = time.perf_counter()
+        await self._latency.wait_async()
+        page = self._page(collection_name, limit, cursor)
+        record_stage("firestore.get_logs", time.perf_counter() - start)
+        return page
+
+    def _page(self, collection_name, limit, cursor):
+        with self._lock:
+            docs = sorted(self.collections.get(collection_name, {}).items(),
+                          key=lambda item: (item[1].get("timestamp", ""), item[0]), reverse=True)
+        offset = int(cursor) if cursor else 0
+        page = docs[offset:offset + limit]
+        next_cursor = str(offset + limit) if offset + limit < len(docs) else None
+        return [{**data, "id": doc_id} for doc_id, data in page], next_cursor
+
+
+class FakeStorageManager:
+    def __init__(self, latency=None):
+        self._latency = latency or Latency()
+        self._lock = threading.Lock()
+        self.blobs = {}
+
+    def upload_log(self, content, filename=None):
+        start = time.perf_counter()
+        self._latency.wait()
+        if not filename:
+            filename = f"log-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.txt"
+        with self._lock:
+            self.blobs[filename] = content
+        record_stage("storage.upload_log", time.perf_counter() - start)
+        return filename
+
+    async def upload_log_async(self, content, filename=None):
+        start = time.perf_counter()
+        await self._latency.wait_async()
+        if not filename:
+            filename = f"log-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.txt"
+        with self._lock:
+            self.blobs[filename] = content
+        record_stage("storage.upload_log", time.perf_counter() - start)
+        return filename
+
+    def list_files(self):
+        start = time.perf_counter()
+        self._latency.wait()
+        with self._lock:
+            names = sorted(self.blobs)
+        record_stage("storage.list_files", time.perf_counter() - start)
+        return names
@@ -0,0 +1,218 @@
+"""
+Load-generation and latency bookkeeping shared by the benchmark targets.
+
+A target is a zero-argument callable that performs one request. While it runs,
+code under test (or the fakes in `fakes.py`) can call `record_stage()` /
+`stage()` to attribute time to named stages; the harness aggregates
+per-stage percentiles next to the end-to-end "request" latency.
+"""
+import contextvars
+import json
+import math
+import os
+import platform
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Per-request stage totals. A ContextVar (rather than a thread-local) also follows a
+# request into asyncio tasks; plain executor threads still need bind_sample().
+_sample = contextvars.ContextVar("benchmark_sample", default=None)
+
+
+def record_stage(name, seconds):
+    """
+    Adds `seconds` to stage `name` of the request currently running in this context.
+    Outside a benchmark request this is a no-op.
+    """
+    sample = _sample.get()
+    if sample is not None:
+        sample[name] = sample.get(name, 0.0) + seconds
+
+
+def bind_sample(fn):
+    """
+    Wraps `fn` so stages it records on another thread (e.g. an executor worker)
+    are attributed to the request that is running on the calling thread.
+    """
+    sample = _sample.get()
+
+    def bound(*args, **kwargs):
+        token = _sample.set(sample)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _sample.reset(token)
+
+    return bound
+
+
+def bind_sample_async(coro_fn):
+    """
+    Like bind_sample() for a coroutine function that is run on an event loop in
+    another thread (e.g. via asyncio.run_coroutine_threadsafe).
+    """
+    sample = _sample.get()
+
+    async def bound(*args, **kwargs):
+        # The task runs in its own copy of the context, so this doesn't leak.
+        _sample.set(sample)
+        return await coro_fn(*args, **kwargs)
+
+    return bound
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean_ms": (sum(values) / len(values) * 1000) if values else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] * 1000) if values else 0.0,
+    }
+
+
+def run_load(request_fn, concurrency, total_requests, warmup=0):
+    """
+    Calls `request_fn` `total_requests` times from `concurrency` threads and
+    returns throughput, error count and per-stage latency percentiles.
+    """
+    for _ in range(warmup):
+        request_fn()
+
+    samples = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def worker():
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            sample = {}
+            token = _sample.set(sample)
+            start = time.perf_counter()
+            try:
+                request_fn()
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            finally:
+                _sample.reset(token)
+                sample["request"] = time.perf_counter() - start
+                with lock:
+                    samples.append(sample)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - started
+
+    stage_names = sorted({name for sample in samples for name in sample})
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(errors),
+        "error_examples": errors[:5],
+        "elapsed_s": elapsed,
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+        "stages": {name: summarize([s[name] for s in samples if name in s]) for name in stage_names},
+    }
+
+
+def run_metadata():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                         stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+# Injected-latency options; runs are only compared when these match.
+LATENCY_SETTINGS = ("sql_latency_ms", "connect_latency_ms", "firestore_latency_ms", "storage_latency_ms", "jitter_ms")
+
+
+def latency_settings(config):
+    return {name: config.get(name) for name in LATENCY_SETTINGS}
+
+
+def print_report(target, result):
+    print(f"\n--- {target} | concurrency={result['concurrency']} ---")
+    print(f"  {result['requests']} requests in {result['elapsed_s']:.2f}s "
+          f"=> {result['throughput_rps']:.1f} req/s, errors: {result['errors']}")
+    for example in result["error_examples"]:
+        print(f"  [ERROR] {example}")
+    print(f"  {'stage':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, s in result["stages"].items():
+        print(f"  {name:<28}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['max_ms']:>10.2f}")
+
+
+def save_results(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n[INFO] Results written to {path}")
+
+
+def compare_results(baseline_path, results, threshold=0.10):
+    """
+    Prints throughput and p99 deltas against a previous run; returns the number of
+    (target, concurrency) pairs that regressed by more than `threshold`. Pairs missing
+    from the baseline, or measured with different injected latency, are reported but
+    not compared.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old_runs = {(r["target"], r["concurrency"]): r for r in baseline.get("runs", [])}
+    # Older result files only carry the settings once, in "config".
+    baseline_latency = latency_settings(baseline.get("config", {}))
+    regressions = 0
+    print(f"\n--- Comparison against {baseline_path} ---")
+    for run in results["runs"]:
+        old = old_runs.get((run["target"], run["concurrency"]))
+        if old is None:
+            print(f"  [NO BASELINE] {run['target']} c={run['concurrency']}")
+            continue
+        old_latency = old.get("latency", baseline_latency)
+        if old_latency != run["latency"]:
+            changed = ", ".join(f"{name} {old_latency[name]} -> {run['latency'][name]}"
+                                for name in LATENCY_SETTINGS if old_latency.get(name) != run["latency"][name])
+            print(f"  [SKIPPED] {run['target']} c={run['concurrency']}: latency settings differ ({changed})")
+            continue
+        rps_delta = (run["throughput_rps"] - old["throughput_rps"]) / old["throughput_rps"] if old["throughput_rps"] else 0.0
+        old_p99 = old["stages"]["request"]["p99_ms"]
+        p99_delta = (run["stages"]["request"]["p99_ms"] - old_p99) / old_p99 if old_p99 else 0.0
+        regressed = rps_delta < -threshold or p99_delta > threshold
+        regressions += regressed
+        flag = "[REGRESSION]" if regressed else "[OK]"
+        print(f"  {flag} {run['target']} c={run['concurrency']}: "
+              f"req/s {rps_delta:+.1%}, p99 {p99_delta:+.1%}")
+    return regressions
@@ -0,0 +1,72 @@
+"""
+Offline load test for both entry points.
+
+Examples:
+    python3 benchmarks/run.py --target all --concurrency 1,8,32 --requests 2000
+    python3 benchmarks/run.py --target cloudrun --firestore-latency-ms 20 --output after.json --compare before.json
+"""
+import argparse
+import importlib.util
+import sys
+import tempfile
+
+from harness import compare_results, latency_settings, print_report, run_load, run_metadata, save_results
+from targets import TARGET_REQUIRES, TARGETS
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="In-process load test against local backend stand-ins.")
+    parser.add_argument("--target", choices=sorted(TARGETS) + ["all"], default="all")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated thread counts.")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per concurrency level.")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--sql-latency-ms", type=float, default=2.0, help="Injected per execute/commit.")
+    parser.add_argument("--connect-latency-ms", type=float, default=50.0, help="Injected per new SQL connection.")
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--firestore-latency-ms", type=float, default=10.0)
+    parser.add_argument("--storage-latency-ms", type=float, default=15.0)
+    parser.add_argument("--jitter-ms", type=float, default=2.0)
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    parser.add_argument("--compare", help="Previous JSON results to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change treated as a regression.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    targets = sorted(TARGETS) if args.target == "all" else [args.target]
+    for target in list(targets):
+        missing = [m for m in TARGET_REQUIRES.get(target, ()) if importlib.util.find_spec(m) is None]
+        if not missing:
+            continue
+        if args.target != "all":
+            print(f"[ERROR] Target {target} needs {', '.join(missing)} (pip install {' '.join(missing)}).")
+            return 2
+        print(f"[SKIP] Target {target} needs {', '.join(missing)} (pip install {' '.join(missing)}).")
+        targets.remove(target)
+    results = {"metadata": run_metadata(), "config": vars(args), "runs": []}
+    latency = latency_settings(vars(args))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for target in targets:
+            request_fn, teardown = TARGETS[target](args, workdir)
+            try:
+                for concurrency in levels:
+                    result = run_load(request_fn, concurrency, args.requests, warmup=args.warmup)
+                    result["target"] = target
+                    result["latency"] = latency
+                    results["runs"].append(result)
+                    print_report(target, result)
+            finally:
+                teardown()
+
+    if args.output:
+        save_results(args.output, results)
+    if args.compare:
+        return 1 if compare_results(args.compare, results, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Benchmark targets: each `setup_*` wires one entry point to local fakes and returns
+`(request_fn, teardown_fn)`.
+
+Both projects ship a top-level `Shared` package, so a target swaps the project
+directory onto `sys.path` and drops the other project's modules first.
+"""
+import asyncio
+import os
+import sys
+import threading
+
+from harness import bind_sample, bind_sample_async
+from fakes import (FakeFirestoreManager, FakeStorageManager, Latency,
+                   create_access_logs, sqlite_connect)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT_MODULES = ("Shared", "HttpTriggerTest", "main", "main_async")
+
+
+def _use_project(dirname):
+    for name in list(sys.modules):
+        if name.split(".")[0] in PROJECT_MODULES:
+            del sys.modules[name]
+    project_dir = os.path.join(REPO_ROOT, dirname)
+    sys.path[:] = [p for p in sys.path if not p.startswith(REPO_ROOT + os.sep)]
+    sys.path.insert(0, project_dir)
+
+
+def setup_azure_trigger(args, workdir):
+    """
+    Drives `HttpTriggerTest.main` with `Shared.db_manager` pointed at SQLite.
+    """
+    _use_project("azure-function-sql-trigger")
+    import azure.functions as func
+    from Shared import db_manager
+    import HttpTriggerTest
+
+    db_path = os.path.join(workdir, "bench_access_logs.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    create_access_logs(db_path)
+    db_manager.configure_pool(
+        connect=sqlite_connect(db_path,
+                               latency=Latency(args.sql_latency_ms, args.jitter_ms),
+                               connect_latency=Latency(args.connect_latency_ms)),
+        max_size=args.pool_size,
+    )
+
+    def request():
+        req = func.HttpRequest(method="GET", url="http://localhost/api/HttpTriggerTest",
+                               params={"name": "BenchUser"}, body=b"")
+        resp = HttpTriggerTest.main(req)
+        body = resp.get_body().decode()
+        if resp.status_code != 200 or "DB Error" in body:
+            raise RuntimeError(f"{resp.status_code}: {body}")
+
+    def teardown():
+        db_manager.close_batch_writers()
+        db_manager.get_pool().close()
+
+    return request, teardown
+
+
+def setup_cloud_run(args, workdir):
+    """
+    Drives the Flask `main.index` route through Flask's test client with in-memory
+    Firestore and Storage managers.
+    """
+    _use_project("gcp-cloud-run-storage")
+    from Shared.firestore_manager import FirestoreManager
+    from Shared.storage_manager import StorageManager
+
+    # The managers are singletons: seeding `_instance` makes `main` pick up the fakes.
+    FirestoreManager._instance = FakeFirestoreManager(Latency(args.firestore_latency_ms, args.jitter_ms))
+    StorageManager._instance = FakeStorageManager(Latency(args.storage_latency_ms, args.jitter_ms))
+    import main
+
+    # Attribute backend time spent on fan-out worker threads to the originating request.
+    executor = getattr(main, "_fanout_executor", None)
+    if executor is not None:
+        submit = executor.submit
+        executor.submit = lambda fn, *a, **kw: submit(bind_sample(fn), *a, **kw)
+
+    local = threading.local()
+
+    def request():
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = main.app.test_client()
+        resp = client.get("/?name=BenchUser")
+        if resp.status_code != 200:
+            raise RuntimeError(f"{resp.status_code}: {resp.get_data(as_text=True)}")
+        failed = [k for k, v in resp.get_json()["actions"].items() if str(v).startswith("Failed")]
+        if failed:
+            raise RuntimeError(f"backend failures: {failed}")
+
+    def teardown():
+        FirestoreManager._instance = None
+        StorageManager._instance = None
+
+    return request, teardown
+
+
+def setup_cloud_run_async(args, workdir):
+    """
+    Drives the ASGI `main_async` app (`GET /`) in-process through httpx's ASGI transport,
+    on one event loop thread shared by all load-generator threads.
+    """
+    import httpx
+
+    _use_project("gcp-cloud-run-storage")
+    from Shared.firestore_manager import FirestoreManager
+    from Shared.storage_manager import StorageManager
+
+    FirestoreManager._instance = FakeFirestoreManager(Latency(args.firestore_latency_ms, args.jitter_ms))
+    StorageManager._instance = FakeStorageManager(Latency(args.storage_latency_ms, args.jitter_ms))
+    import main_async
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="asgi-loop", daemon=True)
+    thread.start()
+
+    async def make_client():
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=main_async.app), base_url="http://bench")
+
+    client = asyncio.run_coroutine_threadsafe(make_client(), loop).result()
+
+    async def get():
+        resp = await client.get("/?name=BenchUser")
+        if resp.status_code != 200:
+            raise RuntimeError(f"{resp.status_code}: {resp.text}")
+        failed = [k for k, v in resp.json()["actions"].items() if str(v).startswith("Failed")]
+        if failed:
+            raise RuntimeError(f"backend failures: {failed}")
+
+    def request():
+        asyncio.run_coroutine_threadsafe(bind_sample_async(get)(), loop).result()
+
+    def teardown():
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        FirestoreManager._instance = None
+        StorageManager._instance = None
+
+    return request, teardown
+
+
+TARGETS = {
+    "azure": setup_azure_trigger,
+    "cloudrun": setup_cloud_run,
+    "cloudrun-async": setup_cloud_run_async,
+}
+
+# Optional modules a target needs beyond the projects' requirements.txt.
+TARGET_REQUIRES = {
+    "cloudrun-async": ("httpx",),
+}
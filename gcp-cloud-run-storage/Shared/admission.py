@@ -0,0 +1,149 @@
+"""
+Admission control for request handlers that call slow backends.
+
+AdmissionController caps the number of requests doing backend work at once and
+keeps a small, bounded wait queue in front of that cap. Requests that cannot be
+admitted are rejected straight away (queue full) or after waiting `queue_timeout`
+seconds, so callers can answer with 429/503 + Retry-After instead of tying up a
+server thread.
+
+With `adaptive=True` the cap follows observed latency (AIMD): it grows by roughly
+one slot per "window" of fast, successful requests while the cap is actually
+being used, and is cut by `backoff` when a request is slower than
+`target_latency` or fails (at most once per `target_latency` seconds).
+"""
+import math
+import threading
+import time
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is shed. `status` is the HTTP status to answer with
+    (429 when the wait queue is full, 503 when the wait timed out).
+    """
+
+    def __init__(self, reason, status, retry_after):
+        super().__init__(f"Request rejected: {reason}")
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    def __init__(self, controller):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._holds = 1             # the `with` block itself
+        self.failed = False
+
+    def mark_failed(self):
+        """
+        Counts this request as a backend failure when adjusting the limit.
+        """
+        self.failed = True
+
+    def hold_until(self, future):
+        """
+        Keeps the slot taken until `future` is done, even past the end of the `with`
+        block (e.g. a backend write that timed out but is still running).
+        """
+        with self._lock:
+            self._holds += 1
+        future.add_done_callback(lambda _: self._drop_hold())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.failed = True
+        self._drop_hold()
+        return False
+
+    def _drop_hold(self):
+        with self._lock:
+            self._holds -= 1
+            if self._holds:
+                return
+        self._controller.release(time.monotonic() - self._started, self.failed)
+
+
+class AdmissionController:
+
+    def __init__(self, limit=4, min_limit=1, max_limit=None, max_queue=4, queue_timeout=1.0,
+                 adaptive=True, target_latency=1.0, backoff=0.7):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(max_limit or limit, self.min_limit)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.backoff = backoff
+
+        self._cond = threading.Condition()
+        self._limit = float(min(max(limit, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._waiting = 0
+        self._last_decrease = 0.0
+        self._latency = None        # EWMA of admitted request latency, seconds
+        self._stats = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def admit(self):
+        """
+        Waits for a slot and returns a ticket to use as a context manager around the
+        backend work; raises AdmissionRejected if the request should be shed.
+        """
+        with self._cond:
+            if self._in_flight >= self.limit:
+                if self._waiting >= self.max_queue:
+                    self._stats["rejected_queue_full"] += 1
+                    raise AdmissionRejected("queue_full", 429, self._retry_after_locked())
+                self._waiting += 1
+                self._stats["queued"] += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self._in_flight >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats["rejected_timeout"] += 1
+                            raise AdmissionRejected("queue_timeout", 503, self._retry_after_locked())
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+        return _Ticket(self)
+
+    def release(self, latency, failed=False):
+        with self._cond:
+            saturated = self._in_flight >= self.limit
+            self._in_flight -= 1
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+            if self.adaptive:
+                now = time.monotonic()
+                if failed or latency > self.target_latency:
+                    if now - self._last_decrease >= self.target_latency:
+                        self._limit = max(self.min_limit, self._limit * self.backoff)
+                        self._last_decrease = now
+                elif saturated:
+                    # Only grow while the current limit is the bottleneck.
+                    self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            self._cond.notify_all()
+
+    def _retry_after_locked(self):
+        # Rough time for the current backlog to drain at the observed latency.
+        latency = self._latency if self._latency is not None else self.target_latency
+        return max(1, math.ceil(latency * (self._waiting + 1) / max(1, self.limit)))
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(limit=self.limit, in_flight=self._in_flight, waiting=self._waiting,
+                         latency_ms=round(self._latency * 1000, 1) if self._latency is not None else None)
+        return stats
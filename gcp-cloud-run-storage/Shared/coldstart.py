@@ -0,0 +1,64 @@
+import threading
+import time
+
+# Monotonic reference point: as close to process start as Python code can get,
+# provided this module is imported first by the entry point.
+PROCESS_START = time.monotonic()
+
+_lock = threading.Lock()
+_timings = {}
+_first_request_at = None
+
+
+def record(phase, seconds):
+    """
+    Records the duration of a cold-start phase (e.g. "import", "storage_client", "bucket_check").
+    """
+    with _lock:
+        _timings[phase] = _timings.get(phase, 0.0) + seconds
+    print(f"[ColdStart] {phase}: {seconds * 1000:.1f} ms")
+
+
+class timed:
+    """
+    Context manager that records the duration of its block as `phase`.
+    """
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.phase, time.monotonic() - self._start)
+        return False
+
+
+def mark_first_request():
+    """
+    Records the time from process start to the first request (only the first call counts).
+    """
+    global _first_request_at
+    if _first_request_at is not None:
+        return
+    with _lock:
+        if _first_request_at is not None:
+            return
+        _first_request_at = time.monotonic()
+    print(f"[ColdStart] first request after {(_first_request_at - PROCESS_START) * 1000:.1f} ms")
+
+
+def snapshot():
+    """
+    Returns the recorded phases in milliseconds plus uptime and time to first request.
+    """
+    with _lock:
+        phases = {phase: seconds * 1000 for phase, seconds in _timings.items()}
+        first = _first_request_at
+    return {
+        "phases_ms": phases,
+        "time_to_first_request_ms": (first - PROCESS_START) * 1000 if first is not None else None,
+        "uptime_s": time.monotonic() - PROCESS_START,
+    }
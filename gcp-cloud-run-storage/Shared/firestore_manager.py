@@ -1,45 +1,487 @@
 from google.cloud import firestore
+from Shared import coldstart
+from Shared import metrics
+from collections import OrderedDict
+import asyncio
+import atexit
+import base64
+import inspect
+import json
 import os
+import threading
+import time
+
+# Firestore rejects commits with more than 500 writes.
+MAX_BATCH_WRITES = 500
+
+
+class BatchedLogWriter:
+    """
+    Queues document writes and commits them with WriteBatch on a background thread.
+    A batch is committed when `batch_size` writes are queued, when the oldest queued
+    write is `flush_interval` seconds old, or on flush()/close().
+    `on_commit(batch)` is called with the (DocumentReference, data) pairs of each batch
+    once it has been committed.
+    """
+
+    def __init__(self, client, batch_size=MAX_BATCH_WRITES, flush_interval=1.0,
+                 max_queue=10000, max_retries=3, on_commit=None):
+        self._client = client
+        self._on_commit = on_commit
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_WRITES))
+        self.flush_interval = flush_interval
+        self.max_queue = max(max_queue, self.batch_size)
+        self.max_retries = max_retries
+
+        self._cond = threading.Condition()
+        self._queue = []          # list of (DocumentReference, data)
+        self._oldest = None
+        self._in_flight = 0
+        self._closed = False
+        self._stats = {"queued": 0, "committed": 0, "batches": 0, "failed": 0, "retries": 0}
+
+        self._thread = threading.Thread(target=self._run, name="firestore-batch-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, doc_ref, data):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchedLogWriter is closed.")
+            while len(self._queue) >= self.max_queue:
+                # Back-pressure: wait for the writer thread to drain a batch.
+                self._cond.notify_all()
+                self._cond.wait()
+            if not self._queue:
+                self._oldest = time.monotonic()
+            self._queue.append((doc_ref, data))
+            self._stats["queued"] += 1
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+
+    def flush(self):
+        """
+        Commits everything queued so far and waits for in-flight batches.
+        """
+        while True:
+            with self._cond:
+                batch = self._take_locked()
+                if not batch:
+                    while self._in_flight:
+                        self._cond.wait()
+                    return
+            self._commit(batch)
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._queue)
+        return stats
+
+    def _take_locked(self):
+        batch = self._queue[:self.batch_size]
+        self._queue = self._queue[self.batch_size:]
+        self._oldest = time.monotonic() if self._queue else None
+        if batch:
+            self._in_flight += 1
+        self._cond.notify_all()
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._queue) >= self.batch_size:
+                        break
+                    if self._queue:
+                        remaining = self._oldest + self.flush_interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+                batch = self._take_locked()
+            self._commit(batch)
+
+    def _commit(self, batch):
+        committed = False
+        for attempt in range(self.max_retries + 1):
+            try:
+                write_batch = self._client.batch()
+                for doc_ref, data in batch:
+                    write_batch.set(doc_ref, data)
+                with metrics.track_backend("firestore_batch_commit"):
+                    write_batch.commit()
+                committed = True
+                break
+            except Exception as e:
+                print(f"[FirestoreManager] Batch commit of {len(batch)} writes failed (attempt {attempt + 1}): {e}")
+                if attempt < self.max_retries:
+                    with self._cond:
+                        self._stats["retries"] += 1
+                    time.sleep(min(0.1 * 2 ** attempt, 2.0))
+        with self._cond:
+            self._in_flight -= 1
+            if committed:
+                self._stats["committed"] += len(batch)
+                self._stats["batches"] += 1
+            else:
+                self._stats["failed"] += len(batch)
+            self._cond.notify_all()
+        if not committed:
+            print(f"[FirestoreManager] Dropped {len(batch)} writes after {self.max_retries + 1} attempts.")
+        elif self._on_commit is not None:
+            try:
+                self._on_commit(batch)
+            except Exception as e:
+                print(f"[FirestoreManager] on_commit callback failed: {e}")
+
+
+class TTLCache:
+    """
+    Small thread-safe read-through cache: entries expire after `ttl` seconds and the
+    least recently used entry is evicted beyond `max_size`. Keys are tuples whose first
+    element is the collection name, so writes can invalidate one collection.
+    """
+
+    def __init__(self, ttl=5.0, max_size=128):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, collection_name):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == collection_name]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+def _encode_cursor(timestamp, doc_id):
+    return base64.urlsafe_b64encode(json.dumps([timestamp, doc_id]).encode("utf-8")).decode("ascii")
+
+
+class InvalidCursor(ValueError):
+    """
+    A page cursor that was not produced by get_logs_page (malformed or tampered with).
+    """
+
+
+def _decode_cursor(cursor):
+    try:
+        timestamp, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise InvalidCursor(f"Invalid page cursor: {cursor!r}")
+    if not isinstance(doc_id, str) or not doc_id or "/" in doc_id or not isinstance(timestamp, (str, type(None))):
+        raise InvalidCursor(f"Invalid page cursor: {cursor!r}")
+    return timestamp, doc_id
+
 
 class FirestoreManager:
     _instance = None
     _client = None
+    _async_client = None
+    _writer = None
+    _project_id = None
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(FirestoreManager, cls).__new__(cls)
-            cls._instance._init_client()
+            instance = super(FirestoreManager, cls).__new__(cls)
+            instance._configure()
+            cls._instance = instance
         return cls._instance
 
+    def _configure(self):
+        # Cheap, import-time part: validate settings. The client itself is created on first use.
+        self._project_id = os.getenv("GCLOUD_PROJECT")
+        if not self._project_id:
+            raise ValueError("Environment variable 'GCLOUD_PROJECT' is not set.")
+        self._init_lock = threading.Lock()
+        self._cache = TTLCache(
+            ttl=float(os.getenv("FIRESTORE_CACHE_TTL", "5")),
+            max_size=int(os.getenv("FIRESTORE_CACHE_SIZE", "128")),
+        )
+
+    def _reset_after_fork(self):
+        # gRPC channels, the writer thread and held locks don't survive fork():
+        # drop them so this process builds its own on first use.
+        self._client = None
+        self._async_client = None
+        self._writer = None
+        self._init_lock = threading.Lock()
+        self._cache = TTLCache(ttl=self._cache.ttl, max_size=self._cache.max_size)
+
+    def _get_client(self):
+        """
+        Returns the Firestore client, creating it (thread-safely) on first use.
+        """
+        if self._client is None:
+            with self._init_lock:
+                if self._client is None:
+                    self._init_client()
+        return self._client
+
+    def _get_async_client(self):
+        """
+        Returns the AsyncClient used by the `*_async` methods, creating it on first use.
+        Must be called from the event loop that will use it.
+        """
+        if self._async_client is None:
+            with self._init_lock:
+                if self._async_client is None:
+                    with coldstart.timed("firestore_async_client"):
+                        self._async_client = firestore.AsyncClient(project=self._project_id)
+                    print(f"[FirestoreManager] Async client initialized for project: {self._project_id}")
+        return self._async_client
+
+    def warm_up(self):
+        self._get_client()
+
     def _init_client(self):
         # Automatically detects 'FIRESTORE_EMULATOR_HOST' if set in Docker/Env
         # If not set, it uses default Google Cloud credentials (for production)
-        project_id = os.getenv("GCLOUD_PROJECT")
-        if not project_id:
-            raise ValueError("Environment variable 'GCLOUD_PROJECT' is not set.")
-            
-        self._client = firestore.Client(project=project_id)
+        project_id = self._project_id
+        with coldstart.timed("firestore_client"):
+            client = firestore.Client(project=project_id)
         print(f"[FirestoreManager] Initialized for project: {project_id}")
 
+        # Opt-in: queue add_log() writes and commit them in batches on a background thread
+        if os.getenv("FIRESTORE_BATCH_WRITES", "").lower() in ("1", "true", "yes"):
+            self._writer = BatchedLogWriter(
+                client,
+                batch_size=int(os.getenv("FIRESTORE_BATCH_SIZE", MAX_BATCH_WRITES)),
+                flush_interval=float(os.getenv("FIRESTORE_BATCH_INTERVAL", "1.0")),
+                on_commit=self._invalidate_committed,
+            )
+            atexit.register(self.close)
+            print("[FirestoreManager] Batched writes enabled.")
+        self._client = client
+
     def add_log(self, collection_name, data):
         """
         Adds a document to the specified Firestore collection.
+        In batched mode the ID is generated client-side and returned before the write is committed.
         """
         try:
-            doc_ref = self._client.collection(collection_name).document()
-            doc_ref.set(data)
+            with metrics.track_backend("add_log"):
+                doc_ref = self._get_client().collection(collection_name).document()
+                if self._writer is not None:
+                    # The cache is invalidated once the batch holding this write commits.
+                    self._writer.enqueue(doc_ref, data)
+                else:
+                    doc_ref.set(data)
+                    self._cache.invalidate(collection_name)
             return doc_ref.id
         except Exception as e:
             print(f"[FirestoreManager] Error writing to Firestore: {e}")
             raise e
 
+    def _invalidate_committed(self, batch):
+        for collection_name in {doc_ref.parent.id for doc_ref, _ in batch}:
+            self._cache.invalidate(collection_name)
+
+    def add_logs(self, collection_name, entries):
+        """
+        Writes many documents with WriteBatch commits of up to MAX_BATCH_WRITES each.
+        Returns one result per entry: the document ID, or the exception that failed its batch.
+        """
+        client = self._get_client()
+        collection = client.collection(collection_name)
+        results = []
+        for start in range(0, len(entries), MAX_BATCH_WRITES):
+            chunk = entries[start:start + MAX_BATCH_WRITES]
+            doc_refs = [collection.document() for _ in chunk]
+            try:
+                write_batch = client.batch()
+                for doc_ref, data in zip(doc_refs, chunk):
+                    write_batch.set(doc_ref, data)
+                with metrics.track_backend("add_logs"):
+                    write_batch.commit()
+                results.extend(doc_ref.id for doc_ref in doc_refs)
+            except Exception as e:
+                print(f"[FirestoreManager] Batch write of {len(chunk)} documents failed: {e}")
+                results.extend(e for _ in chunk)
+        self._cache.invalidate(collection_name)
+        return results
+
+    async def add_log_async(self, collection_name, data):
+        """
+        Async add_log() on the AsyncClient. Always writes directly (batched mode only
+        applies to the synchronous client).
+        """
+        try:
+            with metrics.track_backend("add_log"):
+                doc_ref = self._get_async_client().collection(collection_name).document()
+                await doc_ref.set(data)
+            self._cache.invalidate(collection_name)
+            return doc_ref.id
+        except Exception as e:
+            print(f"[FirestoreManager] Error writing to Firestore: {e}")
+            raise e
+
+    def flush(self):
+        """
+        Commits any queued writes (no-op unless batched writes are enabled).
+        """
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def shutdown(self):
+        """
+        Commits queued writes and closes the clients (e.g. from a gunicorn worker_exit hook).
+        """
+        self.close()
+        for client in (self._client, self._async_client):
+            if client is None:
+                continue
+            try:
+                result = client.close()
+                if hasattr(result, "close"):
+                    result.close()  # AsyncClient.close() returns a coroutine we can't await here
+            except Exception as e:
+                print(f"[FirestoreManager] Error closing client: {e}")
+        self._client = None
+        self._async_client = None
+
+    async def shutdown_async(self):
+        """
+        shutdown() for the ASGI app: awaits AsyncClient.close() on the event loop
+        that used it (e.g. from the Starlette lifespan shutdown).
+        """
+        client, self._async_client = self._async_client, None
+        if client is not None:
+            try:
+                result = client.close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"[FirestoreManager] Error closing async client: {e}")
+        await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
+
     def get_logs(self, collection_name, limit=10):
         """
-        Retrieves logs from Firestore.
+        Retrieves the newest logs from Firestore.
+        """
+        return self.get_logs_page(collection_name, limit)[0]
+
+    def get_logs_page(self, collection_name, limit=10, cursor=None):
+        """
+        Returns `(logs, next_cursor)`: one page of logs ordered newest first by
+        `timestamp` (ties broken by document ID). Pass `next_cursor` back to get the
+        following page; it is None on the last page. Pages are served from a short-lived
+        cache that is invalidated by add_log() on this instance.
         """
+        key = (collection_name, limit, cursor)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        try:
+            # Fetch one extra document to know whether another page exists.
+            query = self._logs_query(self._get_client(), collection_name, cursor).limit(limit + 1)
+            with metrics.track_backend("get_logs"):
+                docs = list(query.stream())
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"[FirestoreManager] Error reading from Firestore: {e}")
+            raise e
+        return self._store_page(key, docs, limit)
+
+    async def get_logs_page_async(self, collection_name, limit=10, cursor=None):
+        """
+        Async get_logs_page() on the AsyncClient (same ordering, cursors and cache).
+        """
+        key = (collection_name, limit, cursor)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
         try:
-            docs = self._client.collection(collection_name).limit(limit).stream()
-            return [{**doc.to_dict(), 'id': doc.id} for doc in docs]
+            query = self._logs_query(self._get_async_client(), collection_name, cursor).limit(limit + 1)
+            with metrics.track_backend("get_logs"):
+                docs = [doc async for doc in query.stream()]
+        except ValueError:
+            raise
         except Exception as e:
             print(f"[FirestoreManager] Error reading from Firestore: {e}")
             raise e
+        return self._store_page(key, docs, limit)
+
+    def _logs_query(self, client, collection_name, cursor):
+        collection = client.collection(collection_name)
+        query = (collection
+                 .order_by("timestamp", direction=firestore.Query.DESCENDING)
+                 .order_by(firestore.FieldPath.document_id(), direction=firestore.Query.DESCENDING))
+        if cursor:
+            timestamp, doc_id = _decode_cursor(cursor)
+            query = query.start_after({"timestamp": timestamp,
+                                       firestore.FieldPath.document_id(): collection.document(doc_id)})
+        return query
+
+    def _store_page(self, key, docs, limit):
+        logs = [{**doc.to_dict(), 'id': doc.id} for doc in docs[:limit]]
+        next_cursor = None
+        if len(docs) > limit and logs:
+            next_cursor = _encode_cursor(logs[-1].get("timestamp"), logs[-1]["id"])
+        page = (logs, next_cursor)
+        self._cache.put(key, page)
+        return page
+
+    def cache_stats(self):
+        return self._cache.stats()
+
+    def queue_depth(self):
+        """
+        Writes waiting to be committed in batched mode (0 otherwise).
+        """
+        return self._writer.stats()["pending"] if self._writer is not None else 0
+
+
+def _reset_after_fork():
+    if FirestoreManager._instance is not None:
+        FirestoreManager._instance._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,136 @@
+"""
+Incremental parsing of bulk request bodies: NDJSON (one JSON value per line) or a
+single JSON array. Bodies are read in chunks, so memory is bounded by the entries
+the caller keeps, not by the body size.
+"""
+import codecs
+import json
+
+CHUNK_SIZE = 64 * 1024
+# Largest single entry accepted; guards against buffering a whole malformed body.
+MAX_ENTRY_SIZE = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+_DELIMITERS = _WHITESPACE + ",]"
+
+
+def _chunks(stream, chunk_size):
+    decode = codecs.getincrementaldecoder("utf-8")().decode
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            tail = decode(b"", final=True)
+            if tail:
+                yield tail
+            return
+        text = decode(data)
+        if text:
+            yield text
+
+
+def _skip_whitespace(buffer, pos):
+    while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+def iter_entries(stream, chunk_size=CHUNK_SIZE):
+    """
+    Yields the JSON values of a body that is either a JSON array (first non-blank
+    character `[`) or NDJSON. Raises ValueError on malformed input.
+    """
+    chunks = _chunks(stream, chunk_size)
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        if buffer.strip():
+            break
+    buffer = buffer.lstrip(_WHITESPACE)
+    if not buffer:
+        return
+    if buffer[0] == "[":
+        yield from _iter_array(buffer[1:], chunks)
+    else:
+        yield from _iter_lines(buffer, chunks)
+
+
+def _iter_lines(buffer, chunks):
+    line_no = 0
+    while True:
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield _loads(line, line_no)
+        if len(buffer) > MAX_ENTRY_SIZE:
+            raise ValueError(f"Line {line_no + 1} is longer than {MAX_ENTRY_SIZE} bytes.")
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        buffer += chunk
+    if buffer.strip():
+        yield _loads(buffer, line_no + 1)
+
+
+def _loads(line, line_no):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON on line {line_no}: {e}")
+    except RecursionError:
+        raise ValueError(f"JSON on line {line_no} is nested too deeply.")
+
+
+def _check_trailing(rest, chunks):
+    # Only whitespace may follow the closing "]", however the rest of the body is chunked.
+    if rest.strip():
+        raise ValueError("Unexpected data after the JSON array.")
+    for chunk in chunks:
+        if chunk.strip():
+            raise ValueError("Unexpected data after the JSON array.")
+
+
+def _iter_array(buffer, chunks):
+    pos = 0
+    expect_value = True   # after "[" or ","
+    first = True
+    exhausted = False
+    while True:
+        pos = _skip_whitespace(buffer, pos)
+        if pos < len(buffer):
+            if buffer[pos] == "]" and (first or not expect_value):
+                _check_trailing(buffer[pos + 1:], () if exhausted else chunks)
+                return
+            if not expect_value:
+                if buffer[pos] != ",":
+                    raise ValueError(f"Expected ',' or ']' in JSON array, got {buffer[pos]!r}.")
+                pos += 1
+                expect_value = True
+                continue
+            try:
+                value, end = _decoder.raw_decode(buffer, pos)
+            except ValueError:
+                end = None
+            except RecursionError:
+                raise ValueError("JSON array element is nested too deeply.")
+            # A value not yet followed by a delimiter may be cut off mid-token
+            # (e.g. "0." of "0.5"), so only accept it once more input or EOF confirms it.
+            if end is not None and (exhausted or (end < len(buffer) and buffer[end] in _DELIMITERS)):
+                yield value
+                pos = end
+                expect_value = False
+                first = False
+                continue
+            if exhausted:
+                raise ValueError("Invalid or truncated JSON array element.")
+            if len(buffer) - pos > MAX_ENTRY_SIZE:
+                raise ValueError(f"JSON array element larger than {MAX_ENTRY_SIZE} bytes or malformed.")
+        elif exhausted:
+            raise ValueError("Unterminated JSON array.")
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+        else:
+            buffer = buffer[pos:] + chunk
+            pos = 0
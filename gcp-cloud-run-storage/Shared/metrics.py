@@ -0,0 +1,257 @@
+"""
+Minimal in-process metrics registry (counters, gauges, fixed-bucket histograms)
+rendered in the Prometheus text exposition format.
+
+Recording takes one short per-metric lock; beyond that, the only per-call work is
+building the label-value tuple that keys a labelled series.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+# Latency buckets in seconds (upper bounds); +Inf is implicit.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(label_names, labels):
+    if not label_names and not labels:
+        return ()
+    if len(labels) == len(label_names):
+        try:
+            return tuple([str(labels[name]) for name in label_names])
+        except KeyError:
+            pass
+    raise ValueError(f"Expected labels {label_names}, got {tuple(labels)}")
+
+
+def _format_labels(label_names, key, extra=None):
+    pairs = list(zip(label_names, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _callback_values(callback):
+    # A callback returns a number, or a dict of label-tuple -> number for labelled metrics.
+    try:
+        result = callback()
+    except Exception:
+        return {}
+    if isinstance(result, dict):
+        return {tuple(str(v) for v in k): val for k, val in result.items()}
+    return {} if result is None else {(): result}
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """
+    A counter is either incremented explicitly or read at scrape time from `callback`
+    (for totals another component already keeps, e.g. pool statistics), like Gauge.
+    """
+    kind = "counter"
+
+    def __init__(self, name, documentation, label_names=(), callback=None):
+        super().__init__(name, documentation, label_names)
+        self._values = {}
+        self._callback = callback
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self.label_names, labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        if self._callback is not None:
+            values.update(_callback_values(self._callback))
+        lines = self._header()
+        lines += [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(v)}"
+                  for key, v in sorted(values.items())]
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    A gauge is either set explicitly or computed at scrape time by `callback`
+    (which returns a number, or a dict of label-tuple -> number for labelled gauges).
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, label_names=(), callback=None):
+        super().__init__(name, documentation, label_names)
+        self._values = {}
+        self._callback = callback
+
+    def set(self, value, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        if self._callback is not None:
+            values.update(_callback_values(self._callback))
+        lines = self._header()
+        lines += [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(v)}"
+                  for key, v in sorted(values.items())]
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = _label_key(self.label_names, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = self._header()
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-1]):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            plain = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{plain} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                    raise ValueError(f"Metric {metric.name} already registered with a different type or labels.")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, label_names=(), callback=None):
+        return self._register(Counter(name, documentation, label_names, callback))
+
+    def gauge(self, name, documentation, label_names=(), callback=None):
+        return self._register(Gauge(name, documentation, label_names, callback))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = Registry()
+
+BACKEND_LATENCY = REGISTRY.histogram(
+    "backend_call_duration_seconds", "Latency of backend calls by operation.", ("operation",))
+BACKEND_ERRORS = REGISTRY.counter(
+    "backend_call_errors_total", "Failed backend calls by operation.", ("operation",))
+
+# Per-request {operation: seconds}, set only while a request is profiled (see profiling.py).
+STAGE_TIMINGS = contextvars.ContextVar("stage_timings", default=None)
+
+
+class track_backend:
+    """
+    Context manager that records latency (and failure, if the block raises) of one backend call.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        BACKEND_LATENCY.observe(elapsed, operation=self.operation)
+        if exc_type is not None:
+            BACKEND_ERRORS.inc(operation=self.operation)
+        stages = STAGE_TIMINGS.get()
+        if stages is not None:
+            stages[self.operation] = stages.get(self.operation, 0.0) + elapsed
+        return False
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,237 @@
+"""
+On-demand per-request profiling.
+
+A `Profiler` decides per request whether to profile it: always when the request
+carries the trusted token in the `X-Profile-Token` header, otherwise with
+probability `sample_rate` percent. A profiled request writes, under one id:
+
+- `<id>.json`: duration and a per-stage breakdown (time inside each
+  `metrics.track_backend` operation, e.g. connect, execute_query, add_log, upload_log);
+- `<id>.collapsed` (mode "sample"): stack samples of the request thread in the
+  collapsed format read by flamegraph.pl and speedscope;
+- `<id>.pstats` (mode "cprofile"): a cProfile dump for pstats / snakeviz.
+
+Only the newest `max_files` profiles are kept. Entry points install a Profiler
+only when sampling or a token is configured, so with profiling off nothing runs.
+"""
+import cProfile
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from Shared import metrics
+
+TOKEN_HEADER = "X-Profile-Token"
+ID_HEADER = "X-Profile-Id"
+MODES = ("sample", "cprofile")
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def active():
+    """
+    True while the current request is being profiled (stage timings are being collected).
+    """
+    return metrics.STAGE_TIMINGS.get() is not None
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Sampler:
+    """
+    One background thread that samples the stacks of the threads currently being
+    profiled; it exits when there are none.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._targets = {}
+        self._thread = None
+
+    def add(self, thread_id):
+        counts = Counter()
+        with self._lock:
+            self._targets[thread_id] = counts
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+        return counts
+
+    def remove(self, thread_id):
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._targets:
+                    self._thread = None
+                    return
+                targets = list(self._targets.items())
+            frames = sys._current_frames()
+            for thread_id, counts in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    counts[_collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class _Profile:
+    """
+    Context manager around one profiled request.
+    """
+
+    def __init__(self, profiler, name, trigger):
+        self.profiler = profiler
+        self.name = name
+        self.trigger = trigger
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{_UNSAFE.sub('_', name).strip('_') or 'root'}-{uuid.uuid4().hex[:8]}"
+        self.path = None
+        self._stages = {}
+        self._counts = None
+        self._cprofile = None
+
+    def __enter__(self):
+        self._token = metrics.STAGE_TIMINGS.set(self._stages)
+        profiler = self.profiler
+        if profiler.mode == "sample":
+            self._thread_id = threading.get_ident()
+            self._counts = profiler._sampler.add(self._thread_id)
+        elif profiler._cprofile_lock.acquire(blocking=False):
+            # Only one cProfile can be active per process; concurrent requests get stages only.
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._started
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self.profiler._cprofile_lock.release()
+        if self._counts is not None:
+            self.profiler._sampler.remove(self._thread_id)
+        metrics.STAGE_TIMINGS.reset(self._token)
+        summary = {
+            "id": self.id,
+            "name": self.name,
+            "trigger": self.trigger,
+            "mode": self.profiler.mode,
+            "duration_ms": duration * 1000,
+            "stages_ms": {stage: seconds * 1000 for stage, seconds in sorted(self._stages.items())},
+            "error": repr(exc) if exc is not None else None,
+        }
+        if self._counts is not None:
+            summary["samples"] = sum(self._counts.values())
+        try:
+            self.path = self.profiler._write(self.id, summary, self._counts, self._cprofile)
+        except OSError:
+            # Profiling must never fail the request.
+            self.path = None
+        return False
+
+
+class Profiler:
+    """
+    Decides which requests to profile and where their profiles go (see module docstring).
+    """
+
+    def __init__(self, directory, sample_rate=0.0, token=None, mode="sample", max_files=200, interval=0.001):
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}; expected one of {MODES}.")
+        self.directory = directory
+        self.sample_rate = sample_rate / 100.0
+        self.token = token or None
+        self.mode = mode
+        self.max_files = max_files
+        self._sampler = _Sampler(interval)
+        self._cprofile_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def begin(self, name, token=None):
+        """
+        Returns a context manager profiling one request, or None if this request
+        is not selected. `token` is the value of the X-Profile-Token header, if any.
+        """
+        if token is not None and self.token is not None and hmac.compare_digest(token.encode(), self.token.encode()):
+            return _Profile(self, name, "header")
+        if self.sample_rate and random.random() < self.sample_rate:
+            return _Profile(self, name, "sample")
+        return None
+
+    def _write(self, profile_id, summary, counts, profile):
+        base = os.path.join(self.directory, profile_id)
+        if counts:
+            with open(base + ".collapsed", "w") as f:
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+        if profile is not None:
+            profile.dump_stats(base + ".pstats")
+        with open(base + ".json", "w") as f:
+            json.dump(summary, f, indent=2)
+        self._prune()
+        return base + ".json"
+
+    def _prune(self):
+        with self._write_lock:
+            written = {}
+            for entry in os.scandir(self.directory):
+                profile_id = entry.name.split(".", 1)[0]
+                written[profile_id] = max(written.get(profile_id, 0), entry.stat().st_mtime_ns)
+            ids = sorted(written, key=written.get)
+            for stale in ids[:max(0, len(ids) - self.max_files)]:
+                for ext in (".json", ".collapsed", ".pstats"):
+                    try:
+                        os.remove(os.path.join(self.directory, stale + ext))
+                    except FileNotFoundError:
+                        pass
+
+
+class WSGIMiddleware:
+    """
+    Profiles whole WSGI requests (framework dispatch and response serialisation
+    included) for the given paths. Profiled responses carry an X-Profile-Id header.
+    The body is collected inside the profile, so list only non-streaming paths.
+    """
+
+    def __init__(self, app, profiler, paths=("/",)):
+        self.app = app
+        self.profiler = profiler
+        self.paths = frozenset(paths)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path not in self.paths:
+            return self.app(environ, start_response)
+        profile = self.profiler.begin(path, environ.get("HTTP_X_PROFILE_TOKEN"))
+        if profile is None:
+            return self.app(environ, start_response)
+
+        def start_with_id(status, headers, exc_info=None):
+            return start_response(status, list(headers) + [(ID_HEADER, profile.id)], exc_info)
+
+        with profile:
+            body = self.app(environ, start_with_id)
+            try:
+                chunks = list(body)
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+        return chunks
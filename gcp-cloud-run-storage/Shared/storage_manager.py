@@ -1,41 +1,549 @@
 from google.cloud import storage
-import os
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from Shared import coldstart
+from Shared import metrics
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import atexit
+import base64
+import bisect
+import contextvars
 import datetime
+import functools
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import operator
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+
+# listing_version() checks at most this many per-day segment indexes.
+MAX_VERSIONED_DAYS = 31
+
+SEGMENT_UPLOAD_ERRORS = metrics.REGISTRY.counter(
+    "storage_segment_upload_errors_total",
+    "Failed log segment uploads, by outcome (retry: kept for another attempt; dropped: lost at shutdown).",
+    ("outcome",))
+
+
+class _Segment:
+    """
+    One open log segment: gzip-compressed NDJSON spooled in memory (on disk past `spool_size`).
+    """
+
+    def __init__(self, prefix, opened_at, spool_size):
+        self.opened_at = opened_at
+        self.opened_monotonic = time.monotonic()
+        self.date = opened_at.strftime("%Y-%m-%d")
+        self.name = (f"{prefix}/dt={self.date}/hour={opened_at:%H}/"
+                     f"segment-{opened_at:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:12]}.ndjson.gz")
+        self.entries = 0
+        self.raw_bytes = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.attempts = 0                # failed upload attempts
+        self.retry_at = 0.0              # monotonic time of the next attempt
+        self.stored = False              # object written; only the index update is left
+        self._size = None
+        self._spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self._gzip = gzip.GzipFile(fileobj=self._spool, mode="wb")
+
+    def append(self, ts, line):
+        self._gzip.write(line)
+        self.raw_bytes += len(line)
+        self.entries += 1
+        self.first_ts = self.first_ts or ts
+        self.last_ts = ts
+
+    def finish(self):
+        """
+        Closes the gzip stream (once) and returns the spooled file, rewound for upload.
+        """
+        if self._size is None:
+            self._gzip.close()
+            self._size = self._spool.tell()
+        self._spool.seek(0)
+        return self._spool, self._size
+
+    def discard(self):
+        self._spool.close()
+
+
+class LogSegmentWriter:
+    """
+    Appends log entries to a rolling gzip NDJSON segment and uploads the segment
+    once it holds `max_bytes` of uncompressed NDJSON, is `max_age` seconds old, or the day
+    changes. Segments are date/hour partitioned and never overwritten; each upload
+    is recorded in a per-day index object (`<prefix>/_index/<date>.json`) with the
+    segment's time range so readers can find segments without listing the bucket.
+
+    A segment whose upload fails is kept (with its spooled file) and retried by the
+    roller thread with exponential backoff (`retry_backoff` doubling up to
+    `retry_backoff_max` seconds); close() retries pending segments `close_retries`
+    more times before giving up on them.
+    """
+
+    def __init__(self, bucket, prefix="logs", max_bytes=16 * 1024 * 1024, max_age=60.0,
+                 spool_size=8 * 1024 * 1024, on_upload=None, retry_backoff=1.0,
+                 retry_backoff_max=60.0, close_retries=3):
+        self._bucket = bucket
+        self._on_upload = on_upload
+        self.prefix = prefix.strip("/")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.spool_size = spool_size
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.close_retries = close_retries
+
+        self._lock = threading.Lock()
+        self._upload_lock = threading.Lock()
+        self._segment = None
+        self._ready = []                 # full segments waiting for the roller thread
+        self._failed = []                # segments waiting to retry a failed upload
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._stats = {"entries": 0, "segments": 0, "bytes": 0, "upload_errors": 0}
+
+        self._thread = threading.Thread(target=self._run, name="gcs-segment-roller", daemon=True)
+        self._thread.start()
+
+    def append(self, content, timestamp=None):
+        """
+        Adds one entry and returns the name of the segment it will be uploaded in.
+        Never does network I/O: full segments are uploaded by the roller thread.
+        """
+        now = timestamp or datetime.datetime.now(datetime.timezone.utc)
+        ts = now.isoformat()
+        line = (json.dumps({"ts": ts, "content": content}, ensure_ascii=False) + "\n").encode("utf-8")
+        full = None
+        with self._lock:
+            segment = self._segment
+            if segment is not None and segment.date != now.strftime("%Y-%m-%d"):
+                full, segment = segment, None
+            if segment is None:
+                segment = self._segment = _Segment(self.prefix, now, self.spool_size)
+            segment.append(ts, line)
+            self._stats["entries"] += 1
+            name = segment.name
+            if segment.raw_bytes >= self.max_bytes:
+                full, self._segment = segment, None
+            if full is not None:
+                self._ready.append(full)
+        if full is not None:
+            self._wake.set()
+        return name
+
+    def flush(self):
+        """
+        Uploads the open segment and every pending segment (failed ones included,
+        regardless of backoff) in this thread. Returns True if nothing is left pending.
+        """
+        with self._lock:
+            segment, self._segment = self._segment, None
+            if segment is not None and segment.entries:
+                self._ready.append(segment)
+        self._upload_ready(force=True)
+        with self._lock:
+            return not self._failed
+
+    def close(self):
+        """
+        Stops the roller thread and uploads what is left, retrying failed segments
+        `close_retries` times; segments that still fail are logged and dropped.
+        """
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+        for attempt in range(self.close_retries + 1):
+            if self.flush():
+                return
+            if attempt < self.close_retries:
+                time.sleep(min(self.retry_backoff * 2 ** attempt, self.retry_backoff_max))
+        with self._lock:
+            failed, self._failed = self._failed, []
+        for segment in failed:
+            SEGMENT_UPLOAD_ERRORS.inc(outcome="dropped")
+            logging.error(f"[StorageManager] Dropping segment {segment.name} after {segment.attempts} failed "
+                          f"uploads: {segment.entries} entries lost.")
+            segment.discard()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open_entries"] = self._segment.entries if self._segment else 0
+            stats["pending_segments"] = len(self._ready) + len(self._failed)
+            stats["pending_entries"] = sum(segment.entries for segment in self._ready + self._failed)
+        return stats
+
+    def index_name(self, date):
+        return f"{self.prefix}/_index/{date}.json"
+
+    def find_segments(self, start, end):
+        """
+        Returns index records for segments overlapping [start, end] (timezone-aware datetimes).
+        """
+        found = []
+        day = start.date()
+        while day <= end.date():
+            blob = self._bucket.blob(self.index_name(day.isoformat()))
+            try:
+                index = json.loads(blob.download_as_bytes())
+            except NotFound:
+                index = {"segments": []}
+            for record in index["segments"]:
+                first = datetime.datetime.fromisoformat(record["first_ts"])
+                last = datetime.datetime.fromisoformat(record["last_ts"])
+                if first <= end and last >= start:
+                    found.append(record)
+            day += datetime.timedelta(days=1)
+        return found
+
+    def read_segment(self, name):
+        """
+        Downloads a segment and yields its entries as dicts.
+        """
+        data = gzip.decompress(self._bucket.blob(name).download_as_bytes())
+        for line in data.splitlines():
+            if line:
+                yield json.loads(line)
+
+    def _run(self):
+        interval = max(0.5, min(self.max_age / 4.0, 5.0))
+        while not self._closed.is_set():
+            self._wake.wait(interval)
+            self._wake.clear()
+            with self._lock:
+                segment = self._segment
+                if segment is not None and time.monotonic() - segment.opened_monotonic >= self.max_age:
+                    self._segment = None
+                    self._ready.append(segment)
+            self._upload_ready()
+
+    def _upload_ready(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            due = [segment for segment in self._failed if force or segment.retry_at <= now]
+            self._failed = [segment for segment in self._failed if segment not in due]
+            ready, self._ready = self._ready, []
+        # Retries first, so segments are uploaded in the order they were filled.
+        for segment in due + ready:
+            self._upload(segment)
+
+    def _upload(self, segment):
+        fileobj, size = segment.finish()
+        try:
+            with self._upload_lock:
+                if not segment.stored:
+                    blob = self._bucket.blob(segment.name)
+                    blob.metadata = {"first_ts": segment.first_ts, "last_ts": segment.last_ts,
+                                     "entries": str(segment.entries)}
+                    # if_generation_match=0: fail rather than overwrite an existing object.
+                    try:
+                        with metrics.track_backend("upload_segment"):
+                            blob.upload_from_file(fileobj, size=size, content_type="application/gzip",
+                                                  if_generation_match=0)
+                    except PreconditionFailed:
+                        if not segment.attempts:
+                            raise
+                        # An earlier attempt reached GCS even though it reported an error.
+                    segment.stored = True
+                self._add_to_index(segment, size)
+        except Exception as e:
+            segment.attempts += 1
+            delay = min(self.retry_backoff * 2 ** (segment.attempts - 1), self.retry_backoff_max)
+            segment.retry_at = time.monotonic() + delay
+            with self._lock:
+                self._stats["upload_errors"] += 1
+                self._failed.append(segment)
+            SEGMENT_UPLOAD_ERRORS.inc(outcome="retry")
+            logging.warning(f"[StorageManager] Upload of segment {segment.name} ({segment.entries} entries) "
+                            f"failed (attempt {segment.attempts}), retrying in {delay:.1f}s: {e}")
+            return False
+
+        segment.discard()
+        if self._on_upload is not None:
+            self._on_upload(segment.name)
+            self._on_upload(self.index_name(segment.date))
+        with self._lock:
+            self._stats["segments"] += 1
+            self._stats["bytes"] += size
+        print(f"[StorageManager] Uploaded segment {segment.name} ({segment.entries} entries, {size} bytes)")
+        return True
+
+    def _add_to_index(self, segment, size):
+        record = {"name": segment.name, "first_ts": segment.first_ts, "last_ts": segment.last_ts,
+                  "entries": segment.entries, "bytes": size}
+        blob = self._bucket.blob(self.index_name(segment.date))
+        # Several instances may append to the same day's index: optimistic concurrency on
+        # generation, with jittered backoff so contending writers don't retry in lockstep.
+        for attempt in range(10):
+            try:
+                index = json.loads(blob.download_as_bytes())
+                generation = blob.generation
+            except NotFound:
+                index = {"segments": []}
+                generation = 0
+            if any(entry["name"] == segment.name for entry in index["segments"]):
+                # Already recorded, e.g. by an earlier attempt whose response was lost.
+                return
+            index["segments"].append(record)
+            try:
+                blob.upload_from_string(json.dumps(index), content_type="application/json",
+                                        if_generation_match=generation)
+                return
+            except PreconditionFailed:
+                time.sleep(random.uniform(0, min(0.05 * 2 ** attempt, 1.0)))
+        raise RuntimeError(f"Could not update segment index {blob.name} after concurrent modifications.")
+
+
+class BlobManifest:
+    """
+    Sorted, in-process cache of the object names under `prefix`.
+
+    The first use lists the prefix; later refreshes (after `ttl` seconds) only
+    list names at or after a time-based watermark, because log object names sort by
+    creation time. A full relisting every `full_refresh_interval` seconds picks up
+    objects with arbitrary names and drops deleted ones. Names uploaded by this
+    process are added immediately.
+
+    At most `max_names` names are kept: past that the manifest marks itself
+    overflowed, drops its names and `covers()` is False until a full relisting fits
+    again, so callers list the bucket directly instead.
+    """
+
+    def __init__(self, list_names, watermark, prefix="", max_names=100000, ttl=30.0,
+                 full_refresh_interval=900.0, skew=120.0):
+        self._list_names = list_names    # callable(start_offset, prefix) -> iterable of names
+        self._watermark = watermark      # callable(datetime) -> smallest name created at/after it
+        self.prefix = prefix
+        self.max_names = max_names
+        self.ttl = ttl
+        self.full_refresh_interval = full_refresh_interval
+        self.skew = skew
+        self.overflowed = False
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._names = []
+        self._known = set()
+        self._digest = 0                 # XOR of the names' hashes: order-independent, updated per add()
+        self._refreshed_at = None        # monotonic
+        self._refreshed_wall = None      # wall clock of the last refresh start
+        self._full_refreshed_at = None
+
+    def add(self, name):
+        if not name.startswith(self.prefix):
+            return
+        with self._lock:
+            if self.overflowed or name in self._known:
+                return
+            if len(self._names) >= self.max_names:
+                self._overflow_locked()
+                return
+            self._known.add(name)
+            bisect.insort(self._names, name)
+            self._digest ^= _name_hash(name)
+
+    def _overflow_locked(self):
+        print(f"[StorageManager] Manifest for '{self.prefix}' exceeds {self.max_names} names; listing directly.")
+        self.overflowed = True
+        self._names = []
+        self._known = set()
+        self._digest = 0
+
+    @property
+    def version(self):
+        """
+        A digest of the cached name set: equal on every instance holding the same
+        names (unlike a per-process counter, which restarts at 0). None when overflowed.
+        """
+        with self._lock:
+            if self.overflowed:
+                return None
+            return f"{len(self._names)}-{self._digest:032x}"
+
+    def covers(self, prefix="", start_offset=None, end_offset=None):
+        """
+        True if every name the listing could return is under the manifest's prefix
+        and the manifest has not overflowed.
+        """
+        if self.overflowed:
+            return False
+        if not self.prefix or (prefix or "").startswith(self.prefix):
+            return True
+        return bool(start_offset and end_offset
+                    and start_offset.startswith(self.prefix) and end_offset.startswith(self.prefix))
+
+    def refresh(self, force_full=False):
+        with self._refresh_lock:
+            now = time.monotonic()
+            started = datetime.datetime.now(datetime.timezone.utc)
+            full = (force_full or self._full_refreshed_at is None
+                    or now - self._full_refreshed_at >= self.full_refresh_interval)
+            if full:
+                # Stop listing as soon as the cap is exceeded instead of walking the whole prefix.
+                names = sorted(itertools.islice(self._list_names(None, self.prefix), self.max_names + 1))
+                with self._lock:
+                    if len(names) > self.max_names:
+                        if not self.overflowed:
+                            self._overflow_locked()
+                    else:
+                        self.overflowed = False
+                        self._names = names
+                        self._known = set(names)
+                        self._digest = functools.reduce(operator.xor, map(_name_hash, names), 0)
+                self._full_refreshed_at = now
+            elif not self.overflowed:
+                since = self._refreshed_wall - datetime.timedelta(seconds=self.skew)
+                for name in self._list_names(max(self._watermark(since), self.prefix), self.prefix):
+                    self.add(name)
+            self._refreshed_at = now
+            self._refreshed_wall = started
+
+    def refresh_if_stale(self):
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.ttl:
+            self.refresh()
+
+    def page(self, prefix="", start_offset=None, end_offset=None, after=None, limit=1000):
+        """
+        Returns up to `limit` names matching the filters that sort after `after`.
+        """
+        self.refresh_if_stale()
+        lower = max(prefix or "", start_offset or "")
+        with self._lock:
+            if after is not None and after >= lower:
+                i = bisect.bisect_right(self._names, after)
+            else:
+                i = bisect.bisect_left(self._names, lower)
+            page = []
+            while i < len(self._names) and len(page) < limit:
+                name = self._names[i]
+                if (prefix and not name.startswith(prefix)) or (end_offset and name >= end_offset):
+                    break
+                page.append(name)
+                i += 1
+            has_more = i < len(self._names) and not (
+                (prefix and not self._names[i].startswith(prefix)) or (end_offset and self._names[i] >= end_offset))
+        return page, has_more
+
+    def __len__(self):
+        with self._lock:
+            return len(self._names)
+
+
+def _name_hash(name):
+    return int.from_bytes(hashlib.sha1(name.encode("utf-8")).digest()[:16], "big")
+
+
+def _encode_page_token(name):
+    return base64.urlsafe_b64encode(name.encode("utf-8")).decode("ascii")
+
+
+def _decode_page_token(token):
+    return base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8")
+
 
 class StorageManager:
     _instance = None
     _client = None
+    _segments = None
+    _manifest = None
+    _async_executor = None
+    _project_id = None
     _bucket_name = os.getenv("BUCKET_NAME", "app-logs-bucket")  # Default bucket name
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(StorageManager, cls).__new__(cls)
-            cls._instance._init_client()
+            instance = super(StorageManager, cls).__new__(cls)
+            instance._configure()
+            cls._instance = instance
         return cls._instance
 
-    def _init_client(self):
-        project_id = os.getenv("GCLOUD_PROJECT")
-        if not project_id:
+    def _configure(self):
+        # Cheap, import-time part: validate settings. The client and the bucket check
+        # (a network round trip) happen on first use or in warm_up().
+        self._project_id = os.getenv("GCLOUD_PROJECT")
+        if not self._project_id:
             raise ValueError("Environment variable 'GCLOUD_PROJECT' is not set.")
-        
+        self._init_lock = threading.Lock()
+
+    def _reset_after_fork(self):
+        # The HTTP session, background threads and held locks don't survive fork():
+        # drop them so this process builds its own on first use.
+        self._client = None
+        self._segments = None
+        self._manifest = None
+        self._async_executor = None
+        self._init_lock = threading.Lock()
+
+    def _get_client(self):
+        """
+        Returns the Storage client, creating it and checking the bucket (thread-safely) on first use.
+        """
+        if self._client is None:
+            with self._init_lock:
+                if self._client is None:
+                    self._init_client()
+        return self._client
+
+    def warm_up(self):
+        self._get_client()
+
+    def _init_client(self):
+        project_id = self._project_id
+
         # Check for Emulator
         # Standard lib supports STORAGE_EMULATOR_HOST, but for fsouza/fake-gcs-server
         # we often need to ensure the client is configured to allow HTTP.
-        # However, the python client usually handles STORAGE_EMULATOR_HOST automatically 
+        # However, the python client usually handles STORAGE_EMULATOR_HOST automatically
         # for connecting to localhost.
-        
-        self._client = storage.Client(project=project_id)
+
+        with coldstart.timed("storage_client"):
+            client = storage.Client(project=project_id)
         print(f"[StorageManager] Initialized for project: {project_id}")
-        
+
         # Ensure bucket exists
-        self._ensure_bucket_exists()
+        with coldstart.timed("bucket_check"):
+            self._ensure_bucket_exists(client)
+
+        # Opt-in: collect log entries into rolling gzip NDJSON segments instead of one object per call
+        if os.getenv("STORAGE_SEGMENTS", "").lower() in ("1", "true", "yes"):
+            self._segments = LogSegmentWriter(
+                client.bucket(self._bucket_name),
+                prefix=os.getenv("STORAGE_SEGMENT_PREFIX", "logs"),
+                max_bytes=int(os.getenv("STORAGE_SEGMENT_MAX_BYTES", 16 * 1024 * 1024)),
+                max_age=float(os.getenv("STORAGE_SEGMENT_MAX_AGE", "60")),
+                on_upload=self._remember,
+            )
+            atexit.register(self.close)
+            print("[StorageManager] Segmented log uploads enabled.")
 
-    def _ensure_bucket_exists(self):
+        # Opt-in cache of the log object names (bounded) so listings don't walk the bucket every time
+        if os.getenv("STORAGE_MANIFEST", "").lower() in ("1", "true", "yes"):
+            default_prefix = f"{self._segments.prefix}/" if self._segments is not None else "log-"
+            self._manifest = BlobManifest(
+                self._list_names,
+                self._name_watermark,
+                prefix=os.getenv("STORAGE_MANIFEST_PREFIX", default_prefix),
+                max_names=int(os.getenv("STORAGE_MANIFEST_MAX_NAMES", "100000")),
+                ttl=float(os.getenv("STORAGE_MANIFEST_TTL", "30")),
+                full_refresh_interval=float(os.getenv("STORAGE_MANIFEST_FULL_REFRESH", "900")),
+            )
+        self._client = client
+
+    def _ensure_bucket_exists(self, client):
         try:
-            bucket = self._client.bucket(self._bucket_name)
+            bucket = client.bucket(self._bucket_name)
             if not bucket.exists():
                 print(f"[StorageManager] Creating bucket: {self._bucket_name}")
-                self._client.create_bucket(self._bucket_name)
+                client.create_bucket(self._bucket_name)
             else:
                 print(f"[StorageManager] Bucket exists: {self._bucket_name}")
         except Exception as e:
@@ -44,26 +552,261 @@ class StorageManager:
     def upload_log(self, content, filename=None):
         """
         Uploads a text string as a file to GCS.
+        In segment mode (and without an explicit filename) the entry is appended to the
+        open segment and the segment's object name is returned.
         """
+        client = self._get_client()
+        if not filename and self._segments is not None:
+            with metrics.track_backend("upload_log"):
+                return self._segments.append(content)
+
         if not filename:
             timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-            filename = f"log-{timestamp}.txt"
-        
+            # The random suffix keeps uploads within the same second from overwriting each other.
+            filename = f"log-{timestamp}-{uuid.uuid4().hex[:8]}.txt"
+
         try:
-            bucket = self._client.bucket(self._bucket_name)
+            bucket = client.bucket(self._bucket_name)
             blob = bucket.blob(filename)
-            blob.upload_from_string(content)
+            with metrics.track_backend("upload_log"):
+                blob.upload_from_string(content)
             print(f"[StorageManager] Uploaded {filename}")
+            self._remember(filename)
             return filename
         except Exception as e:
             print(f"[StorageManager] Error uploading blob: {e}")
             raise e
 
-    def list_files(self):
+    def upload_logs(self, entries):
+        """
+        Stores many log entries (already serialized, one per line) as one combined
+        NDJSON object, or appends them to the open segment in segment mode.
+        Returns the object name.
+        """
+        client = self._get_client()
+        if self._segments is not None:
+            with metrics.track_backend("upload_logs"):
+                name = None
+                for entry in entries:
+                    name = self._segments.append(entry)
+                return name
+
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        # Same "log-<timestamp>" prefix as single uploads so date filters and the manifest apply.
+        filename = f"log-{timestamp}-{uuid.uuid4().hex[:8]}-batch.ndjson"
+        try:
+            blob = client.bucket(self._bucket_name).blob(filename)
+            with metrics.track_backend("upload_logs"):
+                blob.upload_from_string("".join(entry.rstrip("\n") + "\n" for entry in entries),
+                                        content_type="application/x-ndjson")
+            print(f"[StorageManager] Uploaded {filename} ({len(entries)} entries)")
+            self._remember(filename)
+            return filename
+        except Exception as e:
+            print(f"[StorageManager] Error uploading blob: {e}")
+            raise e
+
+    async def upload_log_async(self, content, filename=None):
+        """
+        Async upload_log(). The GCS client is blocking, so uploads run on a dedicated
+        thread pool (STORAGE_ASYNC_WORKERS) instead of the event loop; appends to an
+        open segment are in-memory and run inline (full segments are uploaded by the
+        roller thread, never on the loop).
+        """
+        if not filename and self._client is not None and self._segments is not None:
+            with metrics.track_backend("upload_log"):
+                return self._segments.append(content)
+        return await self._run_blocking(self.upload_log, content, filename)
+
+    async def list_files_page_async(self, prefix=None, page_token=None, max_results=1000, start=None, end=None):
+        return await self._run_blocking(self.list_files_page, prefix, page_token, max_results, start, end)
+
+    async def listing_version_async(self, prefix=None, start=None, end=None):
+        return await self._run_blocking(self.listing_version, prefix, start, end)
+
+    async def iter_file_pages_async(self, prefix=None, start=None, end=None, page_size=1000):
+        """
+        Async iter_file_pages(): yields one page of object names at a time.
+        """
+        token = None
+        while True:
+            names, token = await self.list_files_page_async(prefix, token, page_size, start, end)
+            if names:
+                yield names
+            if not token:
+                return
+
+    async def _run_blocking(self, fn, *args):
+        if self._async_executor is None:
+            with self._init_lock:
+                if self._async_executor is None:
+                    self._async_executor = ThreadPoolExecutor(
+                        max_workers=int(os.getenv("STORAGE_ASYNC_WORKERS", "64")),
+                        thread_name_prefix="storage-async")
+        # Like asyncio.to_thread, but on our own pool (the default one is only ~cpu+4 threads).
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._async_executor, functools.partial(context.run, fn, *args))
+
+    def segment_backlog(self):
+        """
+        Entries not yet uploaded (open segment plus full or failed segments waiting
+        for upload); 0 unless segment mode is enabled.
+        """
+        if self._segments is None:
+            return 0
+        stats = self._segments.stats()
+        return stats["open_entries"] + stats["pending_entries"]
+
+    def flush(self):
+        """
+        Uploads the open log segment (no-op unless segment mode is enabled).
+        """
+        if self._segments is not None:
+            self._segments.flush()
+
+    def close(self):
+        if self._segments is not None:
+            self._segments.close()
+
+    def shutdown(self):
+        """
+        Uploads the open segment, stops the offload pool and closes the client
+        (e.g. from a gunicorn worker_exit hook).
+        """
+        self.close()
+        if self._async_executor is not None:
+            self._async_executor.shutdown(wait=True)
+            self._async_executor = None
+        if self._client is not None:
+            try:
+                self._client.close()
+            except Exception as e:
+                print(f"[StorageManager] Error closing client: {e}")
+            self._client = None
+
+    def find_log_segments(self, start, end):
+        """
+        Returns index records (name, first_ts, last_ts, entries, bytes) of segments overlapping [start, end].
+        """
+        self._get_client()
+        if self._segments is None:
+            raise RuntimeError("Segment mode is not enabled (set STORAGE_SEGMENTS=true).")
+        return self._segments.find_segments(start, end)
+
+    def read_log_segment(self, name):
+        self._get_client()
+        if self._segments is None:
+            raise RuntimeError("Segment mode is not enabled (set STORAGE_SEGMENTS=true).")
+        return list(self._segments.read_segment(name))
+
+    def _remember(self, name):
+        if self._manifest is not None:
+            self._manifest.add(name)
+
+    def _list_names(self, start_offset=None, prefix=None):
+        blobs = self._client.list_blobs(self._bucket_name, prefix=prefix or None, start_offset=start_offset,
+                                        fields="items(name),nextPageToken")
+        return (blob.name for blob in blobs)
+
+    def _name_watermark(self, when):
+        """
+        Smallest object name this service could have created at or after `when`.
+        """
+        if self._segments is not None:
+            when = when.astimezone(datetime.timezone.utc)
+            return f"{self._segments.prefix}/dt={when:%Y-%m-%d}/hour={when:%H}/"
+        when = when.astimezone()  # per-request object names use local time
+        return f"log-{when:%Y%m%d-%H%M%S}"
+
+    def _date_offsets(self, start=None, end=None):
+        """
+        Maps an inclusive date range onto [start_offset, end_offset) object names.
+        """
+        if self._segments is not None:
+            fmt = lambda d: f"{self._segments.prefix}/dt={d:%Y-%m-%d}/"
+        else:
+            fmt = lambda d: f"log-{d:%Y%m%d}"
+        start_offset = fmt(start) if start else None
+        end_offset = fmt(end + datetime.timedelta(days=1)) if end else None
+        return start_offset, end_offset
+
+    def list_files_page(self, prefix=None, page_token=None, max_results=1000, start=None, end=None):
+        """
+        Returns `(names, next_page_token)` for one page of object names.
+        `prefix` narrows by name; `start`/`end` (datetime.date, inclusive) narrow by the
+        date embedded in log object names. Pass the returned token back to get the next page;
+        it is None on the last page.
+        """
+        client = self._get_client()
+        start_offset, end_offset = self._date_offsets(start, end)
+        with metrics.track_backend("list_files"):
+            if self._manifest_covers(prefix, start_offset, end_offset):
+                after = _decode_page_token(page_token) if page_token else None
+                names, has_more = self._manifest.page(prefix or "", start_offset, end_offset, after, max_results)
+                return names, (_encode_page_token(names[-1]) if has_more and names else None)
+
+            iterator = client.list_blobs(
+                self._bucket_name, prefix=prefix, max_results=max_results, page_token=page_token,
+                start_offset=start_offset, end_offset=end_offset, fields="items(name),nextPageToken")
+            page = next(iterator.pages, [])
+            return [blob.name for blob in page], iterator.next_page_token
+
+    def _manifest_covers(self, prefix=None, start_offset=None, end_offset=None):
+        if self._manifest is None:
+            return False
+        self._manifest.refresh_if_stale()
+        return self._manifest.covers(prefix or "", start_offset, end_offset)
+
+    def listing_version(self, prefix=None, start=None, end=None):
+        """
+        Returns a value that changes whenever the listing for these filters changes,
+        or None if that can't be told cheaply. Uses the manifest when it covers the
+        listing; otherwise, in segment mode with a bounded date range, the ETags of
+        the per-day index objects (one metadata request per day).
+        """
+        self._get_client()
+        start_offset, end_offset = self._date_offsets(start, end)
+        if self._manifest_covers(prefix, start_offset, end_offset):
+            return self._manifest.version
+        if (self._segments is None or start is None or end is None
+                or (end - start).days >= MAX_VERSIONED_DAYS
+                or (prefix and not prefix.startswith(self._segments.prefix + "/"))):
+            return None
+        digest = hashlib.sha1()
+        bucket = self._client.bucket(self._bucket_name)
+        day = start
+        with metrics.track_backend("listing_version"):
+            while day <= end:
+                blob = bucket.get_blob(self._segments.index_name(day.isoformat()))
+                digest.update(f"{day}:{blob.etag if blob is not None else '-'};".encode("utf-8"))
+                day += datetime.timedelta(days=1)
+        return digest.hexdigest()
+
+    def iter_file_pages(self, prefix=None, start=None, end=None, page_size=1000):
+        """
+        Yields lists of object names page by page, so callers never hold the whole listing.
+        """
+        token = None
+        while True:
+            names, token = self.list_files_page(prefix, token, page_size, start, end)
+            if names:
+                yield names
+            if not token:
+                return
+
+    def list_files(self, prefix=None, start=None, end=None):
         try:
-            bucket = self._client.bucket(self._bucket_name)
-            blobs = self._client.list_blobs(self._bucket_name)
-            return [blob.name for blob in blobs]
+            return [name for page in self.iter_file_pages(prefix, start, end) for name in page]
         except Exception as e:
             print(f"[StorageManager] Error listing blobs: {e}")
             return []
+
+
+def _reset_after_fork():
+    if StorageManager._instance is not None:
+        StorageManager._instance._reset_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
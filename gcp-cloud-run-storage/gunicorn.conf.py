@@ -0,0 +1,40 @@
+# Gunicorn settings for the Flask app (main:app).
+# Every value can be overridden with the environment variables below.
+import os
+
+
+def _available_cpus():
+    # Respect CPU affinity / container limits where the platform exposes them.
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = f":{os.environ.get('PORT', '8080')}"
+
+# One worker per CPU, each with a thread pool for blocking backend I/O.
+workers = int(os.getenv("GUNICORN_WORKERS", "0")) or _available_cpus()
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# Cloud Run handles instance scaling and request timeouts.
+timeout = 0
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "10"))
+
+# Import the app once in the master and fork workers from it (faster start, shared
+# pages). The managers only create their clients after fork, in each worker.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+if preload_app:
+    os.environ["WARMUP_AFTER_FORK"] = "true"
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import main
+        main.start_warm_up()
+
+
+def worker_exit(server, worker):
+    # Flush queued Firestore batches / open log segments before the worker goes away.
+    import main
+    main.shutdown()
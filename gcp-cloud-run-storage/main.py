@@ -1,21 +1,212 @@
+import time
+_import_started = time.monotonic()
+
 import os
-from flask import Flask, request, jsonify
-from Shared.firestore_manager import FirestoreManager
+import threading
+from Shared import coldstart
+from Shared import metrics
+from Shared.admission import AdmissionController, AdmissionRejected
+from Shared import ingest
+from Shared import profiling
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from Shared.firestore_manager import FirestoreManager, InvalidCursor
 from Shared.storage_manager import StorageManager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import contextvars
 import datetime
+import functools
+import hashlib
 
 app = Flask(__name__)
 
-# Initialize managers
+MAX_VERIFY_PAGE_SIZE = 1000
+BATCH_MAX_ENTRIES = int(os.getenv("BATCH_MAX_ENTRIES", "5000"))
+
+# Fan-out mode: write to Firestore and Cloud Storage concurrently
+FANOUT_WRITES = os.getenv("FANOUT_WRITES", "").lower() in ("1", "true", "yes")
+REQUEST_BUDGET = float(os.getenv("REQUEST_BUDGET_MS", "10000")) / 1000
+FIRESTORE_TIMEOUT = float(os.getenv("FIRESTORE_TIMEOUT_MS", "5000")) / 1000
+STORAGE_TIMEOUT = float(os.getenv("STORAGE_TIMEOUT_MS", "5000")) / 1000
+
+def _new_fanout_executor():
+    return ThreadPoolExecutor(max_workers=int(os.getenv("FANOUT_WORKERS", "16")), thread_name_prefix="fanout")
+
+_fanout_executor = _new_fanout_executor()
+
+def _reset_after_fork():
+    # Worker threads don't survive fork(); give each gunicorn worker its own pool.
+    global _fanout_executor
+    _fanout_executor = _new_fanout_executor()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Opt-in admission control for index(): cap concurrent backend work and shed load early
+# instead of letting every server thread block on a slow backend. Defaults are derived
+# from the gunicorn thread count so that limit + queue never exceeds the threads.
+ADMISSION = None
+if os.getenv("ADMISSION_CONTROL", "").lower() in ("1", "true", "yes"):
+    _threads = int(os.getenv("GUNICORN_THREADS", "8"))
+    _queue = int(os.getenv("ADMISSION_QUEUE", max(1, _threads // 4)))
+    _max_limit = int(os.getenv("ADMISSION_MAX_LIMIT", max(1, _threads - _queue)))
+    ADMISSION = AdmissionController(
+        limit=int(os.getenv("ADMISSION_LIMIT", _max_limit)),
+        min_limit=int(os.getenv("ADMISSION_MIN_LIMIT", "1")),
+        max_limit=_max_limit,
+        max_queue=_queue,
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "1000")) / 1000,
+        adaptive=os.getenv("ADMISSION_ADAPTIVE", "true").lower() in ("1", "true", "yes"),
+        target_latency=float(os.getenv("ADMISSION_TARGET_LATENCY_MS", "1000")) / 1000,
+    )
+
+# On-demand profiling of index(): a PROFILE_SAMPLE_RATE percentage of requests, or any
+# request with "X-Profile-Token: $PROFILE_TOKEN". Not installed at all unless configured.
+PROFILER = profiling.Profiler(
+    directory=os.getenv("PROFILE_DIR", "/tmp/profiles"),
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    token=os.getenv("PROFILE_TOKEN"),
+    mode=os.getenv("PROFILE_MODE", "sample"),
+    max_files=int(os.getenv("PROFILE_MAX_FILES", "200")),
+    interval=float(os.getenv("PROFILE_INTERVAL_MS", "1")) / 1000,
+) if os.getenv("PROFILE_SAMPLE_RATE") or os.getenv("PROFILE_TOKEN") else None
+if PROFILER is not None:
+    app.wsgi_app = profiling.WSGIMiddleware(
+        app.wsgi_app, PROFILER, paths=os.getenv("PROFILE_PATHS", "/").split(","))
+
+# Initialize managers (clients are created lazily on first use, see warm_up())
 firestore_mgr = FirestoreManager()
 storage_mgr = StorageManager()
 
+def _warm_up():
+    # Build both clients (and check the bucket) off the request path.
+    for mgr in (firestore_mgr, storage_mgr):
+        try:
+            mgr.warm_up()
+        except Exception as e:
+            print(f"[ColdStart] Warm-up of {type(mgr).__name__} failed: {e}")
+
+REQUEST_LATENCY = metrics.REGISTRY.histogram(
+    "http_request_duration_seconds", "Request latency by route, method and status.", ("route", "method", "status"))
+REQUESTS_IN_FLIGHT = metrics.REGISTRY.gauge("http_requests_in_flight", "Requests currently being served.")
+metrics.REGISTRY.gauge("firestore_write_queue_depth", "Firestore writes waiting for a batch commit.",
+                       callback=lambda: firestore_mgr.queue_depth())
+metrics.REGISTRY.gauge("storage_segment_backlog", "Log entries in segments not yet uploaded (open, full or awaiting retry).",
+                       callback=lambda: storage_mgr.segment_backlog())
+FANOUT_PENDING = metrics.REGISTRY.gauge("fanout_queue_depth", "Fan-out backend writes submitted and not yet finished.")
+ADMISSION_REJECTED = metrics.REGISTRY.counter(
+    "admission_rejected_total", "Requests shed by admission control, by reason.", ("reason",))
+if ADMISSION is not None:
+    metrics.REGISTRY.gauge("admission_limit", "Current admission concurrency limit.",
+                           callback=lambda: ADMISSION.limit)
+    metrics.REGISTRY.gauge("admission_queue_depth", "Requests waiting for an admission slot.",
+                           callback=lambda: ADMISSION.stats()["waiting"])
+metrics.REGISTRY.gauge("coldstart_phase_seconds", "Cold-start phase durations of this instance.", ("phase",),
+                       callback=lambda: {(phase,): ms / 1000 for phase, ms in coldstart.snapshot()["phases_ms"].items()})
+
+@app.before_request
+def _track_first_request():
+    coldstart.mark_first_request()
+    g.request_started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+@app.after_request
+def _record_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def _record_request_latency(exc):
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    REQUESTS_IN_FLIGHT.dec()
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUEST_LATENCY.observe(time.perf_counter() - started, route=route, method=request.method,
+                            status=g.pop("response_status", 500))
+
+def _write_firestore(name, timestamp):
+    doc_id = firestore_mgr.add_log("access_logs", {
+        "name": name,
+        "timestamp": timestamp,
+        "source": "GCP Cloud Run"
+    })
+    return f"Written to collection 'access_logs' with ID: {doc_id}"
+
+def _write_storage(name, timestamp):
+    file_content = f"Log Entry:\nName: {name}\nTime: {timestamp}\n"
+    filename = storage_mgr.upload_log(file_content)
+    return f"Uploaded file: {filename}"
+
+def _fan_out(writes):
+    """
+    Runs independent backend writes concurrently on the shared executor.
+    `writes` maps action name -> (callable, timeout in seconds). Each write is bounded by
+    its own timeout and by the overall request budget; a write that times out keeps
+    running in the background but is reported as failed. Under admission control each
+    write holds the request's slot until it finishes, so abandoned writes still count
+    against the limit.
+    """
+    started = time.monotonic()
+    if profiling.active():
+        # Attribute the writes' backend stages to the profiled request.
+        writes = {action: (functools.partial(contextvars.copy_context().run, fn), timeout)
+                  for action, (fn, timeout) in writes.items()}
+    ticket = g.get("admission_ticket")
+    futures = {}
+    for action, (fn, timeout) in writes.items():
+        FANOUT_PENDING.inc()
+        try:
+            future = _fanout_executor.submit(fn)
+        except Exception:
+            FANOUT_PENDING.dec()
+            raise
+        future.add_done_callback(lambda _: FANOUT_PENDING.dec())
+        if ticket is not None:
+            ticket.hold_until(future)
+        futures[action] = (future, timeout)
+    actions = {}
+    for action, (future, timeout) in futures.items():
+        limit = min(timeout, REQUEST_BUDGET)
+        try:
+            actions[action] = future.result(timeout=max(0.0, started + limit - time.monotonic()))
+        except FutureTimeoutError:
+            actions[action] = f"Failed: timed out after {limit * 1000:.0f} ms"
+        except Exception as e:
+            actions[action] = f"Failed: {str(e)}"
+    return actions
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     """
     Simulates the Trigger. 
     Accepts a name/message, logs it to Firestore (DB) and Cloud Storage (File).
+    Sheds load with 429/503 + Retry-After when admission control is saturated.
+    """
+    return _admitted(_handle_index)
+
+def _admitted(handle):
+    """
+    Runs `handle()` (returning `(results, status)`) under admission control.
+    Any "Failed..." action in `results["actions"]` counts as a backend failure.
     """
+    if ADMISSION is None:
+        results, status = handle()
+        return jsonify(results), status
+    try:
+        ticket = ADMISSION.admit()
+    except AdmissionRejected as e:
+        ADMISSION_REJECTED.inc(reason=e.reason)
+        response = jsonify({"error": f"Service overloaded ({e.reason.replace('_', ' ')}), retry later."})
+        response.status_code = e.status
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    with ticket:
+        g.admission_ticket = ticket
+        results, status = handle()
+        if any(str(action).startswith("Failed") for action in results.get("actions", {}).values()):
+            ticket.mark_failed()
+    return jsonify(results), status
+
+def _handle_index():
     name = request.args.get("name", "Anonymous")
     
     timestamp = datetime.datetime.now().isoformat()
@@ -26,42 +217,219 @@ def index():
         "actions": {}
     }
 
+    if FANOUT_WRITES:
+        # Both writes are independent: latency follows the slower backend, not the sum.
+        results["actions"] = _fan_out({
+            "firestore": (lambda: _write_firestore(name, timestamp), FIRESTORE_TIMEOUT),
+            "storage": (lambda: _write_storage(name, timestamp), STORAGE_TIMEOUT),
+        })
+        return results, 200
+
     # 1. Write to Firestore (Database)
     try:
-        doc_id = firestore_mgr.add_log("access_logs", {
-            "name": name,
-            "timestamp": timestamp,
-            "source": "GCP Cloud Run"
-        })
-        results["actions"]["firestore"] = f"Written to collection 'access_logs' with ID: {doc_id}"
+        results["actions"]["firestore"] = _write_firestore(name, timestamp)
     except Exception as e:
         results["actions"]["firestore"] = f"Failed: {str(e)}"
 
     # 2. Write to Cloud Storage (File)
     try:
-        file_content = f"Log Entry:\nName: {name}\nTime: {timestamp}\n"
-        filename = storage_mgr.upload_log(file_content)
-        results["actions"]["storage"] = f"Uploaded file: {filename}"
+        results["actions"]["storage"] = _write_storage(name, timestamp)
     except Exception as e:
         results["actions"]["storage"] = f"Failed: {str(e)}"
 
-    return jsonify(results), 200
+    return results, 200
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    """
+    Bulk variant of "/": the body is NDJSON or a JSON array of entries, each an object
+    with a "name" (and optionally "message"). All entries go to Firestore in batched
+    commits and to Cloud Storage as one combined object. The body is parsed as it is
+    read under the admission ticket; more than BATCH_MAX_ENTRIES entries is rejected with 413.
+    Returns per-entry status (207 if some entries failed).
+    """
+    return _admitted(_handle_batch)
+
+def _handle_batch():
+    # Parsed under the admission ticket: reading a large body is part of the load it bounds.
+    entries, statuses = [], []
+    try:
+        for index, entry in enumerate(ingest.iter_entries(request.stream)):
+            if index >= BATCH_MAX_ENTRIES:
+                return {"error": f"Too many entries (max {BATCH_MAX_ENTRIES})."}, 413
+            if isinstance(entry, dict) and isinstance(entry.get("name"), str) and entry["name"]:
+                entries.append((index, entry))
+                statuses.append(None)
+            else:
+                statuses.append({"index": index, "status": "invalid",
+                                 "error": "Entry must be an object with a non-empty string 'name'."})
+    except ValueError as e:
+        return {"error": f"Malformed body: {e}"}, 400
+
+    timestamp = datetime.datetime.now().isoformat()
+    docs = [{
+        "name": entry["name"],
+        "message": entry.get("message"),
+        "timestamp": timestamp,
+        "source": "GCP Cloud Run"
+    } for _, entry in entries]
+    actions = {}
+
+    doc_ids = []
+    if docs:
+        try:
+            doc_ids = firestore_mgr.add_logs("access_logs", docs)
+            failed = sum(1 for result in doc_ids if isinstance(result, Exception))
+            actions["firestore"] = (f"Failed: {failed} of {len(docs)} writes" if failed
+                                    else f"Written {len(docs)} documents to 'access_logs'")
+        except Exception as e:
+            doc_ids = [e] * len(docs)
+            actions["firestore"] = f"Failed: {str(e)}"
+
+        try:
+            filename = storage_mgr.upload_logs([app.json.dumps(doc) for doc in docs])
+            actions["storage"] = f"Uploaded file: {filename}"
+        except Exception as e:
+            filename = None
+            actions["storage"] = f"Failed: {str(e)}"
+
+    for (index, _), result in zip(entries, doc_ids):
+        status = {"index": index, "status": "ok", "firestore_id": result}
+        if isinstance(result, Exception):
+            status = {"index": index, "status": "error", "error": str(result)}
+        elif filename is None:
+            status["status"] = "partial"
+        statuses[index] = status
+
+    accepted = sum(1 for status in statuses if status["status"] == "ok")
+    results = {
+        "accepted": accepted,
+        "rejected": len(statuses) - accepted,
+        "actions": actions,
+        "entries": statuses
+    }
+    return results, (200 if accepted == len(statuses) else 207)
+
+def _parse_date(value):
+    return datetime.date.fromisoformat(value) if value else None
 
 @app.route("/verify", methods=["GET"])
 def verify():
     """
-    Helper endpoint to view what's in the DB/Storage
+    Helper endpoint to view what's in the DB/Storage.
+    Firestore logs are paged newest first with `logs_limit` / `logs_cursor`
+    (the response carries `next_logs_cursor`).
+    Optional query params: `prefix`, `start`/`end` (YYYY-MM-DD) to filter storage files.
+    With `max_results` (and `page_token`) one page is returned with a `next_page_token`;
+    otherwise all matching files are streamed page by page.
+    Responses carry an ETag; a matching If-None-Match gets 304 Not Modified.
     """
     try:
-        logs = firestore_mgr.get_logs("access_logs")
-        files = storage_mgr.list_files()
-        return jsonify({
-            "firestore_logs": logs,
-            "storage_files": files
-        })
+        logs_limit = max(1, min(int(request.args.get("logs_limit", 10)), MAX_VERIFY_PAGE_SIZE))
+        max_results = None
+        if "max_results" in request.args:
+            max_results = max(1, min(int(request.args["max_results"]), MAX_VERIFY_PAGE_SIZE))
+        start = _parse_date(request.args.get("start"))
+        end = _parse_date(request.args.get("end"))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+    prefix = request.args.get("prefix")
+
+    try:
+        logs, next_logs_cursor = firestore_mgr.get_logs_page(
+            "access_logs", logs_limit, request.args.get("logs_cursor"))
+
+        if max_results is not None:
+            files, next_token = storage_mgr.list_files_page(
+                prefix, request.args.get("page_token"), max_results, start, end)
+            response = jsonify({
+                "firestore_logs": logs,
+                "next_logs_cursor": next_logs_cursor,
+                "storage_files": files,
+                "next_page_token": next_token
+            })
+            response.add_etag()
+            return response.make_conditional(request)
+
+        # The streamed listing isn't buffered, so its ETag is derived from the logs page,
+        # the query and the storage listing version (manifest or segment index ETags) instead of the body.
+        listing_version = storage_mgr.listing_version(prefix, start, end)
+        etag = None
+        if listing_version is not None:
+            etag = hashlib.sha1(
+                f"{app.json.dumps(logs)}|{next_logs_cursor}|{request.query_string!r}|{listing_version}".encode("utf-8")
+            ).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    def generate():
+        # Same shape as the paged response, written incrementally so memory stays flat.
+        yield ('{"firestore_logs": ' + app.json.dumps(logs)
+               + ', "next_logs_cursor": ' + app.json.dumps(next_logs_cursor) + ', "storage_files": [')
+        first = True
+        try:
+            for page in storage_mgr.iter_file_pages(prefix, start, end, MAX_VERIFY_PAGE_SIZE):
+                chunk = ", ".join(app.json.dumps(name) for name in page)
+                yield chunk if first else ", " + chunk
+                first = False
+        except Exception as e:
+            print(f"[verify] Error listing blobs: {e}")
+        yield "]}"
+
+    response = Response(stream_with_context(generate()), mimetype="application/json")
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Prometheus text exposition of the in-process metrics registry.
+    """
+    return Response(metrics.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+@app.route("/admission", methods=["GET"])
+def admission_stats():
+    """
+    Current admission limit, queue and shed counts of this instance.
+    """
+    return jsonify(ADMISSION.stats() if ADMISSION is not None else {"enabled": False})
+
+@app.route("/coldstart", methods=["GET"])
+def coldstart_metrics():
+    """
+    Cold-start breakdown of this instance: import, client construction and bucket check.
+    """
+    return jsonify(coldstart.snapshot())
+
+coldstart.record("import", time.monotonic() - _import_started)
+
+def start_warm_up():
+    if os.getenv("WARMUP_ON_START", "").lower() in ("1", "true", "yes"):
+        threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+def shutdown():
+    """
+    Flushes queued writes and closes clients of this process (gunicorn worker_exit hook).
+    """
+    _fanout_executor.shutdown(wait=True)
+    for mgr in (firestore_mgr, storage_mgr):
+        try:
+            mgr.shutdown()
+        except Exception as e:
+            print(f"[Shutdown] {type(mgr).__name__}: {e}")
+
+# With gunicorn --preload this module is imported in the master; clients built there
+# would be dropped after fork, so gunicorn.conf.py warms up each worker in post_fork.
+if os.getenv("WARMUP_AFTER_FORK", "").lower() not in ("1", "true", "yes"):
+    start_warm_up()
+
 if __name__ == "__main__":
     # Cloud Run injects PORT environment variable
     port = int(os.environ.get("PORT", 8080))
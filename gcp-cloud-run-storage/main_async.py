@@ -0,0 +1,271 @@
+import time
+_import_started = time.monotonic()
+
+import os
+import json
+import asyncio
+import datetime
+import email.utils
+import hashlib
+from contextlib import asynccontextmanager
+from Shared import coldstart
+from Shared import metrics
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from Shared.firestore_manager import FirestoreManager, InvalidCursor
+from Shared.storage_manager import StorageManager
+
+# ASGI variant of main.py: same routes, but backend I/O never blocks a server thread,
+# so one process can keep hundreds of requests in flight. Run with:
+#   uvicorn main_async:app --host 0.0.0.0 --port $PORT
+
+MAX_VERIFY_PAGE_SIZE = 1000
+
+REQUEST_BUDGET = float(os.getenv("REQUEST_BUDGET_MS", "10000")) / 1000
+FIRESTORE_TIMEOUT = float(os.getenv("FIRESTORE_TIMEOUT_MS", "5000")) / 1000
+STORAGE_TIMEOUT = float(os.getenv("STORAGE_TIMEOUT_MS", "5000")) / 1000
+
+# Initialize managers (clients are created lazily on first use)
+firestore_mgr = FirestoreManager()
+storage_mgr = StorageManager()
+
+REQUEST_LATENCY = metrics.REGISTRY.histogram(
+    "http_request_duration_seconds", "Request latency by route, method and status.", ("route", "method", "status"))
+REQUESTS_IN_FLIGHT = metrics.REGISTRY.gauge("http_requests_in_flight", "Requests currently being served.")
+metrics.REGISTRY.gauge("storage_segment_backlog", "Log entries in segments not yet uploaded (open, full or awaiting retry).",
+                       callback=lambda: storage_mgr.segment_backlog())
+metrics.REGISTRY.gauge("coldstart_phase_seconds", "Cold-start phase durations of this instance.", ("phase",),
+                       callback=lambda: {(phase,): ms / 1000 for phase, ms in coldstart.snapshot()["phases_ms"].items()})
+
+
+def _json_default(value):
+    # Match Flask's JSON provider: datetimes (e.g. Firestore timestamps) as HTTP dates.
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return email.utils.format_datetime(value.astimezone(datetime.timezone.utc), usegmt=True)
+    if isinstance(value, datetime.date):
+        return email.utils.format_datetime(
+            datetime.datetime.combine(value, datetime.time(), datetime.timezone.utc), usegmt=True)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps(value):
+    return json.dumps(value, default=_json_default)
+
+
+def _json(value, status_code=200, headers=None):
+    return Response(_dumps(value), status_code=status_code, headers=headers, media_type="application/json")
+
+
+def _etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/").strip('"') == etag for tag in tags)
+
+
+async def _bounded(action, timeout):
+    """
+    Awaits one backend write; a timeout or error is reported as a "Failed: ..." action.
+    """
+    try:
+        return await asyncio.wait_for(action, timeout)
+    except asyncio.TimeoutError:
+        return f"Failed: timed out after {timeout * 1000:.0f} ms"
+    except Exception as e:
+        return f"Failed: {str(e)}"
+
+
+async def _write_firestore(name, timestamp):
+    doc_id = await firestore_mgr.add_log_async("access_logs", {
+        "name": name,
+        "timestamp": timestamp,
+        "source": "GCP Cloud Run"
+    })
+    return f"Written to collection 'access_logs' with ID: {doc_id}"
+
+
+async def _write_storage(name, timestamp):
+    file_content = f"Log Entry:\nName: {name}\nTime: {timestamp}\n"
+    filename = await storage_mgr.upload_log_async(file_content)
+    return f"Uploaded file: {filename}"
+
+
+async def index(request):
+    """
+    Simulates the Trigger.
+    Accepts a name/message, logs it to Firestore (DB) and Cloud Storage (File) concurrently.
+    """
+    name = request.query_params.get("name", "Anonymous")
+
+    timestamp = datetime.datetime.now().isoformat()
+    message = f"Hello, {name}. Processed at {timestamp}."
+
+    firestore_result, storage_result = await asyncio.gather(
+        _bounded(_write_firestore(name, timestamp), min(FIRESTORE_TIMEOUT, REQUEST_BUDGET)),
+        _bounded(_write_storage(name, timestamp), min(STORAGE_TIMEOUT, REQUEST_BUDGET)),
+    )
+    return _json({
+        "message": message,
+        "actions": {"firestore": firestore_result, "storage": storage_result}
+    })
+
+
+def _parse_date(value):
+    return datetime.date.fromisoformat(value) if value else None
+
+
+async def verify(request):
+    """
+    Helper endpoint to view what's in the DB/Storage (same parameters and response as main.verify).
+    """
+    args = request.query_params
+    try:
+        logs_limit = max(1, min(int(args.get("logs_limit", 10)), MAX_VERIFY_PAGE_SIZE))
+        max_results = None
+        if "max_results" in args:
+            max_results = max(1, min(int(args["max_results"]), MAX_VERIFY_PAGE_SIZE))
+        start = _parse_date(args.get("start"))
+        end = _parse_date(args.get("end"))
+    except ValueError as e:
+        return _json({"error": f"Invalid query parameter: {e}"}, status_code=400)
+    prefix = args.get("prefix")
+
+    try:
+        logs, next_logs_cursor = await firestore_mgr.get_logs_page_async(
+            "access_logs", logs_limit, args.get("logs_cursor"))
+
+        if max_results is not None:
+            files, next_token = await storage_mgr.list_files_page_async(
+                prefix, args.get("page_token"), max_results, start, end)
+            body = _dumps({
+                "firestore_logs": logs,
+                "next_logs_cursor": next_logs_cursor,
+                "storage_files": files,
+                "next_page_token": next_token
+            })
+            etag = hashlib.sha1(body.encode("utf-8")).hexdigest()
+            if _etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": f'"{etag}"'})
+            return Response(body, media_type="application/json", headers={"ETag": f'"{etag}"'})
+
+        # The streamed listing isn't buffered, so its ETag is derived from the logs page,
+        # the query and the storage listing version (manifest or segment index ETags) instead of the body.
+        listing_version = await storage_mgr.listing_version_async(prefix, start, end)
+        etag = None
+        if listing_version is not None:
+            etag = hashlib.sha1(
+                f"{_dumps(logs)}|{next_logs_cursor}|{request.url.query.encode()!r}|{listing_version}".encode("utf-8")
+            ).hexdigest()
+            if _etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": f'"{etag}"'})
+    except InvalidCursor as e:
+        return _json({"error": str(e)}, status_code=400)
+    except Exception as e:
+        return _json({"error": str(e)}, status_code=500)
+
+    async def generate():
+        # Same shape as the paged response, written incrementally so memory stays flat.
+        yield ('{"firestore_logs": ' + _dumps(logs)
+               + ', "next_logs_cursor": ' + _dumps(next_logs_cursor) + ', "storage_files": [')
+        first = True
+        try:
+            async for page in storage_mgr.iter_file_pages_async(prefix, start, end, MAX_VERIFY_PAGE_SIZE):
+                chunk = ", ".join(_dumps(name) for name in page)
+                yield chunk if first else ", " + chunk
+                first = False
+        except Exception as e:
+            print(f"[verify] Error listing blobs: {e}")
+        yield "]}"
+
+    headers = {"ETag": f'"{etag}"'} if etag is not None else None
+    return StreamingResponse(generate(), media_type="application/json", headers=headers)
+
+
+async def metrics_endpoint(request):
+    """
+    Prometheus text exposition of the in-process metrics registry.
+    """
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+async def coldstart_metrics(request):
+    """
+    Cold-start breakdown of this instance: import, client construction and bucket check.
+    """
+    return JSONResponse(coldstart.snapshot())
+
+
+class RequestMetrics:
+    """
+    ASGI middleware: request latency histogram and in-flight gauge (same series as main.py).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        coldstart.mark_first_request()
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            path = scope["path"]
+            REQUEST_LATENCY.observe(time.perf_counter() - started,
+                                    route=path if path in ROUTE_PATHS else "unmatched",
+                                    method=scope["method"], status=status["code"])
+
+
+async def _warm_up():
+    # Build the clients (and check the bucket) off the request path.
+    try:
+        firestore_mgr._get_async_client()
+        await storage_mgr.listing_version_async()
+    except Exception as e:
+        print(f"[ColdStart] Warm-up failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    warm_up = None
+    if os.getenv("WARMUP_ON_START", "").lower() in ("1", "true", "yes"):
+        warm_up = asyncio.get_running_loop().create_task(_warm_up())
+    yield
+    if warm_up is not None:
+        warm_up.cancel()
+    # Upload the open segment and close the clients; the AsyncClient is closed on this loop.
+    await firestore_mgr.shutdown_async()
+    await asyncio.get_running_loop().run_in_executor(None, storage_mgr.shutdown)
+
+
+routes = [
+    Route("/", index, methods=["GET", "POST"]),
+    Route("/verify", verify, methods=["GET"]),
+    Route("/metrics", metrics_endpoint, methods=["GET"]),
+    Route("/coldstart", coldstart_metrics, methods=["GET"]),
+]
+ROUTE_PATHS = {route.path for route in routes}
+
+app = Starlette(routes=routes, lifespan=lifespan)
+app.add_middleware(RequestMetrics)
+
+coldstart.record("import", time.monotonic() - _import_started)
+
+if __name__ == "__main__":
+    import uvicorn
+    # Cloud Run injects PORT environment variable
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
@@ -2,6 +2,10 @@ import pyodbc
 import sys
 import os
 
+# The migrations live with the Function App code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "azure-function-sql-trigger"))
+from Shared import migrations
+
 # Cloud Connection String
 # Requires 'SQL_PASSWORD' environment variable
 password = os.environ.get("SQL_PASSWORD")
@@ -14,20 +18,12 @@ CONN_STR = f"Driver={{ODBC Driver 18 for SQL Server}};Server=tcp:alexbeginner.da
 def init_cloud_db():
     print("Connecting to Cloud DB 'alexbeginner'...")
     try:
-        conn = pyodbc.connect(CONN_STR, autocommit=True)
-        cursor = conn.cursor()
-        
-        # Create Table
-        print("Checking for 'AccessLogs' table...")
-        cursor.execute("""
-            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='AccessLogs' AND xtype='U')
-            CREATE TABLE AccessLogs (
-                Id INT IDENTITY(1,1) PRIMARY KEY,
-                [User] NVARCHAR(100),
-                Timestamp DATETIME DEFAULT GETDATE()
-            )
-        """)
-        print("[PASS] Table 'AccessLogs' created successfully in the Cloud.")
+        conn = pyodbc.connect(CONN_STR)
+        print(f"Schema version: {migrations.current_version(conn)}")
+        applied = migrations.migrate(conn)
+        for version in applied:
+            print(f"[PASS] Applied migration {version}.")
+        print(f"[PASS] Table 'AccessLogs' is ready in the Cloud (schema version {migrations.current_version(conn)}).")
         
         conn.close()
     except Exception as e: